@@ -3,6 +3,8 @@
 # ===== Default imports =====
 
 import asyncio
+from datetime import datetime, timedelta
+import io
 import logging
 import time
 
@@ -10,29 +12,40 @@ import time
 
 from aiogram import Bot, Dispatcher, types
 from aiogram.dispatcher import FSMContext
-from aiogram.utils import exceptions
 
 # ===== Local imports =====
 
 from analytics import BotAnalytics
+from broadcast import BroadcastEngine, MailingLedger
 from antiflood import VocabularyBotAntifloodMiddleware
 from db_manager import DbManager
 from lang_manager import LangManager
 from markups_manager import MarkupManager
+from sampling_profiler import ProfilerBusyError, SamplingProfiler
+from scheduler import Scheduler
 from states.Mailing import AdminMailingState
+import translation
 
 
 class AdminManager:
     """Class for working with admin functions"""
 
+    ACTIVE_USERS_DAYS = (1, 7, 30)  # DAU, WAU, MAU
+    FEATURE_USERS_LIMIT = 10
+    PROFILE_SECONDS = 10  # Default /profile duration
+
     def __init__(self, bot: Bot, db_manager: DbManager, lang_manager: LangManager, markup_manager: MarkupManager,
-                 dispatcher: Dispatcher, analytics: BotAnalytics):
+                 dispatcher: Dispatcher, analytics: BotAnalytics, scheduler: Scheduler):
         self.bot = bot
         self.dp = dispatcher
         self.db = db_manager
         self.lang = lang_manager
         self.markup = markup_manager
         self.analytics = analytics
+        self.scheduler = scheduler
+        self.broadcaster = BroadcastEngine(self.bot)
+        self.profiler = SamplingProfiler()
+        self.tasks = set()  # Background tasks (mailings), referenced until done
         self.permissions = self.db.get_permissions_list()
         self.__init_message_handlers()
 
@@ -68,6 +81,63 @@ class AdminManager:
                 delta = time.time() - start_time
                 await message.edit_text(text=f'Pong! *(reply took {delta:.2f}s)*', parse_mode='Markdown')
 
+        @self.dp.message_handler(commands=['profile'], state='*')
+        @VocabularyBotAntifloodMiddleware.rate_limit(1, 'profile')
+        @self.analytics.default_metric
+        async def profile_command_message_handler(message: types.Message):
+            if self.db.is_admin(message['from']['id']):
+                args = message.get_args()
+                seconds = min(int(args) if args.isdigit() and int(args) > 0 else self.PROFILE_SECONDS,
+                              SamplingProfiler.MAX_SECONDS)
+                if self.profiler.running:
+                    await message.reply('Profiling is already running')
+                    return
+                await message.reply(f'Profiling for {seconds}s...')
+                # Sampling runs in background, so the admin chat queue isn't held by the handler
+                self.run_in_background(self.send_profile(message.chat.id, seconds), 'profile')
+
+        @self.dp.message_handler(commands=['jobs'], state='*')
+        @VocabularyBotAntifloodMiddleware.rate_limit(1, 'jobs')
+        @self.analytics.default_metric
+        async def jobs_command_message_handler(message: types.Message):
+            if self.db.is_admin(message['from']['id']):
+                await message.answer(text=self.get_jobs_page(), parse_mode='Markdown')
+
+        @self.dp.message_handler(commands=['limits'], state='*')
+        @VocabularyBotAntifloodMiddleware.rate_limit(1, 'limits')
+        @self.analytics.default_metric
+        async def limits_command_message_handler(message: types.Message):
+            if self.db.is_admin(message['from']['id']):
+                await message.answer(text=self.get_limits_page(), parse_mode='Markdown')
+
+        @self.dp.message_handler(commands=['queues'], state='*')
+        @VocabularyBotAntifloodMiddleware.rate_limit(1, 'queues')
+        @self.analytics.default_metric
+        async def queues_command_message_handler(message: types.Message):
+            if self.db.is_admin(message['from']['id']):
+                await message.answer(text=self.get_queues_page(), parse_mode='Markdown')
+
+        @self.dp.message_handler(commands=['queries'], state='*')
+        @VocabularyBotAntifloodMiddleware.rate_limit(1, 'queries')
+        @self.analytics.default_metric
+        async def queries_command_message_handler(message: types.Message):
+            if self.db.is_admin(message['from']['id']):
+                await message.answer(text=self.get_queries_page(), parse_mode='Markdown')
+
+        @self.dp.message_handler(commands=['traffic'], state='*')
+        @VocabularyBotAntifloodMiddleware.rate_limit(1, 'traffic')
+        @self.analytics.default_metric
+        async def traffic_command_message_handler(message: types.Message):
+            if self.db.is_admin(message['from']['id']):
+                await message.answer(text=self.get_traffic_page(), parse_mode='Markdown')
+
+        @self.dp.message_handler(commands=['trending'], state='*')
+        @VocabularyBotAntifloodMiddleware.rate_limit(1, 'trending')
+        @self.analytics.default_metric
+        async def trending_command_message_handler(message: types.Message):
+            if self.db.is_admin(message['from']['id']):
+                await message.answer(text=self.get_trending_page(), parse_mode='Markdown')
+
         # IF ADMIN PANEL -> USERS
         @self.dp.message_handler(lambda message: message.text == self.lang.get_page_text('ADMIN', 'BUTTONS',
                                                                                          self.lang.parse_user_lang(
@@ -76,7 +146,9 @@ class AdminManager:
         @self.analytics.default_metric
         async def admin_users_command_handler(message: types.Message):
             user_lang = self.lang.parse_user_lang(message['from']['id'])
-            await message.answer(text=self.lang.get_admin_users_page(user_lang))
+            active_users = [self.analytics.get_unique_users(days) for days in self.ACTIVE_USERS_DAYS]
+            feature_users = self.analytics.get_feature_unique_users(7)[:self.FEATURE_USERS_LIMIT]
+            await message.answer(text=self.lang.get_admin_users_page(user_lang, active_users, feature_users))
 
         # IF ADMIN PANEL -> MAILINGS
         @self.dp.message_handler(lambda message: message.text == self.lang.get_page_text('ADMIN', 'BUTTONS',
@@ -108,8 +180,8 @@ class AdminManager:
                 data['confirmation'] = message.text == confirmation_options[0]
             if data['confirmation']:
                 await message.answer(text=self.lang.get_page_text('MAILINGS', 'SUCCESSFUL', user_lang))
-                await self.broadcast(self.db.get_broadcast_users(), data['message'], message['from']['id'],
-                                     notification=True)
+                self.run_in_background(self.broadcast(data['message'], message['from']['id'], notification=True),
+                                       'mailing')
             else:
                 await message.answer(text=self.lang.get_page_text('MAILINGS', 'CANCELED', user_lang))
             await state.finish()
@@ -154,36 +226,132 @@ class AdminManager:
         admin_permission_level = self.db.get_admin_permission_level(user_id) - 1
         return self.permissions[admin_permission_level]
 
-    async def __send_mailing(self, user_id: int, text: str, disable_notification: bool = False) -> bool:
-        """Safe messages sender"""
+    def get_jobs_page(self) -> str:
+        """Scheduler jobs runtime info for admins"""
+        jobs_page = '*Scheduler jobs*\n'
+        for name, last_run, last_duration, last_status, next_run, runs, failures in self.scheduler.get_jobs_info():
+            jobs_page += f'\n`{name}`: '
+            if last_run is not None:
+                jobs_page += f'last run {datetime.fromtimestamp(last_run).strftime("%d.%m.%Y %H:%M:%S")} ' \
+                             f'({last_status}, took {last_duration:.2f}s)'
+            else:
+                jobs_page += 'never run'
+            if next_run is not None and next_run != float('inf'):
+                jobs_page += f', next run {datetime.fromtimestamp(next_run).strftime("%H:%M:%S")}'
+            elif next_run == float('inf'):
+                jobs_page += ', running now'
+            jobs_page += f' [runs: {runs}, failures: {failures}]'
+        return jobs_page
+
+    def get_limits_page(self) -> str:
+        """Outgoing Bot API requests governor stats for admins"""
+        governor = getattr(self.bot, 'governor', None)
+        if governor is None:
+            return 'Rate governor is disabled'
+        stats = governor.stats()
+        limits_page = f'*Rate governor*\n\nChat buckets: {stats["chat_buckets"]}\n'
+        for lane, lane_stats in stats['lanes'].items():
+            limits_page += f'\n`{lane}`: queue {lane_stats["queue_depth"]}, granted {lane_stats["granted"]}, ' \
+                           f'wait avg {lane_stats["wait_avg"] * 1000:.1f}ms, max {lane_stats["wait_max"] * 1000:.1f}ms'
+        return limits_page
+
+    def get_queues_page(self) -> str:
+        """Per-chat updates queues stats by shards for admins"""
+        if not hasattr(self.dp, 'queue_stats'):
+            return 'Ordered dispatcher is disabled'
+        queues_page = '*Updates queues*\n'
+        for shard in self.dp.queue_stats():
+            queues_page += f'\n`{shard["shard"]:>2}`: chats {shard["chats"]}, queued {shard["queued"]}, ' \
+                           f'lag {shard["lag"] * 1000:.0f}ms, processed {shard["processed"]}, ' \
+                           f'wait avg {shard["wait_avg"] * 1000:.1f}ms, max {shard["wait_max"] * 1000:.1f}ms'
+        return queues_page
+
+    def get_queries_page(self, limit: int = 10) -> str:
+        """SQL statements with the biggest total time for admins"""
+        if self.db.profiler is None:
+            return 'Query profiler is disabled'
+        queries_page = '*SQL statements by total time*\n'
+        for statement, stats in self.db.profiler.top(limit):
+            queries_page += f'\n`{statement[:200].replace("`", "")}`\ncount {stats.count}, ' \
+                            f'total {stats.total * 1000:.0f}ms, max {stats.max * 1000:.1f}ms, rows {stats.rows}\n'
+        return queries_page
+
+    def get_traffic_page(self, days: int = 14, hours: int = 24) -> str:
+        """Handler calls per day and per hour (UTC) from analytics rollups for admins"""
+        now = time.time()
+        since_day = (datetime.utcfromtimestamp(now) - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        traffic_page = '*Handler calls by day*\n'
+        for day, count in self.db.get_daily_traffic(since_day):
+            traffic_page += f'\n`{day}`: {count}'
+        traffic_page += '\n\n*Handler calls by hour*\n'
+        for hour, count in self.db.get_hourly_traffic(now - hours * 60 * 60):
+            traffic_page += f'\n`{datetime.utcfromtimestamp(hour).strftime("%d.%m %H:00")}`: {count}'
+        return traffic_page
+
+    def get_trending_page(self, k: int = 15) -> str:
+        """Most added and searched words (recent days weigh more) for admins. Words missing in the offline
+        lexicon are marked, they are candidates for the next lexicon build"""
+        trending_page = ''
+        for kind in self.analytics.trends.KINDS:
+            trending_page += f'*Most {kind} words*\n'
+            for word, from_lang, to_lang, count in self.analytics.trends.top(kind, k):
+                missing = ' (not in lexicon)' if translation.lexicon_translate(word, from_lang, to_lang) is None else ''
+                trending_page += f'\n`{word.replace("`", "")}` {from_lang}-{to_lang}: {count}{missing}'
+            trending_page += '\n\n'
+        return trending_page.strip()
+
+    async def send_profile(self, chat_id: int, seconds: int) -> None:
+        """Sample the bot for seconds and send collapsed stacks (flamegraph.pl, speedscope) as a document"""
         try:
-            await self.bot.send_message(user_id, text, disable_notification=disable_notification)
-        except exceptions.BotBlocked:
-            logging.getLogger(type(self).__name__ + ':BROADCAST').error(f"Target [ID:{user_id}]: blocked by user")
-        except exceptions.ChatNotFound:
-            logging.getLogger(type(self).__name__ + ':BROADCAST').error(f"Target [ID:{user_id}]: invalid user ID")
-        except exceptions.RetryAfter as e:
-            logging.getLogger(type(self).__name__ + ':BROADCAST').error(
-                f"Target [ID:{user_id}]: Flood limit is exceeded. Sleep {e.timeout} seconds.")
-            await asyncio.sleep(e.timeout)
-            return await self.__send_mailing(user_id, text)  # Recursive call
-        except exceptions.UserDeactivated:
-            logging.getLogger(type(self).__name__ + ':BROADCAST').error(f"Target [ID:{user_id}]: user is deactivated")
-        except exceptions.TelegramAPIError:
-            logging.getLogger(type(self).__name__ + ':BROADCAST').exception(f"Target [ID:{user_id}]: failed")
-        else:
-            logging.getLogger(type(self).__name__ + ':BROADCAST').info(f"Target [ID:{user_id}]: success")
-            return True
-        return False
-
-    async def broadcast(self, user_ids: list, text: str, admin_id: int, notification: bool = False) -> None:
-        """Simple mass messaging mechanism (20 messages per second, the limit - 30/sec)"""
-        count = 0
+            stacks = await self.profiler.profile(seconds)
+        except ProfilerBusyError as error:
+            await self.bot.send_message(chat_id, str(error))
+            return
+        samples = sum(stacks.values())
+        summary = '\n'.join(f'{handler}: {count / samples:.0%}'
+                             for handler, count in SamplingProfiler.handlers_summary(stacks)[:10])
+        document = types.InputFile(io.BytesIO(SamplingProfiler.render(stacks).encode('utf-8')),
+                                   filename=f'profile-{time.strftime("%Y%m%d-%H%M%S")}.folded')
+        await self.bot.send_document(chat_id, document,
+                                     caption=f'{samples} samples in {seconds}s by handler:\n{summary}'[:1024])
+        logging.getLogger(type(self).__name__).info(f'Profile of {seconds}s sent [{samples} samples]')
+
+    def run_in_background(self, coroutine, name: str) -> asyncio.Task:
+        """Start task keeping a reference to it until it is done, so it isn't garbage collected, and log its error"""
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+
+        def done(finished_task: asyncio.Task) -> None:
+            self.tasks.discard(finished_task)
+            if not finished_task.cancelled() and finished_task.exception() is not None:
+                logging.getLogger(type(self).__name__).error(f'Background task [{name}] failed',
+                                                             exc_info=finished_task.exception())
+
+        task.add_done_callback(done)
+        return task
+
+    async def broadcast(self, text: str, admin_id: int, notification: bool = False, mailings: int = 2) -> None:
+        """Mass messaging to users with given mailings level at the Telegram API limit"""
+        job_id = self.db.add_mailing_job(admin_id, text, mailings, notification)
+        await self._run_mailing(job_id, admin_id, text, mailings, notification)
+
+    async def resume_mailings(self) -> None:
+        """Continue mailings interrupted by restart from their last checkpoint"""
+        for job_id, admin_id, text, mailings, notification, last_user_id in self.db.get_unfinished_mailing_jobs():
+            logging.getLogger(type(self).__name__).info(f'Resuming mailing [{job_id}] after user [{last_user_id}]')
+            self.run_in_background(self._run_mailing(job_id, admin_id, text, mailings, bool(notification),
+                                                     last_user_id), 'mailing')
+
+    async def _run_mailing(self, job_id: int, admin_id: int, text: str, mailings: int, notification: bool,
+                           last_user_id: int = 0) -> None:
+        ledger = MailingLedger(self.db, job_id, last_user_id)
         try:
-            for user_id in user_ids:
-                if await self.__send_mailing(user_id, text, disable_notification=notification):
-                    count += 1
-                await asyncio.sleep(.05)  # For message per second limit (20/s)
+            await self.broadcaster.broadcast(ledger.track(self.db.iter_mailing_recipients(job_id, mailings,
+                                                                                           last_user_id)),
+                                             lambda lang_code: self.lang.get_mailing_text(text, lang_code),
+                                             disable_notification=notification, on_delivered=ledger.delivered)
         finally:
-            await self.bot.send_message(admin_id, f'{count} messages successful sent.')
-            logging.getLogger(type(self).__name__).info(f'{count} messages successful sent.')
+            ledger.flush()
+        sent, failed = self.db.finish_mailing_job(job_id)
+        await self.bot.send_message(admin_id, f'{sent} messages successful sent.')
+        logging.getLogger(type(self).__name__).info(f'Mailing [{job_id}] finished: {sent} sent, {failed} failed.')
@@ -4,6 +4,7 @@
 
 import logging
 import functools
+import time
 
 # ===== External libs imports =====
 
@@ -13,50 +14,123 @@ from aiogram import types
 from aiogram.dispatcher import FSMContext
 
 from db_manager import DbManager
+from heavy_hitters import WordTrends
+from hyperloglog import HyperLogLog
+import metrics
 
 
 class BotAnalytics:
-    """Class for collecting bot usage analytics and other metrics"""
+    """Class for collecting bot usage analytics and other metrics.
+    Handler calls are buffered and appended to the analytics events log in batches, the log is folded into
+    hourly and daily counts by the rollup job. Unique users are counted with per-day HyperLogLog sketches
+    (all active users and users of every handler), merged into the database periodically"""
 
-    def __init__(self, db_manager: DbManager):
+    FLUSH_SIZE = 500  # Events
+    FLUSH_INTERVAL = 5  # Seconds
+    ACTIVE_SKETCH = 'active'
+
+    def __init__(self, db_manager: DbManager, worker_id: int = None):
         self.db = db_manager
+        self.trends = WordTrends(self.db, worker_id)  # Most added and searched words
+        self.metric_ids = {}
+        self.events = []
+        self._last_flush = time.monotonic()
+        self.sketches = {}  # (sketch name, UTC day) -> HyperLogLog
+        self.dirty_sketches = set()
 
     def default_metric(self, message_handler):
-        """Decorator for message handlers. Collects message data (user, handler) and stores in DB"""
+        """Decorator for message handlers. Collects message data (user, handler) and stores in DB, records handler
+        latency metrics"""
         @functools.wraps(message_handler)
-        def decorator(message: types.Message):
+        async def decorator(message: types.Message):
             self._log_message_handler(message_handler.__name__, message['from']['id'])
-            return message_handler(message)
+            return await metrics.timed_handler(message_handler.__name__, message_handler(message))
         return decorator
 
+    def _log_event(self, metric_name: str, user_id: int) -> None:
+        metric_id = self.metric_ids.get(metric_name)
+        if metric_id is None:
+            metric_id = self.metric_ids[metric_name] = self.db.get_metric_id(metric_name)
+        now = time.time()
+        self.events.append((metric_id, user_id, now))
+        day = time.strftime('%Y-%m-%d', time.gmtime(now))
+        for name in (self.ACTIVE_SKETCH, f'metric:{metric_name}'):
+            sketch = self.sketches.get((name, day))
+            if sketch is None:
+                sketch = self.sketches[(name, day)] = HyperLogLog()
+            if sketch.add(user_id):
+                self.dirty_sketches.add((name, day))
+        if len(self.events) >= self.FLUSH_SIZE or time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write buffered events to the database"""
+        self._last_flush = time.monotonic()
+        if self.events:
+            events, self.events = self.events, []
+            self.db.add_analytics_events(events)
+
+    def save_sketches(self) -> None:
+        """Merge changed sketches into the database. Sketches of previous days are dropped from memory"""
+        if self.dirty_sketches:
+            self.db.merge_hll_sketches({key: self.sketches[key] for key in self.dirty_sketches})
+            self.dirty_sketches.clear()
+        today = time.strftime('%Y-%m-%d', time.gmtime())
+        self.sketches = {key: sketch for key, sketch in self.sketches.items() if key[1] == today}
+
+    def get_unique_users(self, days: int, name: str = ACTIVE_SKETCH) -> int:
+        """Unique users for the last days (today is the first one), e.g. DAU, WAU and MAU for 1, 7 and 30 days"""
+        sketches = self._get_sketches(self._since(days), name)
+        return HyperLogLog.merged([registers for _, registers in sketches]).count()
+
+    def get_feature_unique_users(self, days: int) -> list:
+        """Unique users of every handler for the last days as (handler name, users) by users desc"""
+        features = {}
+        for name, registers in self._get_sketches(self._since(days)):
+            if name.startswith('metric:'):
+                features.setdefault(name[len('metric:'):], []).append(registers)
+        result = [(name, HyperLogLog.merged(sketches).count()) for name, sketches in features.items()]
+        return sorted(result, key=lambda feature: feature[1], reverse=True)
+
+    def _get_sketches(self, since_day: str, name: str = None) -> list:
+        """Stored sketches merged with unsaved ones of this worker. Nothing is saved here: the write transaction
+        would wait for other workers on the event loop, and merging a sketch twice doesn't change counts"""
+        local = [(key[0], sketch.to_bytes()) for key, sketch in self.sketches.items()
+                 if key[1] >= since_day and (name is None or key[0] == name)]
+        return self.db.get_hll_sketches(since_day, name) + local
+
+    @staticmethod
+    def _since(days: int) -> str:
+        return time.strftime('%Y-%m-%d', time.gmtime(time.time() - (days - 1) * 24 * 60 * 60))
+
     def _log_message_handler(self, handler_name: str, user_id: int) -> None:
-        self.db.log_default_metric(handler_name, user_id, self.db.get_metric_id(handler_name))
+        self._log_event(handler_name, user_id)
         logging.getLogger(type(self).__name__).info(f'[{user_id}] Analytics message handler executed [{handler_name}]')
 
     def callback_metric(self, callback_handler):
         """Decorator for callback handlers. Collects data (user, handler) and stores in DB"""
         @functools.wraps(callback_handler)
-        def decorator(query: types.CallbackQuery):
+        async def decorator(query: types.CallbackQuery):
             self._log_callback_handler(callback_handler.__name__, query['from']['id'])
-            return callback_handler(query)
+            return await metrics.timed_handler(callback_handler.__name__, callback_handler(query))
         return decorator
 
     def callback_fsm_metric(self, callback_handler):
         """Decorator for callback handlers with FSM. Collects data (user, handler) and stores in DB"""
         @functools.wraps(callback_handler)
-        def decorator(query: types.CallbackQuery, state: FSMContext):
+        async def decorator(query: types.CallbackQuery, state: FSMContext):
             self._log_callback_handler(callback_handler.__name__, query['from']['id'])
-            return callback_handler(query, state)
+            return await metrics.timed_handler(callback_handler.__name__, callback_handler(query, state))
         return decorator
 
     def _log_callback_handler(self, callback_name: str, user_id: int) -> None:
-        self.db.log_callback_metric(callback_name, user_id, self.db.get_metric_id(callback_name))
+        self._log_event(callback_name, user_id)
         logging.getLogger(type(self).__name__).info(
             f'[{user_id}] Analytics callback handler executed [{callback_name}]')
 
     def fsm_metric(self, message_handler):
         @functools.wraps(message_handler)
-        def decorator(message: types.Message, state: FSMContext):
+        async def decorator(message: types.Message, state: FSMContext):
             self._log_message_handler(message_handler.__name__, message['from']['id'])
-            return message_handler(message, state)
+            return await metrics.timed_handler(message_handler.__name__, message_handler(message, state))
         return decorator
@@ -4,103 +4,167 @@
 
 import asyncio
 import logging
+import math
+import time
 
 # ===== External libs imports =====
 
-from aiogram import Dispatcher, types
+from aiogram import types
 from aiogram.dispatcher.handler import CancelHandler, current_handler
 from aiogram.dispatcher.middlewares import BaseMiddleware
-from aiogram.utils.exceptions import Throttled
 
 # ===== Local imports =====
 
 from lang_manager import LangManager
 
 
+class TimerWheel:
+    """Hashed timer wheel. One ticking task serves all delayed callbacks instead of a sleeping coroutine per call"""
+
+    def __init__(self, tick: float = .5, slots: int = 256):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.position = 0
+        self.size = 0
+        self._task = None
+
+    def schedule(self, delay: float, callback, *args) -> None:
+        """Call coroutine function callback(*args) after delay (rounded up to the wheel tick)"""
+        rounds, offset = divmod(max(1, math.ceil(delay / self.tick)), len(self.slots))
+        if offset == 0:
+            rounds, offset = rounds - 1, len(self.slots)
+        self.slots[(self.position + offset) % len(self.slots)].append([rounds, callback, args])
+        self.size += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self) -> None:
+        while self.size > 0:
+            await asyncio.sleep(self.tick)
+            self.position = (self.position + 1) % len(self.slots)
+            due, pending = [], []
+            for timer in self.slots[self.position]:
+                if timer[0] == 0:
+                    due.append(timer)
+                else:
+                    timer[0] -= 1
+                    pending.append(timer)
+            self.slots[self.position] = pending
+            self.size -= len(due)
+            for _, callback, args in due:
+                asyncio.ensure_future(callback(*args))
+
+
 class VocabularyBotAntifloodMiddleware(BaseMiddleware):
+    """Antiflood for messages and callback queries. Every (user, key) pair has a token bucket, stored as compact
+    [tokens, last update, exceeded count, notice scheduled] list, idle entries are evicted periodically"""
 
-    def __init__(self, lang_manager: LangManager, limit=2, key_prefix='antiflood_'):
+    EVICTION_INTERVAL = 60
+
+    def __init__(self, lang_manager: LangManager, limit=2, key_prefix='antiflood_', callback_limit=.5,
+                 callback_burst=3):
         self.lang = lang_manager
         self.rate_limit = limit
         self.prefix = key_prefix
+        self.callback_rate_limit = callback_limit
+        self.callback_burst = callback_burst
+        self.buckets = {}
+        self.timers = TimerWheel()
+        self._last_eviction = time.monotonic()
         super(VocabularyBotAntifloodMiddleware, self).__init__()
 
     @staticmethod
-    def rate_limit(limit: int, key=None):
+    def rate_limit(limit: int, key=None, burst: int = 1):
         """
         Decorator for configuring rate limit and key in different functions.
 
-        :param limit:
+        :param limit: seconds to restore one allowed call
         :param key:
+        :param burst: calls allowed in a row
         :return:
         """
         def decorator(func):
             setattr(func, 'throttling_rate_limit', limit)
+            setattr(func, 'throttling_burst', burst)
             if key:
                 setattr(func, 'throttling_key', key)
             return func
         return decorator
 
-    async def on_process_message(self, message: types.Message, data: dict):
-        """
-        This handler is called when dispatcher receives a message
-
-        :param message:
-        """
-        # Get current handler
+    def _get_limits(self, default_limit: float, default_burst: int, default_key: str) -> tuple:
         handler = current_handler.get()
-
-        # Get dispatcher from context
-        dispatcher = Dispatcher.get_current()
-        # If handler was configured, get rate limit and key from handler
         if handler:
-            limit = getattr(handler, 'throttling_rate_limit', self.rate_limit)
+            limit = getattr(handler, 'throttling_rate_limit', default_limit)
+            burst = getattr(handler, 'throttling_burst', default_burst)
             key = getattr(handler, 'throttling_key', f"{self.prefix}_{handler.__name__}")
         else:
-            limit = self.rate_limit
-            key = f"{self.prefix}_message"
-
-        # Use Dispatcher.throttle method.
-        try:
-            await dispatcher.throttle(key, rate=limit)
-        except Throttled as t:
-            # Log the throttling issue
-            logging.getLogger(type(self).__name__).error(t)
-
-            # Execute action
-            await self.message_throttled(message, t)
-
-            # Cancel current handler
-            raise CancelHandler()
+            limit, burst, key = default_limit, default_burst, f"{self.prefix}_{default_key}"
+        return limit, burst, key
+
+    def _hit(self, user_id: int, key: str, limit: float, burst: int):
+        """Take token from (user, key) bucket. Returns None if call is allowed, otherwise bucket state"""
+        now = time.monotonic()
+        if now - self._last_eviction > self.EVICTION_INTERVAL:
+            self._evict(now)
+        bucket = self.buckets.get((user_id, key))
+        if bucket is None:
+            bucket = self.buckets[(user_id, key)] = [burst, now, 0, False, limit, burst]
+        bucket[0] = min(burst, bucket[0] + (now - bucket[1]) / limit) if limit > 0 else burst
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = 0
+            return None
+        bucket[2] += 1
+        return bucket
+
+    def _evict(self, now: float) -> None:
+        """Drop buckets which are full again and have no scheduled notice"""
+        self.buckets = {key: bucket for key, bucket in self.buckets.items()
+                        if bucket[3] or bucket[0] + (now - bucket[1]) / max(bucket[4], 1e-9) < bucket[5]}
+        self._last_eviction = now
 
-    async def message_throttled(self, message: types.Message, throttled: Throttled):
+    async def on_process_message(self, message: types.Message, data: dict):
         """
-        Notify user only on first exceed and notify about unlocking only on last exceed
+        This handler is called when dispatcher receives a message
 
         :param message:
-        :param throttled:
         """
-        handler = current_handler.get()
-        dispatcher = Dispatcher.get_current()
-        if handler:
-            key = getattr(handler, 'throttling_key', f"{self.prefix}_{handler.__name__}")
-        else:
-            key = f"{self.prefix}_message"
-
-        # Calculate how many time is left till the block ends
-        delta = throttled.rate - throttled.delta
-
-        # Prevent flooding
-        if throttled.exceeded_count <= 2:
-            user_lang = self.lang.parse_user_lang(message['from']['id'])
+        limit, burst, key = self._get_limits(self.rate_limit, 1, 'message')
+        bucket = self._hit(message.from_user.id, key, limit, burst)
+        if bucket is None:
+            return
+        logging.getLogger(type(self).__name__).error(f'Rate limit exceeded [{message.from_user.id}] [{key}]')
+        # Notify user only on first exceed and notify about unlocking only once, when the lock ends
+        if bucket[2] == 1:
+            user_lang = self.lang.parse_user_lang(message.from_user.id)
             await message.reply(self.lang.get_page_text('THROTTLING', 'TOO_MANY_REQUESTS', user_lang))
+        if not bucket[3]:
+            bucket[3] = True
+            self.timers.schedule((1 - bucket[0]) * limit, self._notify_unlocked, message, bucket)
+        raise CancelHandler()
 
-        # Sleep.
-        await asyncio.sleep(delta)
+    async def on_process_callback_query(self, query: types.CallbackQuery, data: dict):
+        """
+        This handler is called when dispatcher receives a callback query
 
-        # Check lock status
-        thr = await dispatcher.check_key(key)
+        :param query:
+        """
+        limit, burst, key = self._get_limits(self.callback_rate_limit, self.callback_burst, 'callback_query')
+        bucket = self._hit(query.from_user.id, key, limit, burst)
+        if bucket is None:
+            return
+        logging.getLogger(type(self).__name__).error(f'Rate limit exceeded [{query.from_user.id}] [{key}]')
+        if bucket[2] == 1:
+            user_lang = self.lang.parse_user_lang(query.from_user.id)
+            await query.answer(self.lang.get_page_text('THROTTLING', 'TOO_MANY_REQUESTS', user_lang))
+        else:
+            await query.answer()
+        raise CancelHandler()
 
-        # If current message is not last with current key - do not send message
-        if thr.exceeded_count == throttled.exceeded_count:
+    @staticmethod
+    async def _notify_unlocked(message: types.Message, bucket: list) -> None:
+        bucket[3] = False
+        if bucket[2] > 0:
+            bucket[2] = 0
             await message.reply('Unlocked.')
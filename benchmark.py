@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import argparse
+from datetime import date, timedelta
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'benchmark.db')  # Benchmark doesn't use the bot database
+
+import config
+from analytics import BotAnalytics
+from db_manager import DbManager
+from db_profiler import QueryProfiler
+from lang_manager import LangManager
+from markups_manager import MarkupManager
+import pagination
+
+# Structure of the bot database tables used by DbManager (service tables are created by DbManager itself)
+SCHEMA = '''
+CREATE TABLE users (user_id INTEGER PRIMARY KEY, user_nickname TEXT, user_firstname TEXT, user_lastname TEXT,
+                    lang TEXT DEFAULT 'en', date_added TIMESTAMP, referrals INTEGER DEFAULT 0, referrer INTEGER,
+                    mailings INTEGER DEFAULT 2);
+CREATE TABLE words (word_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, word_string TEXT,
+                    word_translation TEXT, date_added TIMESTAMP, from_lang TEXT, to_lang TEXT);
+CREATE INDEX words_user_id ON words (user_id);
+CREATE TABLE metrics (metric_id INTEGER PRIMARY KEY, metric_name TEXT);
+CREATE TABLE analytics_log (metric INTEGER, user_id INTEGER, count INTEGER DEFAULT 1);
+CREATE TABLE permissions (permission_level INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE admins (user_id INTEGER PRIMARY KEY, permission_level INTEGER);
+CREATE TABLE achievements (user_id INTEGER, name TEXT, date_added TIMESTAMP);
+CREATE TABLE achievements_log (user_id INTEGER, achievement TEXT, date_added TIMESTAMP);
+'''
+METRICS = ('welcome_message_handler', 'dictionary_command_handler', 'new_word_command_handler',
+           'quiz_command_handler', 'profile_command_handler', 'pagination_callback_handler')
+DEFAULT_REGRESSION_THRESHOLD = 10  # Percents
+
+
+def build_synthetic_db(path_to_db: str, users: int, words_per_user: int, lang_pairs: list, events: int,
+                       seed: int = 0) -> None:
+    """Create bot database with generated users, dictionaries (words_per_user per languages pair, added over the
+    last two years) and analytics log with events spread over users and metrics"""
+    rand = random.Random(seed)
+    conn = sqlite3.connect(path_to_db)
+    conn.executescript(SCHEMA)
+    today = date.today()
+    conn.executemany('INSERT INTO users (user_id, user_nickname, user_firstname, user_lastname, lang, date_added, '
+                     'referrer) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     [(user_id, f'user{user_id}', f'User{user_id}', 'Benchmark', rand.choice(('en', 'ru', 'ua')),
+                       today - timedelta(days=rand.randint(0, 730)), rand.randint(1, user_id) if user_id > 1 else None)
+                      for user_id in range(1, users + 1)])
+    for user_id in range(1, users + 1):
+        conn.executemany('INSERT INTO words (user_id, word_string, word_translation, date_added, from_lang, to_lang) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         [(user_id, f'word{user_id}_{index}', f'translation{user_id}_{index}',
+                           today - timedelta(days=rand.randint(0, 730)), from_lang, to_lang)
+                          for from_lang, to_lang in lang_pairs for index in range(words_per_user)])
+    conn.executemany('INSERT INTO metrics (metric_id, metric_name) VALUES (?, ?)', enumerate(METRICS, 1))
+    counts = {}
+    for _ in range(events):
+        key = (rand.randint(1, len(METRICS)), rand.randint(1, users))
+        counts[key] = counts.get(key, 0) + 1
+    conn.executemany('INSERT INTO analytics_log (metric, user_id, count) VALUES (?, ?, ?)',
+                     [(metric, user_id, count) for (metric, user_id), count in counts.items()])
+    conn.commit()
+    conn.close()
+
+
+class BenchmarkSuite:
+    """Times DbManager and LangManager hot paths on a synthetic database. Every case is called `repeat` times
+    for random users, results are per call in microseconds together with SQL queries per call"""
+
+    def __init__(self, path_to_db: str, users: int, lang_pairs: list, shards: int = 0, seed: int = 0):
+        self.users = users
+        self.lang_pairs = lang_pairs
+        self.rand = random.Random(seed)
+        random.seed(seed)  # Quiz options are chosen with the global generator
+        self.db = DbManager(path_to_db, False, shards=shards)
+        self.db.create_connection()
+        self.profiler = self.db.profiler = QueryProfiler(slow_query=float('inf'), query_budget=sys.maxsize)
+        self.lang = LangManager(config.PATH_TO_TRANSLATIONS, self.db)
+        self.markup = MarkupManager(self.lang)
+        self.analytics = BotAnalytics(self.db)
+        self.paginators = pagination.PaginatorSessionCache(pagination.PAGINATORS, self.lang, self.db, self.markup)
+        self.cases = {
+            'get_user_dict': self.get_user_dict,
+            'get_user_dictionary_stats': self.get_user_dictionary_stats,
+            'get_user_quiz_data': self.get_user_quiz_data,
+            'get_rating_list': self.get_rating_list,
+            'analytics_flush': self.analytics_flush,
+            'analytics_log_event': self.analytics_log_event,
+            'get_user_profile_page': self.get_user_profile_page,
+            'dictionary_pagination': self.dictionary_pagination,
+        }
+
+    def close(self) -> None:
+        self.analytics.flush()
+        self.db.close_connection()
+
+    def _user(self) -> int:
+        return self.rand.randint(1, self.users)
+
+    def get_user_dict(self):
+        from_lang, to_lang = self.rand.choice(self.lang_pairs)
+        self.db.get_user_dict(self._user(), from_lang, to_lang)
+
+    def get_user_dictionary_stats(self):
+        from_lang, to_lang = self.rand.choice(self.lang_pairs)
+        self.db.get_user_dictionary_stats(self._user(), from_lang, to_lang)
+
+    def get_user_quiz_data(self):
+        from_lang, to_lang = self.rand.choice(self.lang_pairs)
+        self.db.get_user_quiz_data(self._user(), from_lang, to_lang, 10)
+
+    def get_rating_list(self):
+        self.db.get_rating_list(10, self.rand.randint(0, 2) * 10)
+
+    def analytics_flush(self):
+        """Writing a batch of 100 buffered handler events, the way analytics flushes them"""
+        for _ in range(100):
+            self.analytics.events.append((self.rand.randint(1, len(METRICS)), self._user(), time.time()))
+        self.analytics.flush()
+
+    def analytics_log_event(self):
+        self.analytics._log_event(self.rand.choice(METRICS), self._user())
+
+    def get_user_profile_page(self):
+        self.lang.get_user_profile_page(self._user(), 'en')
+
+    def dictionary_pagination(self):
+        """Dictionary opening and moving to the next page the way the pagination callback does"""
+        from_lang, to_lang = self.rand.choice(self.lang_pairs)
+        user_id = self._user()
+        current_page = {'from_lang': from_lang, 'to_lang': to_lang, 'current_page': 0}
+        for _ in range(3):
+            paginator = self.paginators.get('dictionary', user_id, current_page)
+            if paginator.is_last():
+                paginator.first_page('en')
+            else:
+                paginator.next_page('en')
+            current_page = paginator.get_state_data()
+
+    def run(self, repeat: int = 200, cases: list = None) -> dict:
+        results = {}
+        for name in cases or self.cases:
+            case = self.cases[name]
+            case()  # Warm up caches (SQLite pages, statements cache)
+            queries_before = sum(stats.count for stats in self.profiler.statements.values())
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                case()
+                timings.append(time.perf_counter() - start)
+            queries = sum(stats.count for stats in self.profiler.statements.values()) - queries_before
+            timings.sort()
+            results[name] = {
+                'calls': repeat,
+                'mean_us': round(statistics.mean(timings) * 1e6, 1),
+                'p50_us': round(timings[len(timings) // 2] * 1e6, 1),
+                'p95_us': round(timings[int(len(timings) * .95)] * 1e6, 1),
+                'queries_per_call': round(queries / repeat, 2)
+            }
+        return results
+
+
+def run_benchmarks(users: int = 1000, words_per_user: int = 50, lang_pairs: list = None, events: int = 100000,
+                   repeat: int = 200, shards: int = 0, cases: list = None, seed: int = 0) -> dict:
+    """Build a synthetic database in a temporary directory and run the suite. Returns results with parameters"""
+    lang_pairs = lang_pairs or [('en', 'ru')]
+    with tempfile.TemporaryDirectory() as directory:
+        path_to_db = os.path.join(directory, 'benchmark.db')
+        start = time.perf_counter()
+        build_synthetic_db(path_to_db, users, words_per_user, lang_pairs, events, seed)
+        logging.getLogger('Benchmark').info(f'Synthetic database built in {time.perf_counter() - start:.1f}s')
+        suite = BenchmarkSuite(path_to_db, users, lang_pairs, shards, seed)
+        try:
+            results = suite.run(repeat, cases)
+        finally:
+            suite.close()
+    return {
+        'params': {'users': users, 'words_per_user': words_per_user, 'lang_pairs': lang_pairs, 'events': events,
+                   'repeat': repeat, 'shards': shards, 'seed': seed},
+        'platform': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                     'machine': platform.machine()},
+        'results': results
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> list:
+    """Compare mean times with baseline results. Returns (case, baseline us, current us, delta %, regression)"""
+    comparison = []
+    for name, current in results['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        delta = (current['mean_us'] - previous['mean_us']) / previous['mean_us'] * 100 if previous['mean_us'] else 0.
+        comparison.append((name, previous['mean_us'], current['mean_us'], round(delta, 1), delta > threshold))
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DbManager and LangManager benchmarks on a synthetic database')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--words', type=int, default=50, help='Words per user per languages pair')
+    parser.add_argument('--pairs', default='en-ru', help='Comma separated languages pairs, e.g. en-ru,ru-en')
+    parser.add_argument('--events', type=int, default=100000, help='Analytics events in the log')
+    parser.add_argument('--repeat', type=int, default=200, help='Calls per case')
+    parser.add_argument('--shards', type=int, default=0)
+    parser.add_argument('--cases', help='Comma separated cases to run (all by default)')
+    parser.add_argument('--output', help='Write results to JSON file')
+    parser.add_argument('--baseline', help='Compare with results JSON file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help='Slowdown in percents treated as regression')
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    benchmark_results = run_benchmarks(arguments.users, arguments.words,
+                                       [tuple(pair.split('-')) for pair in arguments.pairs.split(',')],
+                                       arguments.events, arguments.repeat, arguments.shards,
+                                       arguments.cases.split(',') if arguments.cases else None)
+    print(json.dumps(benchmark_results, indent=2))
+    if arguments.output:
+        with open(arguments.output, 'w', encoding='utf-8') as file:
+            json.dump(benchmark_results, file, indent=2)
+    if arguments.baseline:
+        with open(arguments.baseline, 'r', encoding='utf-8') as file:
+            comparison = compare(benchmark_results, json.load(file), arguments.threshold)
+        for case_name, baseline_us, current_us, delta_percent, regression in comparison:
+            print(f'{case_name:<28} {baseline_us:>10.1f}us -> {current_us:>10.1f}us {delta_percent:+7.1f}%'
+                  f'{"  REGRESSION" if regression else ""}', file=sys.stderr)
+        if any(comparison_row[-1] for comparison_row in comparison):
+            sys.exit(1)
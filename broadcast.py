@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+from collections import deque
+import logging
+
+# ===== External libs imports =====
+
+from aiogram import Bot
+from aiogram.utils import exceptions
+
+# ===== Local imports =====
+
+from governor import PRIORITY_BULK, GovernedBot, api_priority
+from rate_limit import TokenBucket
+
+
+class BroadcastEngine:
+    """Mass mailing engine. Messages are sent by a bounded pool of workers. GovernedBot limits them in its bulk
+    lane and pauses only the chat bucket affected by RetryAfter, other bots are limited by the engine's own token
+    bucket tuned to Telegram global limit (30 messages per second), which RetryAfter pauses for all workers"""
+
+    RATE_LIMIT = 28  # Messages per second, a bit under the Telegram limit
+    BURST = 1  # A full bucket of RATE_LIMIT tokens would double the rate in the first second
+    CONCURRENCY = 16
+
+    SENT = 'sent'
+    BLOCKED = 'blocked'
+    NOT_FOUND = 'not_found'
+    DEACTIVATED = 'deactivated'
+    FAILED = 'failed'
+    UNREACHABLE = (BLOCKED, NOT_FOUND, DEACTIVATED)
+
+    def __init__(self, bot: Bot, rate_limit: float = RATE_LIMIT, concurrency: int = CONCURRENCY):
+        self.bot = bot
+        self.concurrency = concurrency
+        # Requests of governed bot are already limited by the governor
+        self.bucket = TokenBucket(rate_limit, capacity=self.BURST) if not isinstance(bot, GovernedBot) else None
+
+    async def broadcast(self, recipients, render, disable_notification: bool = False, on_delivered=None) -> dict:
+        """Send message to every (user_id, lang_code) recipient from iterable (e.g. DB cursor).
+        Message text is rendered once per interface language with render(lang_code).
+        on_delivered(user_id, status) is called after each delivery attempt. Returns count of each status"""
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        texts = {}
+        result = {}
+
+        async def worker():
+            api_priority.set(PRIORITY_BULK)  # Mailing requests must never delay interactive replies
+            while True:
+                recipient = await queue.get()
+                if recipient is None:
+                    return
+                user_id, lang_code = recipient
+                if lang_code not in texts:
+                    texts[lang_code] = render(lang_code)
+                status = await self.send(user_id, texts[lang_code], disable_notification)
+                result[status] = result.get(status, 0) + 1
+                if on_delivered is not None:
+                    on_delivered(user_id, status)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.concurrency)]
+        try:
+            for recipient in recipients:
+                await queue.put(recipient)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        return result
+
+    async def send(self, user_id: int, text: str, disable_notification: bool = False) -> str:
+        """Safe message sender. Returns delivery status"""
+        logger = logging.getLogger(type(self).__name__)
+        while True:
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            try:
+                await self.bot.send_message(user_id, text, disable_notification=disable_notification)
+            except exceptions.RetryAfter as e:
+                logger.error(f"Target [ID:{user_id}]: Flood limit is exceeded. Retry in {e.timeout} seconds.")
+                if self.bucket is not None:  # Governed bot waits for the paused chat bucket itself
+                    self.bucket.pause(e.timeout)
+                continue
+            except exceptions.BotBlocked:
+                logger.error(f"Target [ID:{user_id}]: blocked by user")
+                return self.BLOCKED
+            except exceptions.ChatNotFound:
+                logger.error(f"Target [ID:{user_id}]: invalid user ID")
+                return self.NOT_FOUND
+            except exceptions.UserDeactivated:
+                logger.error(f"Target [ID:{user_id}]: user is deactivated")
+                return self.DEACTIVATED
+            except exceptions.TelegramAPIError:
+                logger.exception(f"Target [ID:{user_id}]: failed")
+                return self.FAILED
+            logger.debug(f"Target [ID:{user_id}]: success")
+            return self.SENT
+
+
+class MailingLedger:
+    """Persisted mailing progress. Deliveries are checkpointed in batches together with the low watermark:
+    the biggest user_id such that every recipient up to it has been processed. Unreachable users are marked,
+    so they are skipped by the next mailings"""
+
+    CHECKPOINT_SIZE = 100
+
+    def __init__(self, db_manager, job_id: int, last_user_id: int = 0):
+        self.db = db_manager
+        self.job_id = job_id
+        self.last_user_id = last_user_id
+        self._dispatched = deque()  # Recipients in user_id order which are not covered by watermark yet
+        self._done = set()
+        self._deliveries = []
+
+    def track(self, recipients):
+        """Wrap recipients iterable (ordered by user_id) to follow dispatched recipients"""
+        for recipient in recipients:
+            self._dispatched.append(recipient[0])
+            yield recipient
+
+    def delivered(self, user_id: int, status: str) -> None:
+        self._done.add(user_id)
+        self._deliveries.append((self.job_id, user_id, status))
+        while self._dispatched and self._dispatched[0] in self._done:
+            self.last_user_id = self._dispatched.popleft()
+            self._done.discard(self.last_user_id)
+        if len(self._deliveries) >= self.CHECKPOINT_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._deliveries:
+            return
+        unreachable = [(user_id, status) for _, user_id, status in self._deliveries
+                       if status in BroadcastEngine.UNREACHABLE]
+        self.db.save_mailing_checkpoint(self.job_id, self.last_user_id, self._deliveries, unreachable)
+        self._deliveries = []
@@ -25,13 +25,15 @@ class VocabularyBotCallbackHandler:
     """Class for Vocabulary Bot callback handlers"""
 
     def __init__(self, db_manager: DbManager, lang_manager: LangManager, markup_manager: MarkupManager,
-                 analytics: BotAnalytics, dispatcher: Dispatcher, bot: Bot):
+                 analytics: BotAnalytics, dispatcher: Dispatcher, bot: Bot,
+                 paginators: pagination.PaginatorSessionCache):
         self.db = db_manager
         self.lang = lang_manager
         self.markup = markup_manager
         self.analytics = analytics
         self.dp = dispatcher
         self.bot = bot
+        self.paginators = paginators
         self.__init_handlers()
 
     def __init_handlers(self):
@@ -116,9 +118,7 @@ class VocabularyBotCallbackHandler:
                 'from_lang': from_lang,
                 'to_lang': to_lang
             }
-            paginator = getattr(pagination, 'dictionary'.capitalize() + 'Paginator')(self.lang, self.db, self.markup,
-                                                                                     user_id,
-                                                                                     current_page=current_state)
+            paginator = self.paginators.get(pagination.DictionaryPaginator.action, user_id, current_state)
             await message.answer(text=self.lang.get_page_text('DICTIONARY', 'TEXT', user_lang),
                                  reply_markup=self.markup.get_dictionary_markup(user_lang))
             await message.answer(text=paginator.first_page(user_lang), reply_markup=paginator.get_reply_markup())
@@ -143,16 +143,14 @@ class VocabularyBotCallbackHandler:
             action = query.data[6:]
             user_lang = self.lang.parse_user_lang(query['from']['id'])
             async with state.proxy() as data:
-                if 'curr_pagination_page' in data:
+                if 'curr_pagination_page' in data and action in pagination.PAGINATORS:
                     current_page = data['curr_pagination_page']
-                    paginator = getattr(pagination, action.capitalize() + 'Paginator')(self.lang, self.db, self.markup,
-                                                                                       query['from']['id'],
-                                                                                       current_page=current_page)
+                    paginator = self.paginators.get(action, query['from']['id'], current_page)
                     if not paginator.is_first():
-                        await query.message.edit_text(text=paginator.first_page(user_lang),
-                                                      reply_markup=paginator.get_reply_markup(),
-                                                      parse_mode=paginator.get_parse_mode())
+                        text = paginator.first_page(user_lang)
                         data['curr_pagination_page'] = paginator.get_state_data()
+                        await query.message.edit_text(text=text, reply_markup=paginator.get_reply_markup(),
+                                                      parse_mode=paginator.get_parse_mode())
                     else:
                         await query.answer(self.lang.get_page_text('PAGINATION', 'FIRST_REACHED', user_lang),
                                            show_alert=True)
@@ -165,16 +163,14 @@ class VocabularyBotCallbackHandler:
             action = query.data[5:]
             user_lang = self.lang.parse_user_lang(query['from']['id'])
             async with state.proxy() as data:
-                if 'curr_pagination_page' in data:
+                if 'curr_pagination_page' in data and action in pagination.PAGINATORS:
                     current_page = data['curr_pagination_page']
-                    paginator = getattr(pagination, action.capitalize() + 'Paginator')(self.lang, self.db, self.markup,
-                                                                                       query['from']['id'],
-                                                                                       current_page=current_page)
+                    paginator = self.paginators.get(action, query['from']['id'], current_page)
                     if not paginator.is_first():
-                        await query.message.edit_text(text=paginator.prev_page(user_lang),
-                                                      reply_markup=paginator.get_reply_markup(),
-                                                      parse_mode=paginator.get_parse_mode())
+                        text = paginator.prev_page(user_lang)
                         data['curr_pagination_page'] = paginator.get_state_data()
+                        await query.message.edit_text(text=text, reply_markup=paginator.get_reply_markup(),
+                                                      parse_mode=paginator.get_parse_mode())
                     else:
                         await query.answer(self.lang.get_page_text('PAGINATION', 'FIRST_REACHED', user_lang),
                                            show_alert=True)
@@ -187,16 +183,14 @@ class VocabularyBotCallbackHandler:
             action = query.data[5:]
             user_lang = self.lang.parse_user_lang(query['from']['id'])
             async with state.proxy() as data:
-                if 'curr_pagination_page' in data:
+                if 'curr_pagination_page' in data and action in pagination.PAGINATORS:
                     current_page = data['curr_pagination_page']
-                    paginator = getattr(pagination, action.capitalize() + 'Paginator')(self.lang, self.db, self.markup,
-                                                                                       query['from']['id'],
-                                                                                       current_page=current_page)
+                    paginator = self.paginators.get(action, query['from']['id'], current_page)
                     if not paginator.is_last():
-                        await query.message.edit_text(text=paginator.next_page(user_lang),
-                                                      reply_markup=paginator.get_reply_markup(),
-                                                      parse_mode=paginator.get_parse_mode())
+                        text = paginator.next_page(user_lang)
                         data['curr_pagination_page'] = paginator.get_state_data()
+                        await query.message.edit_text(text=text, reply_markup=paginator.get_reply_markup(),
+                                                      parse_mode=paginator.get_parse_mode())
                     else:
                         await query.answer(self.lang.get_page_text('PAGINATION', 'LAST_REACHED', user_lang),
                                            show_alert=True)
@@ -209,16 +203,14 @@ class VocabularyBotCallbackHandler:
             action = query.data[5:]
             user_lang = self.lang.parse_user_lang(query['from']['id'])
             async with state.proxy() as data:
-                if 'curr_pagination_page' in data:
+                if 'curr_pagination_page' in data and action in pagination.PAGINATORS:
                     current_page = data['curr_pagination_page']
-                    paginator = getattr(pagination, action.capitalize() + 'Paginator')(self.lang, self.db, self.markup,
-                                                                                       query['from']['id'],
-                                                                                       current_page=current_page)
+                    paginator = self.paginators.get(action, query['from']['id'], current_page)
                     if not paginator.is_last():
-                        await query.message.edit_text(text=paginator.last_page(user_lang),
-                                                      reply_markup=paginator.get_reply_markup(),
-                                                      parse_mode=paginator.get_parse_mode())
+                        text = paginator.last_page(user_lang)
                         data['curr_pagination_page'] = paginator.get_state_data()
+                        await query.message.edit_text(text=text, reply_markup=paginator.get_reply_markup(),
+                                                      parse_mode=paginator.get_parse_mode())
                     else:
                         await query.answer(self.lang.get_page_text('PAGINATION', 'LAST_REACHED', user_lang),
                                            show_alert=True)
@@ -352,6 +344,7 @@ class VocabularyBotCallbackHandler:
                     to_lang = data['curr_pagination_page']['to_lang']
                     self.db.add_user_word(new_word_string, new_word_translation, query['from']['id'], from_lang,
                                           to_lang)
+                    self.analytics.trends.add('added', new_word_string, from_lang, to_lang)
                     await query.message.edit_text(self.lang.get_page_text('ADD_WORD', 'SUCCESSFUL_ADDED', user_lang))
                 await state.finish()
                 await asyncio.sleep(1)
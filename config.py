@@ -11,8 +11,35 @@ TOKEN = os.getenv('TOKEN')
 TOKEN_DEV = os.getenv('TOKEN_DEV')
 DEV_ID = os.getenv('DEV_ID')
 PATH_TO_DB = ROOT_DIR + '/' + os.getenv('DB_NAME')
+# User data shard files (0 keeps everything in one file). Must not be changed once shards contain data
+DB_SHARDS = int(os.getenv('DB_SHARDS', 0))
+DB_PROFILE = os.getenv('DB_PROFILE', '').lower() in ('1', 'true')  # SQL profiler and per-update queries budget
+DB_SLOW_QUERY_MS = int(os.getenv('DB_SLOW_QUERY_MS', 100))
+DB_QUERY_BUDGET = int(os.getenv('DB_QUERY_BUDGET', 20))  # Queries per update
 PATH_TO_TRANSLATIONS = ROOT_DIR + '/languages'
+PATH_TO_LEXICON = ROOT_DIR + '/' + os.getenv('LEXICON_NAME', 'lexicon.bin')
+PATH_TO_FSM_DB = ROOT_DIR + '/' + os.getenv('FSM_DB_NAME', 'fsm_states.db')
+FSM_STATES_TTL = int(os.getenv('FSM_STATES_TTL', 7 * 24 * 60 * 60))  # Seconds since the last state change
 DEFAULT_LANG = 'en'
+ANALYTICS_EVENTS_RETENTION_DAYS = int(os.getenv('ANALYTICS_EVENTS_RETENTION_DAYS', 30))  # Raw events
+ANALYTICS_HOURLY_RETENTION_DAYS = int(os.getenv('ANALYTICS_HOURLY_RETENTION_DAYS', 90))  # Then daily counts only
+# Anonymized incoming updates capture for replay (disabled if directory is not set). The same salt must be used
+# to anonymize database copy for replay, without it IDs are hashed with a random key
+TRAFFIC_CAPTURE_DIR = os.getenv('TRAFFIC_CAPTURE_DIR')
+TRAFFIC_CAPTURE_SALT = os.getenv('TRAFFIC_CAPTURE_SALT')
+TRAFFIC_CAPTURE_MAX_MB = int(os.getenv('TRAFFIC_CAPTURE_MAX_MB', 64))  # Per capture file
+TRAFFIC_CAPTURE_FILES = int(os.getenv('TRAFFIC_CAPTURE_FILES', 10))
 
 LINGVOLIVE_API_KEY = os.getenv('LINGVOLIVE_API_KEY')
 QUOTE_API_ENDPOINT = os.getenv('QUOTE_API_ENDPOINT')
+
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST')  # Public bot URL, e.g. https://example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv('WEBHOOK_MAX_IN_FLIGHT', 64))
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('PORT', 8080))
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')  # Local only, metrics are not public
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))  # 0 disables /metrics endpoint
+LOOP_MONITOR_INTERVAL = float(os.getenv('LOOP_MONITOR_INTERVAL', .5))  # Seconds between loop lag measurements
+LOOP_BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD', .25))  # Seconds, 0 disables the loop monitor
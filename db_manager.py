@@ -2,6 +2,8 @@
 
 # ===== Default imports =====
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from config import DEFAULT_LANG
 from datetime import datetime
 import logging
@@ -9,39 +11,137 @@ import os
 import random
 import sqlite3
 from shutil import copyfile
+import time
 
 # ===== Local imports =====
 
 from itertools import islice
+from hyperloglog import HyperLogLog
+import metrics
 
 
 class DbManager:
     """Class for working with bot database"""
 
     conn = None  # Connection to SQLite3 database
-
-    def __init__(self, path_to_db: str, dev_mode: bool):
+    BUSY_TIMEOUT = 10  # Seconds to wait for a lock held by another process
+    dict_versions = None  # Per-user dictionary versions, changed on every words change (used by caches)
+    DICT_VERSIONS_SIZE = 10000  # Versions of users who changed their dictionaries most recently
+    shard_conns = None  # Connections to user data shards (empty when user data is kept in the main database)
+    profiler = None  # Optional QueryProfiler (see db_profiler.py)
+    # User-scoped tables, spread over shard databases by user_id when sharding is enabled
+    SHARDED_TABLES = ('words', 'analytics_log', 'achievements', 'achievements_log')
+    # Service tables added after the initial database structure
+    SERVICE_TABLES = (
+        '''CREATE TABLE IF NOT EXISTS scheduler_jobs (
+            job_name TEXT PRIMARY KEY,
+            last_run REAL,
+            last_duration REAL,
+            last_status TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS mailing_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            mailings INTEGER NOT NULL,
+            notification INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            date_added TIMESTAMP,
+            date_updated TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS mailing_deliveries (
+            job_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            PRIMARY KEY (job_id, user_id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS unreachable_users (
+            user_id INTEGER PRIMARY KEY,
+            reason TEXT NOT NULL,
+            date_added TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS analytics_events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            metric INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            date_added REAL NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS metric_hourly (
+            metric INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (metric, hour)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS metric_daily (
+            metric INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (metric, day)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS hll_sketches (
+            sketch TEXT NOT NULL,
+            day TEXT NOT NULL,
+            registers BLOB NOT NULL,
+            PRIMARY KEY (sketch, day)
+        )''',
+    )
+    ROLLUP_STATE_KEY = 'analytics_rollup_event_id'  # Last analytics event folded into rollups
+    LEGACY_DAY = '0000-00-00'  # metric_daily day of counts collected before the events log
+    USERS_COUNT_KEY = 'users_count'
+
+    def __init__(self, path_to_db: str, dev_mode: bool, copy_dev_db: bool = True, shards: int = 0):
         self.dev_mode = dev_mode
         self.path_to_db = path_to_db
         self.path_to_sql_dump = str(path_to_db).replace('db', 'sql')
+        self.shards = shards
         if self.dev_mode:
             path_to_db_dev = str(path_to_db).replace('.db', '_dev.db')
-            copyfile(path_to_db, path_to_db_dev)
+            # Worker processes use the copy made by supervisor
+            if copy_dev_db:
+                copyfile(path_to_db, path_to_db_dev)
+                for shard in range(self.shards):
+                    if os.path.exists(self._shard_path(path_to_db, shard)):
+                        copyfile(self._shard_path(path_to_db, shard), self._shard_path(path_to_db_dev, shard))
             self.path_to_db = path_to_db_dev
+        self.dict_versions = OrderedDict()
+        self._dict_version = 0
+        self._dict_versions_floor = 0
+        self.shard_conns = []
+        self._shard_executor = None
+
+    @staticmethod
+    def _shard_path(path_to_db: str, shard: int) -> str:
+        return str(path_to_db).replace('.db', f'_shard{shard}.db')
 
     def create_connection(self):
         try:
-            self.conn = sqlite3.connect(self.path_to_db)
+            self.conn = sqlite3.connect(self.path_to_db, timeout=self.BUSY_TIMEOUT)
+            # WAL lets readers work while another connection (or worker process) writes
+            self.conn.execute('PRAGMA journal_mode=WAL')
             if not self._database_created():
                 self._init_database()
+            self._init_service_tables()
+            self._init_shards()
+            self._init_metric_rollups()
             logging.getLogger(type(self).__name__).info(
                 f' SQLite {sqlite3.version} database successfully loaded '
-                f'[size: {round(os.path.getsize(self.path_to_db) / 1000)} KB]')
+                f'[size: {round(os.path.getsize(self.path_to_db) / 1000)} KB, shards: {self.shards}]')
         except sqlite3.Error as error:
             logging.getLogger(type(self).__name__).error(f' SQLite3 Connection Error ({error})')
 
     def close_connection(self):
         try:
+            for conn in self.shard_conns:
+                conn.close()
+            if self._shard_executor is not None:
+                self._shard_executor.shutdown()
             self.conn.close()
             logging.getLogger(type(self).__name__).info(f"Database connection successfully closed")
         except sqlite3.Error as error:
@@ -64,11 +164,110 @@ class DbManager:
         except sqlite3.Error as error:
             logging.getLogger(type(self).__name__).error(f'Error while creating database.\n{error}')
 
+    def _init_service_tables(self) -> None:
+        try:
+            for query in self.SERVICE_TABLES:
+                self.conn.execute(query)
+            self.conn.commit()
+        except sqlite3.Error as error:
+            logging.getLogger(type(self).__name__).error(f'Error while creating service tables.\n{error}')
+
+    def _init_shards(self) -> None:
+        """Open shard databases. Missing user tables are created with the main database schema and filled with
+        rows of the shard users, so an existing single-file database is split on the first start with sharding"""
+        if self.shards <= 0:
+            return
+        schema = self._execute_query(
+            f'''SELECT type, tbl_name, sql FROM sqlite_master WHERE sql IS NOT NULL
+                AND tbl_name IN ({', '.join('?' for _ in self.SHARDED_TABLES)})
+                ORDER BY type DESC''', *self.SHARDED_TABLES).fetchall()  # Tables before indexes
+        for shard in range(self.shards):
+            # Queries of one shard may run in executor threads (scatter-gather), but never at the same time
+            conn = sqlite3.connect(self._shard_path(self.path_to_db, shard), timeout=self.BUSY_TIMEOUT,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+            created = [table for table in self.SHARDED_TABLES if table not in existing]
+            if created:
+                conn.execute('ATTACH DATABASE ? AS main_db', (self.path_to_db,))
+                with conn:
+                    for object_type, table, sql in schema:
+                        if table in created:
+                            conn.execute(sql)
+                    for table in created:
+                        columns = [row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')]
+                        if 'user_id' in columns:
+                            conn.execute(f'INSERT INTO {table} SELECT * FROM main_db.{table} WHERE user_id % ? = ?',
+                                         (self.shards, shard))
+                        else:  # Not user rows (e.g. reference data), each shard gets a copy
+                            conn.execute(f'INSERT INTO {table} SELECT * FROM main_db.{table}')
+                conn.execute('DETACH DATABASE main_db')
+                logging.getLogger(type(self).__name__).info(f'Shard {shard} created with tables {created}')
+            self.shard_conns.append(conn)
+        self._shard_executor = ThreadPoolExecutor(self.shards, thread_name_prefix='db-shard')
+
+    def _init_metric_rollups(self) -> None:
+        """Seed daily rollups with lifetime counts of analytics_log once, so totals include events logged
+        before the events log was introduced"""
+        if self.get_bot_state(self.ROLLUP_STATE_KEY) is not None:
+            return
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO metric_daily (metric, day, count) VALUES (?, ?, ?)',
+                                  [(metric, self.LEGACY_DAY, total) for metric, total, name
+                                   in self._get_analytics_log_totals()])
+            last_event_id = self.conn.execute('SELECT MAX(event_id) FROM analytics_events').fetchone()[0]
+            self.conn.execute('INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)',
+                              (self.ROLLUP_STATE_KEY, str(last_event_id or 0)))
+        logging.getLogger(type(self).__name__).info('Metric rollups initialized with analytics log totals')
+
+    def _user_conn(self, user_id: int) -> sqlite3.Connection:
+        """Connection to the database keeping user-scoped tables of the user"""
+        return self.shard_conns[user_id % self.shards] if self.shard_conns else self.conn
+
     def _execute_query(self, query: str, *args) -> sqlite3.Cursor:
+        return self._execute_query_on(self.conn, query, *args)
+
+    def _execute_user_query(self, user_id: int, query: str, *args) -> sqlite3.Cursor:
+        return self._execute_query_on(self._user_conn(user_id), query, *args)
+
+    def _execute_query_on(self, conn: sqlite3.Connection, query: str, *args) -> sqlite3.Cursor:
+        start = time.perf_counter()
         try:
-            return self.conn.execute(query, args)
+            cursor = conn.execute(query, args)
+            if self.profiler is not None:
+                return self.profiler.record(conn, query, args, cursor, time.perf_counter() - start)
+            return cursor
         except sqlite3.Error as error:
             logging.getLogger(type(self).__name__).error(f' SQLite3 Query Execution Error ({error})\n {query}, {args}')
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.DB_QUERIES.inc()
+            metrics.DB_SECONDS.inc(amount=elapsed)
+            metrics.add_time('db', elapsed)
+
+    def _scatter(self, query: str, *args) -> list:
+        """Run query on every shard in parallel. Returns rows of all shards. Metrics and profiler are not thread
+        safe, so executor threads only run the query and it is accounted here"""
+        def fetch_shard(conn: sqlite3.Connection) -> tuple:
+            shard_start = time.perf_counter()
+            try:
+                return conn.execute(query, args).fetchall(), time.perf_counter() - shard_start
+            except sqlite3.Error as error:
+                logging.getLogger(type(self).__name__).error(
+                    f' SQLite3 Query Execution Error ({error})\n {query}, {args}')
+                return [], time.perf_counter() - shard_start
+
+        start = time.perf_counter()
+        results = self._shard_executor.map(fetch_shard, self.shard_conns)
+        rows = []
+        for conn, (shard_rows, elapsed) in zip(self.shard_conns, results):
+            metrics.DB_QUERIES.inc()
+            metrics.DB_SECONDS.inc(amount=elapsed)
+            if self.profiler is not None:
+                self.profiler.record_fetched(conn, query, args, elapsed, len(shard_rows))
+            rows.extend(shard_rows)
+        metrics.add_time('db', time.perf_counter() - start)  # Shard queries run in threads out of handler context
+        return rows
 
     def is_user_exists(self, user_id: int) -> bool:
         query = 'SELECT * FROM users WHERE user_id=?'
@@ -78,6 +277,8 @@ class DbManager:
         query = '''INSERT INTO users (user_id, user_nickname, user_firstname, user_lastname, date_added) 
                    VALUES(?, ?, ?, ?, ?)'''
         self._execute_query(query, user_id, user_nickname, user_firstname, user_lastname, datetime.now().date())
+        # Counter is changed in SQL, so concurrent worker processes don't lose increments
+        self._execute_query('UPDATE bot_state SET value = CAST(value AS INTEGER) + 1 WHERE key=?', self.USERS_COUNT_KEY)
         self.conn.commit()
 
     def get_user_lang(self, user_id: int) -> str:
@@ -104,10 +305,6 @@ class DbManager:
         self._execute_query(query, metric_name)
         self.conn.commit()
 
-    def metric_exists(self, metric_id: int) -> bool:
-        query = 'SELECT metric_id FROM metrics WHERE metric_id=?'
-        return len(self._execute_query(query, metric_id).fetchall()) > 0
-
     def metric_name_exists(self, metric_name: str) -> bool:
         query = 'SELECT metric_id FROM metrics WHERE metric_name=?'
         return len(self._execute_query(query, metric_name).fetchall()) > 0
@@ -120,38 +317,6 @@ class DbManager:
             self.add_metric(metric_name)
             return self.get_metric_id(metric_name)
 
-    def analytics_log_exists(self, user_id: int, metric_id: int) -> bool:
-        return len(self._execute_query("SELECT user_id FROM analytics_log WHERE user_id=? AND metric=?",
-                                       user_id, metric_id).fetchall()) > 0
-
-    def log_default_metric(self, handler_name: str, user_id: int, metric_id: int) -> None:
-        if not self.metric_exists(metric_id):
-            self.add_metric(handler_name)
-        if self.analytics_log_exists(user_id, metric_id):
-            query = 'UPDATE analytics_log SET count=? WHERE user_id=? AND metric=?'
-            count = self._execute_query('SELECT count FROM analytics_log WHERE user_id=? AND metric=?',
-                                        user_id, metric_id).fetchall()[0][0]
-            self._execute_query(query, count + 1, user_id, metric_id)
-            self.conn.commit()
-        else:
-            query = 'INSERT INTO analytics_log (metric, user_id) VALUES (?, ?)'
-            self._execute_query(query, metric_id, user_id)
-            self.conn.commit()
-
-    def log_callback_metric(self, callback_name: str, user_id: int, metric_id: int) -> None:
-        if not self.metric_name_exists(callback_name):
-            self.add_metric(callback_name)
-        if self.analytics_log_exists(user_id, metric_id):
-            query = 'UPDATE analytics_log SET count=? WHERE user_id=? AND metric=?'
-            count = self._execute_query('SELECT count FROM analytics_log WHERE user_id=? AND metric=?',
-                                        user_id, metric_id).fetchall()[0][0]
-            self._execute_query(query, count + 1, user_id, metric_id)
-            self.conn.commit()
-        else:
-            query = 'INSERT INTO analytics_log (metric, user_id) VALUES (?, ?)'
-            self._execute_query(query, metric_id, user_id)
-            self.conn.commit()
-
     def is_admin(self, user_id: int) -> bool:
         query = 'SELECT user_id FROM admins WHERE user_id=?'
         return len(self._execute_query(query, user_id).fetchall()) > 0
@@ -167,17 +332,30 @@ class DbManager:
     def get_user_dict(self, user_id: int, from_lang: str, to_lang: str) -> list:
         query = '''SELECT word_id, word_string, word_translation, from_lang, to_lang, date_added
                 FROM words WHERE user_id=? AND from_lang=? AND to_lang=?'''
-        return self._execute_query(query, user_id, from_lang, to_lang).fetchall()
+        return self._execute_user_query(user_id, query, user_id, from_lang, to_lang).fetchall()
 
     def word_in_user_dict(self, word_id: int, user_id: int) -> bool:
         query = 'SELECT word_id FROM words WHERE word_id=? AND user_id=?'
-        return len(self._execute_query(query, word_id, user_id).fetchall()) > 0
+        return len(self._execute_user_query(user_id, query, word_id, user_id).fetchall()) > 0
 
     def get_user_word(self, word_id: int, user_id: int) -> list:
         query = 'SELECT * FROM words WHERE word_id=? AND user_id=?'
-        return self._execute_query(query, word_id, user_id).fetchall()[0]
+        return self._execute_user_query(user_id, query, word_id, user_id).fetchall()[0]
 
     def get_admin_statistics(self) -> list:
+        query = '''SELECT metric, SUM(count) AS metric_total, metrics.metric_name
+                   FROM metric_daily INNER JOIN metrics ON metrics.metric_id = metric
+                   GROUP BY metric ORDER BY metric_total DESC'''
+        return self._execute_query(query).fetchall()
+
+    def _get_analytics_log_totals(self) -> list:
+        if self.shard_conns:
+            totals = {}
+            for metric, count in self._scatter('SELECT metric, SUM(count) FROM analytics_log GROUP BY metric'):
+                totals[metric] = totals.get(metric, 0) + count
+            names = dict(self._execute_query('SELECT metric_id, metric_name FROM metrics').fetchall())
+            result = [(metric, total, names[metric]) for metric, total in totals.items() if metric in names]
+            return sorted(result, key=lambda row: row[1], reverse=True)
         query = '''SELECT metric, SUM(count) AS metric_total, metrics.metric_name 
         FROM analytics_log INNER JOIN metrics ON metrics.metric_id = metric 
         GROUP BY metric ORDER BY metric_total DESC'''
@@ -187,17 +365,27 @@ class DbManager:
         query = 'SELECT user_id FROM users'
         return self._execute_query(query).fetchall()
 
+    def get_users_count(self) -> int:
+        """Users count kept up to date by add_user (counted once on the first call)"""
+        count = self.get_bot_state(self.USERS_COUNT_KEY)
+        if count is None:
+            with self.conn:
+                count = self.conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+                self.conn.execute('INSERT OR IGNORE INTO bot_state (key, value) VALUES (?, ?)',
+                                  (self.USERS_COUNT_KEY, str(count)))
+        return int(count)
+
     def get_user_info(self, user_id: int) -> list:
         query = 'SELECT * FROM users WHERE user_id=?'
         return self._execute_query(query, user_id).fetchall()[0]
 
     def get_user_dict_capacity(self, user_id: int, from_lang: str, to_lang: str) -> int:
         query = 'SELECT word_id FROM words WHERE user_id=? AND from_lang=? AND to_lang=?'
-        return len(self._execute_query(query, user_id, from_lang, to_lang).fetchall())
+        return len(self._execute_user_query(user_id, query, user_id, from_lang, to_lang).fetchall())
 
     def get_user_total_dict_capacity(self, user_id: int) -> int:
         query = 'SELECT word_id FROM words WHERE user_id=?'
-        return len(self._execute_query(query, user_id).fetchall())
+        return len(self._execute_user_query(user_id, query, user_id).fetchall())
 
     def get_user_referral_count(self, user_id: int) -> int:
         query = 'SELECT referrals FROM users WHERE user_id=?'
@@ -221,33 +409,101 @@ class DbManager:
     def add_user_word(self, word_string: str, word_translation: str, user_id: int, from_lang: str, to_lang: str):
         query = '''INSERT INTO words (user_id, word_string, word_translation, date_added, from_lang, to_lang)
                 VALUES (?, ?, ?, ?, ?, ?)'''
-        self._execute_query(query, user_id, word_string, word_translation, datetime.now().date(), from_lang, to_lang)
-        self.conn.commit()
+        self._execute_user_query(user_id, query, user_id, word_string, word_translation, datetime.now().date(),
+                                 from_lang, to_lang)
+        self._user_conn(user_id).commit()
+        self._bump_user_dict_version(user_id)
 
     def update_user_word_string(self, user_id: int, word_id: int, word_string: str):
         query = 'UPDATE words SET word_string=? WHERE user_id=? AND word_id=?'
-        self._execute_query(query, word_string, user_id, word_id)
-        self.conn.commit()
+        self._execute_user_query(user_id, query, word_string, user_id, word_id)
+        self._user_conn(user_id).commit()
+        self._bump_user_dict_version(user_id)
 
     def update_user_word_translation(self, user_id: int, word_id: int, word_translation: str):
         query = 'UPDATE words SET word_translation=? WHERE user_id=? AND word_id=?'
-        self._execute_query(query, word_translation, user_id, word_id)
-        self.conn.commit()
+        self._execute_user_query(user_id, query, word_translation, user_id, word_id)
+        self._user_conn(user_id).commit()
+        self._bump_user_dict_version(user_id)
+
+    def get_user_dict_version(self, user_id: int) -> int:
+        # Versions are taken from one counter, so the biggest evicted version is newer than any version
+        # of an evicted user and the sessions cached with the old version are rebuilt
+        return self.dict_versions.get(user_id, self._dict_versions_floor)
+
+    def _bump_user_dict_version(self, user_id: int) -> None:
+        self._dict_version += 1
+        self.dict_versions[user_id] = self._dict_version
+        self.dict_versions.move_to_end(user_id)
+        while len(self.dict_versions) > self.DICT_VERSIONS_SIZE:
+            self._dict_versions_floor = self.dict_versions.popitem(last=False)[1]
 
     def get_user_word_by_str(self, word_string: str, user_id: int) -> int:
         query = 'SELECT word_id FROM words WHERE user_id=? AND word_string=?'
-        result = self._execute_query(query, user_id, word_string).fetchall()
+        result = self._execute_user_query(user_id, query, user_id, word_string).fetchall()
         return result[0][0] if len(result) > 0 else None
 
     def delete_user_word(self, word_id: int, user_id: int):
         query = 'DELETE FROM words WHERE word_id=? AND user_id=?'
-        self._execute_query(query, word_id, user_id)
+        self._execute_user_query(user_id, query, word_id, user_id)
+        self._user_conn(user_id).commit()
+        self._bump_user_dict_version(user_id)
+
+    def add_mailing_job(self, admin_id: int, text: str, mailings: int, notification: bool) -> int:
+        query = '''INSERT INTO mailing_jobs (admin_id, text, mailings, notification, date_added, date_updated)
+                   VALUES (?, ?, ?, ?, ?, ?)'''
+        job_id = self._execute_query(query, admin_id, text, mailings, int(notification), datetime.now(),
+                                     datetime.now()).lastrowid
         self.conn.commit()
+        return job_id
 
-    def get_broadcast_users(self, mailings: int = 2) -> list:
-        query = 'SELECT user_id FROM users WHERE mailings=?'
-        result = self._execute_query(query, mailings).fetchall()
-        return map(lambda item: item[0], result) if len(result) > 0 else []
+    def get_unfinished_mailing_jobs(self) -> list:
+        query = '''SELECT job_id, admin_id, text, mailings, notification, last_user_id FROM mailing_jobs
+                   WHERE status='running' ORDER BY job_id'''
+        return self._execute_query(query).fetchall()
+
+    def iter_mailing_recipients(self, job_id: int, mailings: int, last_user_id: int = 0, batch_size: int = 500):
+        """Stream (user_id, lang) of mailing recipients in user_id order, which haven't received the mailing yet.
+        Rows are read by short keyset-paginated queries, so no read transaction is kept open during the mailing"""
+        query = '''SELECT users.user_id, users.lang FROM users
+                   LEFT JOIN mailing_deliveries ON mailing_deliveries.job_id=?
+                        AND mailing_deliveries.user_id=users.user_id
+                   WHERE users.mailings=? AND users.user_id>? AND mailing_deliveries.user_id IS NULL
+                        AND users.user_id NOT IN (SELECT user_id FROM unreachable_users)
+                   ORDER BY users.user_id
+                   LIMIT ?'''
+        while True:
+            rows = self._execute_query(query, job_id, mailings, last_user_id, batch_size).fetchall()
+            yield from rows
+            if len(rows) < batch_size:
+                break
+            last_user_id = rows[-1][0]
+
+    def save_mailing_checkpoint(self, job_id: int, last_user_id: int, deliveries: list, unreachable: list) -> None:
+        sent = len([delivery for delivery in deliveries if delivery[2] == 'sent'])
+        try:
+            self.conn.executemany('INSERT OR REPLACE INTO mailing_deliveries (job_id, user_id, status) '
+                                  'VALUES (?, ?, ?)', deliveries)
+            self.conn.executemany('INSERT OR REPLACE INTO unreachable_users (user_id, reason, date_added) '
+                                  'VALUES (?, ?, ?)', [(user_id, reason, datetime.now().date())
+                                                       for user_id, reason in unreachable])
+            self.conn.execute('''UPDATE mailing_jobs SET last_user_id=?, sent=sent+?, failed=failed+?, date_updated=?
+                                 WHERE job_id=?''',
+                              (last_user_id, sent, len(deliveries) - sent, datetime.now(), job_id))
+            self.conn.commit()
+        except sqlite3.Error as error:
+            logging.getLogger(type(self).__name__).error(f' SQLite3 Mailing checkpoint Error ({error})')
+
+    def finish_mailing_job(self, job_id: int) -> tuple:
+        """Mark mailing job as finished. Returns (sent, failed) counts"""
+        self._execute_query("UPDATE mailing_jobs SET status='finished', date_updated=? WHERE job_id=?",
+                            datetime.now(), job_id)
+        self.conn.commit()
+        return self._execute_query('SELECT sent, failed FROM mailing_jobs WHERE job_id=?', job_id).fetchall()[0]
+
+    def set_user_reachable(self, user_id: int) -> None:
+        self._execute_query('DELETE FROM unreachable_users WHERE user_id=?', user_id)
+        self.conn.commit()
 
     @staticmethod
     def _stat_pages(data: dict, size: int = 10):
@@ -257,7 +513,7 @@ class DbManager:
 
     def get_user_dict_last_word_date(self, user_id: int) -> datetime:
         query = 'SELECT date_added FROM words WHERE user_id=? ORDER BY date_added ASC'
-        query_result = self._execute_query(query, user_id).fetchall()[0][0].split('-')
+        query_result = self._execute_user_query(user_id, query, user_id).fetchall()[0][0].split('-')
         result = datetime(int(query_result[0]), int(query_result[1]), int(query_result[2]))
         return result
 
@@ -331,6 +587,17 @@ class DbManager:
         return quiz_data
 
     def get_rating_list(self, limit: int, offset: int) -> list:
+        if self.shard_conns:
+            # Every user lives in one shard, so the page is within the top (limit + offset) users of each shard
+            counts = self._scatter('''SELECT user_id, COUNT(word_id) AS words_count FROM words GROUP BY user_id
+                                      ORDER BY words_count DESC LIMIT ?''', limit + offset)
+            counts = sorted(counts, key=lambda row: row[1], reverse=True)[offset:offset + limit]
+            if not counts:
+                return []
+            query = f'''SELECT user_id, user_firstname FROM users
+                        WHERE user_id IN ({', '.join('?' for _ in counts)})'''
+            names = dict(self._execute_query(query, *[user_id for user_id, count in counts]).fetchall())
+            return [(user_id, names[user_id], count) for user_id, count in counts if user_id in names]
         query = '''SELECT users.user_id, users.user_firstname, COUNT(words.word_id) AS words_count
                    FROM words
                    INNER JOIN users ON words.user_id = users.user_id
@@ -342,9 +609,131 @@ class DbManager:
 
     def search_user_word(self, user_id: int, word_string: str) -> list:
         query = 'SELECT * FROM words WHERE user_id=? AND word_string=?'
-        result = self._execute_query(query, user_id, word_string).fetchall()
+        result = self._execute_user_query(user_id, query, user_id, word_string).fetchall()
         return result[0] if len(result) > 0 else []
 
     def get_user_achievements(self, user_id: int) -> list:
         query = 'SELECT * FROM achievements WHERE user_id=?'
-        return self._execute_query(query, user_id).fetchall()
+        return self._execute_user_query(user_id, query, user_id).fetchall()
+
+    def add_analytics_events(self, events: list) -> None:
+        """Append (metric, user_id, timestamp) events to the analytics events log"""
+        with self.conn:
+            self.conn.executemany('INSERT INTO analytics_events (metric, user_id, date_added) VALUES (?, ?, ?)',
+                                  events)
+
+    def rollup_analytics_events(self) -> int:
+        """Fold new analytics events into hourly and daily metric counts and per-user lifetime counts
+        (analytics_log). Returns number of folded events"""
+        first_event_id = int(self.get_bot_state(self.ROLLUP_STATE_KEY) or 0)
+        last_event_id = self._execute_query('SELECT MAX(event_id) FROM analytics_events').fetchone()[0]
+        if last_event_id is None or last_event_id <= first_event_id:
+            return 0
+        user_counts = self._execute_query('''SELECT user_id, metric, COUNT(*) FROM analytics_events
+                                             WHERE event_id > ? AND event_id <= ? GROUP BY user_id, metric''',
+                                          first_event_id, last_event_id).fetchall()
+        with self.conn:
+            self.conn.execute('''INSERT INTO metric_hourly (metric, hour, count)
+                                 SELECT metric, CAST(date_added / 3600 AS INTEGER) * 3600 AS event_hour, COUNT(*)
+                                 FROM analytics_events WHERE event_id > ? AND event_id <= ?
+                                 GROUP BY metric, event_hour
+                                 ON CONFLICT (metric, hour) DO UPDATE SET count = count + excluded.count''',
+                              (first_event_id, last_event_id))
+            self.conn.execute('''INSERT INTO metric_daily (metric, day, count)
+                                 SELECT metric, date(date_added, 'unixepoch') AS event_day, COUNT(*)
+                                 FROM analytics_events WHERE event_id > ? AND event_id <= ?
+                                 GROUP BY metric, event_day
+                                 ON CONFLICT (metric, day) DO UPDATE SET count = count + excluded.count''',
+                              (first_event_id, last_event_id))
+            # Without shards user counts are in the main database and are committed together with rollups
+            for user_id, metric, count in user_counts:
+                conn = self._user_conn(user_id)
+                updated = conn.execute('UPDATE analytics_log SET count = count + ? WHERE user_id=? AND metric=?',
+                                       (count, user_id, metric)).rowcount
+                if not updated:
+                    conn.execute('INSERT INTO analytics_log (metric, user_id, count) VALUES (?, ?, ?)',
+                                 (metric, user_id, count))
+            for conn in self.shard_conns:
+                conn.commit()
+            self.conn.execute('INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)',
+                              (self.ROLLUP_STATE_KEY, str(last_event_id)))
+        return last_event_id - first_event_id
+
+    def purge_analytics_events(self, events_before: float, hourly_before: float) -> tuple:
+        """Delete folded raw events and hourly counts (kept downsampled in daily counts) older than given
+        timestamps. Returns numbers of deleted events and hourly rows"""
+        last_event_id = int(self.get_bot_state(self.ROLLUP_STATE_KEY) or 0)
+        with self.conn:
+            events = self.conn.execute('DELETE FROM analytics_events WHERE event_id <= ? AND date_added < ?',
+                                       (last_event_id, events_before)).rowcount
+            hours = self.conn.execute('DELETE FROM metric_hourly WHERE hour < ?', (hourly_before,)).rowcount
+        return events, hours
+
+    def get_hourly_traffic(self, since: float) -> list:
+        query = 'SELECT hour, SUM(count) FROM metric_hourly WHERE hour >= ? GROUP BY hour ORDER BY hour'
+        return self._execute_query(query, since).fetchall()
+
+    def get_daily_traffic(self, since: str) -> list:
+        query = 'SELECT day, SUM(count) FROM metric_daily WHERE day >= ? GROUP BY day ORDER BY day'
+        return self._execute_query(query, since).fetchall()
+
+    def merge_hll_sketches(self, sketches: dict) -> None:
+        """Merge {(sketch name, day): HyperLogLog} into stored sketches. Stored sketch is read and written in one
+        write transaction, so sketches saved by other worker processes at the same time are not lost"""
+        self.conn.commit()  # BEGIN fails inside the transaction Python opened implicitly for pending writes
+        try:
+            self.conn.execute('BEGIN IMMEDIATE')
+            for (name, day), sketch in sketches.items():
+                stored = self.conn.execute('SELECT registers FROM hll_sketches WHERE sketch=? AND day=?',
+                                           (name, day)).fetchone()
+                if stored is not None:
+                    sketch = HyperLogLog.from_bytes(stored[0]).merge(sketch)
+                self.conn.execute('INSERT OR REPLACE INTO hll_sketches (sketch, day, registers) VALUES (?, ?, ?)',
+                                  (name, day, sketch.to_bytes()))
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+    def get_hll_sketches(self, since_day: str, name: str = None) -> list:
+        """Stored (sketch name, registers) since the day, of all sketches or of the sketch with given name"""
+        if name is not None:
+            query = 'SELECT sketch, registers FROM hll_sketches WHERE day >= ? AND sketch=?'
+            return self._execute_query(query, since_day, name).fetchall()
+        query = 'SELECT sketch, registers FROM hll_sketches WHERE day >= ?'
+        return self._execute_query(query, since_day).fetchall()
+
+    def purge_hll_sketches(self, before_day: str) -> int:
+        with self.conn:
+            return self.conn.execute('DELETE FROM hll_sketches WHERE day < ?', (before_day,)).rowcount
+
+    def get_scheduler_job(self, job_name: str):
+        query = 'SELECT last_run, last_duration, last_status FROM scheduler_jobs WHERE job_name=?'
+        result = self._execute_query(query, job_name).fetchall()
+        return result[0] if len(result) > 0 else None
+
+    def save_scheduler_job(self, job_name: str, last_run: float, last_duration: float, last_status: str) -> None:
+        query = '''INSERT OR REPLACE INTO scheduler_jobs (job_name, last_run, last_duration, last_status)
+                   VALUES (?, ?, ?, ?)'''
+        self._execute_query(query, job_name, last_run, last_duration, last_status)
+        self.conn.commit()
+
+    def get_bot_state(self, key: str):
+        query = 'SELECT value FROM bot_state WHERE key=?'
+        result = self._execute_query(query, key).fetchall()
+        return result[0][0] if len(result) > 0 else None
+
+    def get_bot_states(self, prefix: str) -> list:
+        """(key, value) of bot state values with keys starting with prefix"""
+        query = 'SELECT key, value FROM bot_state WHERE substr(key, 1, ?)=?'
+        return self._execute_query(query, len(prefix), prefix).fetchall()
+
+    def set_bot_state(self, key: str, value) -> None:
+        query = 'INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)'
+        self._execute_query(query, key, str(value))
+        self.conn.commit()
+
+    def optimize(self) -> None:
+        self._execute_query('PRAGMA optimize')
+        for conn in self.shard_conns:
+            self._execute_query_on(conn, 'PRAGMA optimize')
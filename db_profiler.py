@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+from contextlib import contextmanager
+import contextvars
+import logging
+import re
+import sqlite3
+import time
+
+# ===== External libs imports =====
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+FILTERS = 'filters'  # Queries made before a handler is chosen (handler filters, e.g. lambdas checking user lang)
+
+# Queries of the update processed in the current context
+_update_profile = contextvars.ContextVar('update_profile', default=None)
+
+
+class StatementStats:
+    __slots__ = ('count', 'total', 'max', 'rows')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.rows = 0
+
+
+class UpdateProfile:
+    """Queries made while processing one update, by handler"""
+
+    def __init__(self, update_id: int):
+        self.update_id = update_id
+        self.queries = 0
+        self.handlers = {}  # handler name -> queries
+        self.statements = {}  # statement -> queries
+
+    def add(self, statement: str) -> None:
+        handler = current_handler.get(None)
+        # Before a handler is chosen the current one is the dispatcher's update handler
+        if handler is None or isinstance(getattr(handler, '__self__', None), Dispatcher):
+            handler_name = FILTERS
+        else:
+            handler_name = handler.__name__
+        self.queries += 1
+        self.handlers[handler_name] = self.handlers.get(handler_name, 0) + 1
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+
+
+class ProfiledCursor:
+    """Cursor wrapper counting fetched rows and fetch time (SQLite executes SELECT lazily, while rows are fetched)"""
+
+    def __init__(self, profiler: 'QueryProfiler', cursor: sqlite3.Cursor, statement: str, query: str, args: tuple,
+                 elapsed: float):
+        self._profiler = profiler
+        self._cursor = cursor
+        self._statement = statement
+        self._query = query
+        self._args = args
+        self._elapsed = elapsed
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def _fetch(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        elapsed = time.perf_counter() - start
+        rows = len(result) if isinstance(result, list) else int(result is not None)
+        self._elapsed += elapsed
+        self._profiler.add_fetch(self._cursor.connection, self._statement, self._query, self._args, elapsed,
+                                 self._elapsed, rows)
+        return result
+
+    def fetchall(self) -> list:
+        return self._fetch(self._cursor.fetchall)
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, size: int = None):
+        return self._fetch(self._cursor.fetchmany, size if size is not None else self._cursor.arraysize)
+
+
+class QueryProfiler(BaseMiddleware):
+    """Opt-in SQL profiler used by DbManager: per-statement count, total and max time and returned rows.
+    Slow queries are logged with their query plan. As an update middleware it counts queries per update and
+    warns about updates exceeding the queries budget (N+1 queries in handlers or handler filters)"""
+
+    SLOW_QUERY = .1  # Seconds
+    QUERY_BUDGET = 20  # Queries per update
+    EXPLAIN_INTERVAL = 10 * 60  # Seconds between query plan logs of the same statement
+
+    def __init__(self, slow_query: float = SLOW_QUERY, query_budget: int = QUERY_BUDGET):
+        self.slow_query = slow_query
+        self.query_budget = query_budget
+        self.statements = {}  # statement -> StatementStats
+        self.over_budget = []  # UpdateProfile of updates exceeded the budget (inside expect_max_queries)
+        self._explained = {}  # statement -> last query plan log time
+        self._collect_over_budget = False
+        super(QueryProfiler, self).__init__()
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Statement text without formatting and with collapsed lists of parameters"""
+        return re.sub(r'\(\?(, ?\?)+\)', '(?, ...)', ' '.join(query.split()))
+
+    def record(self, conn: sqlite3.Connection, query: str, args: tuple, cursor: sqlite3.Cursor,
+               elapsed: float) -> ProfiledCursor:
+        statement = self.normalize(query)
+        stats = self.statements.get(statement)
+        if stats is None:
+            stats = self.statements[statement] = StatementStats()
+        stats.count += 1
+        stats.total += elapsed
+        stats.max = max(stats.max, elapsed)
+        profile = _update_profile.get()
+        if profile is not None:
+            profile.add(statement)
+        if elapsed >= self.slow_query:
+            self._log_slow(conn, statement, query, args, elapsed)
+        return ProfiledCursor(self, cursor, statement, query, args, elapsed)
+
+    def record_fetched(self, conn: sqlite3.Connection, query: str, args: tuple, elapsed: float, rows: int) -> None:
+        """Account query which rows were already fetched (e.g. in executor thread), elapsed includes the fetch"""
+        self.record(conn, query, args, None, elapsed)
+        self.statements[self.normalize(query)].rows += rows
+
+    def add_fetch(self, conn: sqlite3.Connection, statement: str, query: str, args: tuple, elapsed: float,
+                  query_elapsed: float, rows: int) -> None:
+        """Account rows fetching, query_elapsed is the query time including all its fetches so far"""
+        stats = self.statements[statement]
+        stats.total += elapsed
+        stats.rows += rows
+        if query_elapsed > stats.max:
+            stats.max = query_elapsed
+        if query_elapsed >= self.slow_query > query_elapsed - elapsed:
+            self._log_slow(conn, statement, query, args, query_elapsed)
+
+    def _log_slow(self, conn: sqlite3.Connection, statement: str, query: str, args: tuple, elapsed: float) -> None:
+        logger = logging.getLogger(type(self).__name__)
+        now = time.monotonic()
+        if now - self._explained.get(statement, -self.EXPLAIN_INTERVAL) < self.EXPLAIN_INTERVAL:
+            logger.warning(f'Slow query ({elapsed * 1000:.0f}ms): {statement}')
+            return
+        self._explained[statement] = now
+        try:
+            plan = '\n'.join(f'  {row[-1]}' for row in conn.execute('EXPLAIN QUERY PLAN ' + query, args))
+        except sqlite3.Error as error:
+            plan = f'  not available ({error})'
+        logger.warning(f'Slow query ({elapsed * 1000:.0f}ms): {statement}\nQuery plan:\n{plan}')
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        _update_profile.set(UpdateProfile(update.update_id))
+
+    async def on_post_process_update(self, update: types.Update, result, data: dict):
+        profile = _update_profile.get()
+        _update_profile.set(None)
+        if profile is None or profile.queries <= self.query_budget:
+            return
+        if self._collect_over_budget:
+            self.over_budget.append(profile)
+        handlers = ', '.join(f'{name}: {count}' for name, count in
+                             sorted(profile.handlers.items(), key=lambda item: item[1], reverse=True))
+        statement, count = max(profile.statements.items(), key=lambda item: item[1])
+        logging.getLogger(type(self).__name__).warning(
+            f'Update [{update.update_id}] made {profile.queries} queries (budget {self.query_budget}) '
+            f'[{handlers}], most repeated ({count}): {statement}')
+
+    @contextmanager
+    def expect_max_queries(self, budget: int = None):
+        """Fail with AssertionError if an update processed inside the block exceeded the queries budget.
+        Used by benchmarks and tests: with profiler.expect_max_queries(5): await dp.process_updates(updates)"""
+        saved_budget = self.query_budget
+        self.query_budget = budget if budget is not None else saved_budget
+        self.over_budget = []
+        self._collect_over_budget = True
+        try:
+            yield self
+        finally:
+            self.query_budget = saved_budget
+            self._collect_over_budget = False
+        if self.over_budget:
+            raise AssertionError('Queries budget exceeded: ' + ', '.join(
+                f'update {profile.update_id} made {profile.queries} queries {profile.handlers}'
+                for profile in self.over_budget))
+
+    def top(self, limit: int = 10, key: str = 'total') -> list:
+        """Statements with the biggest total (or max, count, rows) as (statement, StatementStats)"""
+        return sorted(self.statements.items(), key=lambda item: getattr(item[1], key), reverse=True)[:limit]
+
+    def reset(self) -> None:
+        self.statements = {}
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+from collections import OrderedDict
+import copy
+import json
+import logging
+import sqlite3
+import time
+import typing
+import zlib
+
+# ===== External libs imports =====
+
+from aiogram.dispatcher.storage import BaseStorage
+
+
+class SQLiteStorage(BaseStorage):
+    """Persistent FSM storage on local SQLite database. Recently used states are kept in a bounded LRU cache,
+    changes are buffered and written in one transaction per flush interval, so hot keys (e.g. quiz progress)
+    are written once per interval. Serialized state is compact JSON, compressed with zlib when it is big"""
+
+    TABLE = '''CREATE TABLE IF NOT EXISTS fsm_states (
+        chat INTEGER NOT NULL,
+        user INTEGER NOT NULL,
+        state TEXT,
+        data BLOB,
+        bucket BLOB,
+        date_updated INTEGER NOT NULL,
+        PRIMARY KEY (chat, user)
+    )'''
+    CACHE_SIZE = 1000
+    FLUSH_INTERVAL = 1  # Seconds
+    TTL = 7 * 24 * 60 * 60  # Seconds since the last state change
+    COMPRESS_THRESHOLD = 256  # Bytes
+    RAW, COMPRESSED = b'j', b'z'
+
+    def __init__(self, path_to_db: str, ttl: int = TTL, cache_size: int = CACHE_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.path_to_db = path_to_db
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.conn = sqlite3.connect(path_to_db, timeout=10)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(self.TABLE)
+        self.conn.commit()
+        self._cache = OrderedDict()  # (chat, user) -> [state, data, bucket, date_updated]
+        self._dirty = set()
+        self._flush_task = None
+
+    # ===== Serialization =====
+
+    @classmethod
+    def _dumps(cls, value: dict) -> typing.Optional[bytes]:
+        if not value:
+            return None
+        raw = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if len(raw) > cls.COMPRESS_THRESHOLD:
+            return cls.COMPRESSED + zlib.compress(raw)
+        return cls.RAW + raw
+
+    @classmethod
+    def _loads(cls, value: typing.Optional[bytes]) -> dict:
+        if not value:
+            return {}
+        raw = zlib.decompress(value[1:]) if value[:1] == cls.COMPRESSED else value[1:]
+        return json.loads(raw.decode('utf-8'))
+
+    # ===== Records cache =====
+
+    def _get_record(self, chat, user) -> list:
+        key = (chat, user)
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+            return record
+        row = self.conn.execute('SELECT state, data, bucket, date_updated FROM fsm_states WHERE chat=? AND user=?',
+                                key).fetchone()
+        if row is None or row[3] < time.time() - self.ttl:
+            record = [None, {}, {}, int(time.time())]
+        else:
+            record = [row[0], self._loads(row[1]), self._loads(row[2]), row[3]]
+        self._cache[key] = record
+        self._shrink_cache()
+        return record
+
+    def _shrink_cache(self) -> None:
+        """Drop least recently used records which are already written to the database (except the last used one)"""
+        if len(self._cache) <= self.cache_size:
+            return
+        for key in list(self._cache)[:-1]:
+            if len(self._cache) <= self.cache_size:
+                break
+            if key not in self._dirty:
+                del self._cache[key]
+
+    def _touch(self, chat, user, record: list) -> None:
+        record[3] = int(time.time())
+        self._dirty.add((chat, user))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self.flush()
+
+    def flush(self) -> None:
+        """Write buffered changes in one transaction"""
+        if not self._dirty:
+            return
+        updates, deletes = [], []
+        for key in self._dirty:
+            record = self._cache.get(key)
+            if record is None:
+                continue
+            state, data, bucket, date_updated = record
+            if state is None and not data and not bucket:
+                deletes.append(key)
+            else:
+                updates.append((*key, state, self._dumps(data), self._dumps(bucket), date_updated))
+        try:
+            with self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO fsm_states VALUES (?, ?, ?, ?, ?, ?)', updates)
+                self.conn.executemany('DELETE FROM fsm_states WHERE chat=? AND user=?', deletes)
+            self._dirty.clear()
+        except sqlite3.Error as error:
+            logging.getLogger(type(self).__name__).error(f'FSM states flush error ({error})')
+        self._shrink_cache()
+
+    def purge_expired(self) -> int:
+        """Delete states which were not changed for TTL. Returns count of deleted states"""
+        self.flush()
+        expire_before = int(time.time()) - self.ttl
+        for key in [key for key, record in self._cache.items() if record[3] < expire_before]:
+            del self._cache[key]
+        with self.conn:
+            deleted = self.conn.execute('DELETE FROM fsm_states WHERE date_updated < ?', (expire_before,)).rowcount
+        logging.getLogger(type(self).__name__).info(f'Expired FSM states purged [{deleted}]')
+        return deleted
+
+    # ===== BaseStorage implementation =====
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        self.flush()
+
+    async def wait_closed(self):
+        self.conn.close()
+
+    async def get_state(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        chat, user = self.check_address(chat=chat, user=user)
+        state = self._get_record(chat, user)[0]
+        return state if state is not None else default
+
+    async def get_data(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        chat, user = self.check_address(chat=chat, user=user)
+        return copy.deepcopy(self._get_record(chat, user)[1])
+
+    async def update_data(self, *, chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None, data: dict = None, **kwargs):
+        if data is None:
+            data = {}
+        chat, user = self.check_address(chat=chat, user=user)
+        record = self._get_record(chat, user)
+        record[1].update(data, **kwargs)
+        self._touch(chat, user, record)
+
+    async def set_state(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        record = self._get_record(chat, user)
+        record[0] = state
+        self._touch(chat, user, record)
+
+    async def set_data(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        record = self._get_record(chat, user)
+        record[1] = copy.deepcopy(data) if data else {}
+        self._touch(chat, user, record)
+
+    async def reset_state(self, *, chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None, with_data: typing.Optional[bool] = True):
+        await self.set_state(chat=chat, user=user, state=None)
+        if with_data:
+            await self.set_data(chat=chat, user=user, data={})
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        chat, user = self.check_address(chat=chat, user=user)
+        return copy.deepcopy(self._get_record(chat, user)[2])
+
+    async def set_bucket(self, *, chat: typing.Union[str, int, None] = None, user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        record = self._get_record(chat, user)
+        record[2] = copy.deepcopy(bucket) if bucket else {}
+        self._touch(chat, user, record)
+
+    async def update_bucket(self, *, chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None, bucket: typing.Dict = None, **kwargs):
+        if bucket is None:
+            bucket = {}
+        chat, user = self.check_address(chat=chat, user=user)
+        record = self._get_record(chat, user)
+        record[2].update(bucket, **kwargs)
+        self._touch(chat, user, record)
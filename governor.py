@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+from collections import deque
+import contextvars
+import logging
+import time
+
+# ===== External libs imports =====
+
+from aiogram import Bot
+from aiogram.utils import exceptions
+
+# ===== Local imports =====
+
+import metrics
+from rate_limit import TokenBucket
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Priority lane of outgoing Bot API requests made in current context (e.g. broadcast workers set bulk lane)
+api_priority = contextvars.ContextVar('api_priority', default=PRIORITY_INTERACTIVE)
+
+
+class RateGovernor:
+    """Outgoing Telegram Bot API requests governor. Tracks global and per-chat limits with token buckets
+    and grants requests by priority lanes, so interactive replies always go ahead of bulk mailings"""
+
+    GLOBAL_RATE = 30  # Messages per second for all chats
+    GLOBAL_BURST = 1  # A full second of tokens after idle time would let a mailing start at double rate
+    CHAT_RATE = 1  # Messages per second for one private chat
+    CHAT_BURST = 3
+    GROUP_RATE = 20 / 60  # Messages per second for one group chat
+    GROUP_BURST = 5
+    LANES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+    LANE_NAMES = ('interactive', 'bulk')
+    SCAN_DEPTH = 64  # How deep to look into a lane for a request to a chat which is not limited
+    MAX_IDLE_BUCKETS = 10000
+
+    def __init__(self, global_rate: float = GLOBAL_RATE):
+        self.global_bucket = TokenBucket(global_rate, capacity=self.GLOBAL_BURST)
+        self.chat_buckets = {}
+        self.lanes = [deque() for _ in self.LANES]
+        self._wakeup = asyncio.Event()
+        self._pump_task = None
+        # Stats per lane: granted requests, total and max wait time
+        self.granted = [0 for _ in self.LANES]
+        self.wait_total = [0. for _ in self.LANES]
+        self.wait_max = [0. for _ in self.LANES]
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_IDLE_BUCKETS:
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.is_idle()}
+            # Negative chat IDs are groups and channels which have lower limits
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.GROUP_RATE, capacity=self.GROUP_BURST)
+            else:
+                bucket = TokenBucket(self.CHAT_RATE, capacity=self.CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id=None, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """Wait for permission to send request to chat (None for requests without chat). Returns wait time"""
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self.lanes[priority].append((chat_id, future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.ensure_future(self._pump())
+        self._wakeup.set()
+        await future
+        wait = time.monotonic() - start
+        self.granted[priority] += 1
+        self.wait_total[priority] += wait
+        self.wait_max[priority] = max(self.wait_max[priority], wait)
+        return wait
+
+    def _grant_next(self) -> float:
+        """Grant one request if possible. Returns 0 if granted or delay before next attempt"""
+        global_delay = self.global_bucket.delay()
+        if global_delay > 0:
+            return global_delay
+        min_delay = None
+        for lane in self.lanes:
+            for index, (chat_id, future) in enumerate(lane):
+                if index >= self.SCAN_DEPTH:
+                    break
+                if future.done():  # Waiter was cancelled
+                    del lane[index]
+                    return 0
+                chat_delay = self._chat_bucket(chat_id).delay() if chat_id is not None else 0
+                if chat_delay == 0:
+                    del lane[index]
+                    self.global_bucket.try_acquire()
+                    if chat_id is not None:
+                        self._chat_bucket(chat_id).try_acquire()
+                    future.set_result(None)
+                    return 0
+                min_delay = chat_delay if min_delay is None else min(min_delay, chat_delay)
+        return min_delay
+
+    async def _pump(self) -> None:
+        while any(self.lanes):
+            delay = self._grant_next()
+            if delay:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    def pause(self, chat_id, seconds: float) -> None:
+        """Pause only the bucket affected by RetryAfter: chat bucket or global one for requests without chat"""
+        if chat_id is not None:
+            self._chat_bucket(chat_id).pause(seconds)
+        else:
+            self.global_bucket.pause(seconds)
+        logging.getLogger(type(self).__name__).warning(f'Bucket [{chat_id or "global"}] paused for {seconds}s')
+
+    def stats(self) -> dict:
+        return {
+            'chat_buckets': len(self.chat_buckets),
+            'lanes': {
+                name: {
+                    'queue_depth': len(self.lanes[lane]),
+                    'granted': self.granted[lane],
+                    'wait_avg': self.wait_total[lane] / self.granted[lane] if self.granted[lane] else 0.,
+                    'wait_max': self.wait_max[lane]
+                } for lane, name in zip(self.LANES, self.LANE_NAMES)
+            }
+        }
+
+
+class GovernedBot(Bot):
+    """Bot which passes every outgoing send/edit request through RateGovernor"""
+
+    GOVERNED_METHODS = ('send', 'edit', 'forward', 'copy')
+
+    def __init__(self, token: str, governor: RateGovernor = None, **kwargs):
+        super().__init__(token, **kwargs)
+        self.governor = governor if governor is not None else RateGovernor()
+
+    async def request(self, method: str, data=None, files=None, **kwargs):
+        if not method.lower().startswith(self.GOVERNED_METHODS):
+            return await self._timed_request(method, data, files, **kwargs)
+        chat_id = data.get('chat_id') if data else None
+        await self.governor.acquire(chat_id, api_priority.get())
+        try:
+            return await self._timed_request(method, data, files, **kwargs)
+        except exceptions.RetryAfter as e:
+            self.governor.pause(chat_id, e.timeout)
+            raise
+
+    async def _timed_request(self, method: str, data=None, files=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.API_SECONDS.observe(elapsed, method)
+            metrics.add_time('api', elapsed)
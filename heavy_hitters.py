@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import heapq
+import json
+
+# ===== Local imports =====
+
+from db_manager import DbManager
+
+
+class SpaceSaving:
+    """Space-Saving heavy hitters summary: keeps at most `capacity` counters, a new item replaces the item with
+    the minimal count and inherits it as the error. Any item seen more than N / capacity times is in the summary
+    and its count is overestimated by at most its error. Counts are decayed to follow recent trends"""
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counters = {}  # item -> [count, error]
+        self._heap = []  # (count, item) with stale entries, the minimal actual one is evicted
+
+    def add(self, item: str, weight: float = 1) -> None:
+        counter = self.counters.get(item)
+        if counter is None:
+            error = 0
+            if len(self.counters) >= self.capacity:
+                error = self._evict()
+            counter = self.counters[item] = [error, error]
+        counter[0] += weight
+        heapq.heappush(self._heap, (counter[0], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._rebuild_heap()
+
+    def _evict(self) -> float:
+        while True:
+            count, item = heapq.heappop(self._heap)
+            counter = self.counters.get(item)
+            if counter is not None and counter[0] == count:
+                del self.counters[item]
+                return count
+
+    def _rebuild_heap(self) -> None:
+        self._heap = [(counter[0], item) for item, counter in self.counters.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, k: int) -> list:
+        """The k most frequent items as (item, count, error) by count desc"""
+        return [(item, count, error) for item, (count, error)
+                in heapq.nlargest(k, self.counters.items(), key=lambda counter: counter[1][0])]
+
+    def decay(self, factor: float = .5, min_count: float = 1) -> None:
+        """Multiply counts by factor, forgetting items which fall below min_count"""
+        self.counters = {item: [count * factor, error * factor] for item, (count, error) in self.counters.items()
+                         if count * factor >= min_count}
+        self._rebuild_heap()
+
+    def merge(self, other: 'SpaceSaving') -> 'SpaceSaving':
+        """Add counters of another summary (e.g. snapshot of another worker), keeping the biggest ones"""
+        for item, (count, error) in other.counters.items():
+            counter = self.counters.setdefault(item, [0, 0])
+            counter[0] += count
+            counter[1] += error
+        if len(self.counters) > self.capacity:
+            self.counters = dict(heapq.nlargest(self.capacity, self.counters.items(),
+                                                key=lambda counter: counter[1][0]))
+        self._rebuild_heap()
+        return self
+
+    def to_json(self) -> str:
+        return json.dumps({'capacity': self.capacity, 'counters': self.counters}, separators=(',', ':'),
+                          ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, data: str) -> 'SpaceSaving':
+        data = json.loads(data)
+        summary = cls(data['capacity'])
+        summary.counters = data['counters']
+        summary._rebuild_heap()
+        return summary
+
+
+class WordTrends:
+    """Most added and most searched words (with languages pair) tracked in memory and snapshotted to the bot
+    state, one snapshot per worker process"""
+
+    KINDS = ('added', 'searched')
+    CAPACITY = 1000
+
+    def __init__(self, db_manager: DbManager, worker_id: int = None, capacity: int = CAPACITY):
+        self.db = db_manager
+        self.worker_id = worker_id or 0
+        self.summaries = {}
+        for kind in self.KINDS:
+            snapshot = self.db.get_bot_state(self._state_key(kind, self.worker_id))
+            self.summaries[kind] = SpaceSaving.from_json(snapshot) if snapshot is not None else SpaceSaving(capacity)
+
+    @staticmethod
+    def _state_key(kind: str, worker_id) -> str:
+        return f'trending_{kind}_{worker_id}'
+
+    @staticmethod
+    def make_item(word: str, from_lang: str, to_lang: str) -> str:
+        return f'{from_lang}:{to_lang}:{" ".join(word.split()).lower()}'
+
+    @staticmethod
+    def parse_item(item: str) -> tuple:
+        """Returns (word, from_lang, to_lang)"""
+        from_lang, to_lang, word = item.split(':', 2)
+        return word, from_lang, to_lang
+
+    def add(self, kind: str, word: str, from_lang: str, to_lang: str) -> None:
+        self.summaries[kind].add(self.make_item(word, from_lang, to_lang))
+
+    def snapshot(self) -> None:
+        for kind, summary in self.summaries.items():
+            self.db.set_bot_state(self._state_key(kind, self.worker_id), summary.to_json())
+
+    def decay(self, factor: float = .5) -> None:
+        for summary in self.summaries.values():
+            summary.decay(factor)
+
+    def top(self, kind: str, k: int = 10) -> list:
+        """Top words of all workers as (word, from_lang, to_lang, count)"""
+        summary = SpaceSaving(self.summaries[kind].capacity).merge(self.summaries[kind])
+        for key, snapshot in self.db.get_bot_states(f'trending_{kind}_'):
+            if key != self._state_key(kind, self.worker_id):
+                summary.merge(SpaceSaving.from_json(snapshot))
+        return [self.parse_item(item) + (round(count),) for item, count, error in summary.top(k)]
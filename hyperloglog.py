@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import hashlib
+import math
+import zlib
+
+
+class HyperLogLog:
+    """HyperLogLog sketch for counting unique values (e.g. users) with fixed memory: 2 ** precision one-byte
+    registers, standard error is about 1.04 / sqrt(2 ** precision) (1.6% for the default 4096 registers).
+    Sketches of the same precision are merged by registers maximum, so per-day sketches give counts for any period"""
+
+    PRECISION = 12
+
+    def __init__(self, precision: int = PRECISION, registers: bytes = None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError(f'Sketch must have {self.size} registers, got {len(self.registers)}')
+
+    def add(self, value) -> bool:
+        """Add value to the sketch. Returns True if the sketch has changed"""
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1  # Position of the first 1 bit
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other: 'HyperLogLog') -> 'HyperLogLog':
+        if other.precision != self.precision:
+            raise ValueError('Sketches with different precision can not be merged')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / sum(2. ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)  # Linear counting for small cardinalities
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        """Compact form for storage (registers of small sketches are mostly zeros)"""
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        registers = zlib.decompress(data)
+        return cls(len(registers).bit_length() - 1, registers)
+
+    @classmethod
+    def merged(cls, sketches_data: list) -> 'HyperLogLog':
+        """Union of stored sketches"""
+        result = cls()
+        for data in sketches_data:
+            result.merge(cls.from_bytes(data))
+        return result
@@ -102,12 +102,21 @@ class LangManager:
             statistics_string += f'{stat[2]} [{stat[1]}]\n'
         return statistics_string
 
-    def get_admin_users_page(self, lang_code: str) -> str:
-        users_list = self.db.get_users_list()
+    def get_admin_users_page(self, lang_code: str, active_users: list, feature_users: list) -> str:
+        """Users count, active users for the day, week and month and unique users of features"""
         users_page = self.get_page_text('ADMIN', 'USERS', lang_code) + '\n\n'
-        users_page += str(len(users_list))
+        users_page += str(self.db.get_users_count()) + '\n\n'
+        for title, count in zip(self.get_page_text('ADMIN', 'ACTIVE_USERS', lang_code), active_users):
+            users_page += f'{title}: {count}\n'
+        if len(feature_users) > 0:
+            users_page += '\n' + self.get_page_text('ADMIN', 'FEATURE_USERS', lang_code) + ':\n\n'
+            for feature, count in feature_users:
+                users_page += f'{feature} [{count}]\n'
         return users_page
 
+    def get_mailing_text(self, text: str, lang_code: str) -> str:
+        return text + '\n\n' + self.get_page_text('MAILINGS', 'FOOTER', lang_code)
+
     def get_database_page(self, lang_code: str) -> str:
         return self.get_page_text('ADMIN', 'DATABASE', lang_code)
 
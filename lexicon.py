@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import argparse
+import bisect
+import logging
+import mmap
+import os
+import random
+import struct
+import time
+
+
+class OfflineLexicon:
+    """Memory-mapped bilingual lexicon for translation lookups without network.
+
+    File layout (little-endian):
+        header  - magic (4s), format version (I), entries count (I)
+        index   - (count + 1) record offsets (I) relative to the data section
+        data    - records sorted by key: key \\t transcription \\t translations joined by \\x1f
+    Key is "<from_lang>:<to_lang>:<normalized word>", so one file serves every language pair.
+    """
+
+    MAGIC = b'VLEX'
+    VERSION = 1
+    HEADER = struct.Struct('<4sII')
+    OFFSET = struct.Struct('<I')
+    FIELD_SEPARATOR = b'\t'
+    TRANSLATIONS_SEPARATOR = '\x1f'
+
+    def __init__(self, path_to_lexicon: str):
+        self.path_to_lexicon = path_to_lexicon
+        self._file = open(path_to_lexicon, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = self.HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise ValueError(f'{path_to_lexicon} is not a lexicon file (version {self.VERSION})')
+        self._index_start = self.HEADER.size
+        self._data_start = self._index_start + (self.count + 1) * self.OFFSET.size
+        self._keys = _KeysView(self)
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def make_key(word: str, from_lang: str, to_lang: str) -> bytes:
+        return f'{from_lang.lower()}:{to_lang.lower()}:{" ".join(word.split()).lower()}'.encode('utf-8')
+
+    def _offset(self, index: int) -> int:
+        return self.OFFSET.unpack_from(self._mm, self._index_start + index * self.OFFSET.size)[0]
+
+    def _record(self, index: int) -> bytes:
+        return self._mm[self._data_start + self._offset(index):self._data_start + self._offset(index + 1)]
+
+    def _key(self, index: int) -> bytes:
+        start = self._data_start + self._offset(index)
+        return self._mm[start:self._mm.find(self.FIELD_SEPARATOR, start)]
+
+    def lookup(self, word: str, from_lang: str, to_lang: str):
+        """Returns {'word', 'transcription', 'translations'} (same shape as leo_translate) or None"""
+        key = self.make_key(word, from_lang, to_lang)
+        index = bisect.bisect_left(self._keys, key)
+        if index == self.count or self._key(index) != key:
+            return None
+        _, transcription, translations = self._record(index).decode('utf-8').split('\t')
+        return {
+            'word': word,
+            'transcription': transcription,
+            'translations': translations.split(self.TRANSLATIONS_SEPARATOR) if translations else []
+        }
+
+    def random_keys(self, amount: int) -> list:
+        return [self._key(random.randrange(self.count)).decode('utf-8') for _ in range(min(amount, self.count))]
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+class _KeysView:
+    """Lazy sequence of lexicon keys for bisect"""
+
+    def __init__(self, lexicon: OfflineLexicon):
+        self.lexicon = lexicon
+
+    def __len__(self):
+        return self.lexicon.count
+
+    def __getitem__(self, index: int) -> bytes:
+        return self.lexicon._key(index)
+
+
+def read_word_list(path_to_word_list: str):
+    """Parse word list lines: from_lang \\t to_lang \\t word \\t transcription \\t translation1;translation2"""
+    with open(path_to_word_list, 'r', encoding='utf-8') as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) != 5:
+                logging.getLogger('OfflineLexicon').warning(f'Skipped malformed line {line_number}: {line!r}')
+                continue
+            from_lang, to_lang, word, transcription, translations = fields
+            yield from_lang, to_lang, word, transcription, \
+                [item.strip() for item in translations.split(';') if item.strip()]
+
+
+def build_lexicon(entries, path_to_lexicon: str) -> int:
+    """Build lexicon file from (from_lang, to_lang, word, transcription, translations) entries.
+    Duplicated keys are merged, translations order is kept. Returns number of written entries"""
+    records = {}
+    for from_lang, to_lang, word, transcription, translations in entries:
+        key = OfflineLexicon.make_key(word, from_lang, to_lang)
+        if key in records:
+            known_transcription, known_translations = records[key]
+            records[key] = (known_transcription or transcription,
+                            known_translations + [item for item in translations if item not in known_translations])
+        else:
+            records[key] = (transcription, list(translations))
+    offsets = [0]
+    data = bytearray()
+    for key in sorted(records):
+        transcription, translations = records[key]
+        data += key + b'\t' + transcription.replace('\t', ' ').encode('utf-8') + b'\t' + \
+            OfflineLexicon.TRANSLATIONS_SEPARATOR.join(translations).replace('\t', ' ').encode('utf-8')
+        offsets.append(len(data))
+    tmp_path = path_to_lexicon + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(OfflineLexicon.HEADER.pack(OfflineLexicon.MAGIC, OfflineLexicon.VERSION, len(records)))
+        file.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        file.write(data)
+    os.replace(tmp_path, path_to_lexicon)
+    return len(records)
+
+
+def benchmark_lexicon(path_to_lexicon: str, lookups: int = 100000) -> dict:
+    """Measure lookup latency on random existing keys and on misses"""
+    lexicon = OfflineLexicon(path_to_lexicon)
+    try:
+        keys = [key.split(':', 2) for key in lexicon.random_keys(1000)]
+        if not keys:
+            return {'entries': 0}
+        hits = [(keys[i % len(keys)][2], keys[i % len(keys)][0], keys[i % len(keys)][1]) for i in range(lookups)]
+        start = time.perf_counter()
+        for word, from_lang, to_lang in hits:
+            lexicon.lookup(word, from_lang, to_lang)
+        hit_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for word, from_lang, to_lang in hits:
+            lexicon.lookup(word + '~', from_lang, to_lang)
+        miss_time = time.perf_counter() - start
+        return {
+            'entries': len(lexicon),
+            'lookups': lookups,
+            'hit_us': round(hit_time / lookups * 1e6, 3),
+            'miss_us': round(miss_time / lookups * 1e6, 3)
+        }
+    finally:
+        lexicon.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline lexicon builder and lookup benchmark')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='Build lexicon file from tab-separated word list')
+    build_parser.add_argument('word_list')
+    build_parser.add_argument('lexicon')
+    bench_parser = subparsers.add_parser('bench', help='Benchmark lookups in lexicon file')
+    bench_parser.add_argument('lexicon')
+    bench_parser.add_argument('--lookups', type=int, default=100000)
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if arguments.command == 'build':
+        written = build_lexicon(read_word_list(arguments.word_list), arguments.lexicon)
+        logging.getLogger('OfflineLexicon').info(f'{written} entries written to {arguments.lexicon}')
+    else:
+        print(benchmark_lexicon(arguments.lexicon, arguments.lookups))
@@ -0,0 +1,487 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import argparse
+import asyncio
+from collections import OrderedDict
+import json
+import logging
+import os
+import random
+import string
+import tempfile
+import time
+
+# ===== External libs imports =====
+
+from aiogram import Bot, types
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import ClientSession, web
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'load_harness.db')  # Load harness doesn't use the bot database
+
+import config
+from benchmark import build_synthetic_db
+from fsm_storage import SQLiteStorage
+from governor import GovernedBot
+from ordered_dispatcher import ChatOrderedDispatcher
+from vocabulary_bot import VocabularyBot
+from webhook import SECRET_TOKEN_HEADER, WebhookServer
+
+TOKEN = '123456:load-harness'
+WEBHOOK_SECRET = 'load-harness'
+STARTUP_METHODS = ('getMe', 'getUpdates', 'setMyCommands', 'deleteWebhook', 'setWebhook')
+
+
+class FakeChat:
+    """Bot messages of one chat as the user sees them: recent messages with inline keyboards and the current
+    reply keyboard"""
+
+    MAX_MESSAGES = 20
+
+    def __init__(self):
+        self.messages = OrderedDict()  # message_id -> message
+        self.keyboard = []  # Reply keyboard buttons texts, row by row
+
+    def add(self, message: dict) -> None:
+        self.messages[message['message_id']] = message
+        if len(self.messages) > self.MAX_MESSAGES:
+            self.messages.popitem(last=False)
+
+    def find_button(self, prefix: str):
+        """The latest message having inline button with callback data starting with prefix as (message, data)"""
+        for message in reversed(self.messages.values()):
+            for row in message.get('reply_markup', {}).get('inline_keyboard', []):
+                for button in row:
+                    if button.get('callback_data', '').startswith(prefix):
+                        return message, button['callback_data']
+        return None, None
+
+
+class FakeBotAPI:
+    """Local stand-in for the Telegram Bot API server. Serves the methods used by the bot with Telegram shaped
+    results, delivers pushed updates to getUpdates long polling and counts calls by method. Not strict server
+    accepts edits and deletes of unknown messages (e.g. messages of replayed updates sent before capture)"""
+
+    def __init__(self, strict: bool = True):
+        self.strict = strict
+        self.me = {'id': int(TOKEN.split(':')[0]), 'is_bot': True, 'first_name': 'Vocabulary Bot',
+                   'username': 'vocabulary_load_bot'}
+        self.chats = {}
+        self.calls = {}
+        self.updates = []
+        self.url = None
+        self._message_id = 0
+        self._updates_event = asyncio.Event()
+        self._runner = None
+        self._methods = {
+            'getMe': self.get_me,
+            'getUpdates': self.get_updates,
+            'sendMessage': self.send_message,
+            'sendPoll': self.send_poll,
+            'editMessageText': self.edit_message_text,
+            'editMessageReplyMarkup': self.edit_message_reply_markup,
+            'deleteMessage': self.delete_message,
+        }
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle_request)
+
+    def chat(self, chat_id: int) -> FakeChat:
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            chat = self.chats[chat_id] = FakeChat()
+        return chat
+
+    def next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    def push_update(self, update: dict) -> None:
+        self.updates.append(update)
+        self._updates_event.set()
+
+    def release_polling(self) -> None:
+        """Answer pending getUpdates long polling requests (used on polling stop)"""
+        self._updates_event.set()
+
+    def reset_calls(self) -> None:
+        self.calls = {}
+
+    async def handle_request(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        data = dict(await request.post())
+        handler = self._methods.get(method)
+        try:
+            result = await handler(data) if handler is not None else True
+        except LookupError as error:
+            return web.json_response({'ok': False, 'error_code': 400, 'description': f'Bad Request: {error}'},
+                                     status=400)
+        return web.json_response({'ok': True, 'result': result})
+
+    async def get_me(self, data: dict) -> dict:
+        return self.me
+
+    async def get_updates(self, data: dict) -> list:
+        offset = int(data.get('offset') or 0)
+        limit = int(data.get('limit') or 100)
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates:
+            self._updates_event.clear()
+            try:
+                await asyncio.wait_for(self._updates_event.wait(), float(data.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    def _message(self, data: dict, **fields) -> dict:
+        chat_id = int(data['chat_id'])
+        message = {'message_id': self.next_message_id(), 'date': int(time.time()),
+                   'chat': {'id': chat_id, 'type': 'private'}, 'from': self.me, **fields}
+        self._apply_markup(chat_id, message, data.get('reply_markup'))
+        self.chat(chat_id).add(message)
+        return message
+
+    def _apply_markup(self, chat_id: int, message: dict, reply_markup: str) -> None:
+        markup = json.loads(reply_markup) if reply_markup else {}
+        message.pop('reply_markup', None)
+        if 'inline_keyboard' in markup:
+            message['reply_markup'] = markup
+        elif 'keyboard' in markup:
+            self.chat(chat_id).keyboard = [button['text'] if isinstance(button, dict) else button
+                                           for row in markup['keyboard'] for button in row]
+        elif markup.get('remove_keyboard'):
+            self.chat(chat_id).keyboard = []
+
+    def _find_message(self, data: dict) -> dict:
+        chat_id, message_id = int(data['chat_id']), int(data['message_id'])
+        message = self.chat(chat_id).messages.get(message_id)
+        if message is None:
+            if self.strict:
+                raise LookupError('message not found')
+            message = {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+                       'from': self.me, 'text': ''}
+            self.chat(chat_id).add(message)
+        return message
+
+    async def send_message(self, data: dict) -> dict:
+        return self._message(data, text=data['text'])
+
+    async def send_poll(self, data: dict) -> dict:
+        poll = {
+            'id': str(self.next_message_id()),
+            'question': data['question'],
+            'options': [{'text': option, 'voter_count': 0} for option in json.loads(data['options'])],
+            'total_voter_count': 0,
+            'is_closed': False,
+            'is_anonymous': True,
+            'type': data.get('type', 'regular'),
+            'allows_multiple_answers': False
+        }
+        if 'correct_option_id' in data:
+            poll['correct_option_id'] = int(data['correct_option_id'])
+        return self._message(data, poll=poll)
+
+    async def edit_message_text(self, data: dict) -> dict:
+        message = self._find_message(data)
+        message['text'] = data['text']
+        message['edit_date'] = int(time.time())
+        self._apply_markup(message['chat']['id'], message, data.get('reply_markup'))
+        return message
+
+    async def edit_message_reply_markup(self, data: dict) -> dict:
+        message = self._find_message(data)
+        self._apply_markup(message['chat']['id'], message, data.get('reply_markup'))
+        return message
+
+    async def delete_message(self, data: dict) -> bool:
+        self._find_message(data)
+        del self.chat(int(data['chat_id'])).messages[int(data['message_id'])]
+        return True
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> None:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f'http://{host}:{port}'
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class UpdateCompletion(BaseMiddleware):
+    """Resolves a future when the dispatcher has finished processing the update"""
+
+    def __init__(self):
+        self.waiters = {}  # update_id -> future
+        super(UpdateCompletion, self).__init__()
+
+    def expect(self, update_id: int) -> asyncio.Future:
+        future = self.waiters[update_id] = asyncio.get_running_loop().create_future()
+        return future
+
+    async def on_post_process_update(self, update: types.Update, result, data: dict):
+        future = self.waiters.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+
+class JourneyError(Exception):
+    """User journey can not continue: the bot didn't answer the way a user expects"""
+
+
+class FakeUser:
+    """Telegram user talking to the bot: sends texts, presses reply keyboard buttons and inline buttons of the
+    latest bot messages. Every action waits until the bot has processed the update"""
+
+    def __init__(self, harness: 'LoadHarness', user_id: int):
+        self.harness = harness
+        self.user_id = user_id
+        self.profile = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}',
+                        'username': f'user{user_id}', 'language_code': 'en'}
+
+    @property
+    def chat(self) -> FakeChat:
+        return self.harness.api.chat(self.user_id)
+
+    async def send(self, step: str, text: str) -> None:
+        await self.harness.deliver(step, {'message': {
+            'message_id': self.harness.api.next_message_id(), 'date': int(time.time()),
+            'chat': {'id': self.user_id, 'type': 'private'}, 'from': self.profile, 'text': text}})
+
+    async def press(self, step: str, index: int) -> None:
+        """Press reply keyboard button by its position"""
+        if index >= len(self.chat.keyboard):
+            raise JourneyError(f'[{step}] no reply keyboard button {index}')
+        await self.send(step, self.chat.keyboard[index])
+
+    async def click(self, step: str, prefix: str, message: dict = None) -> None:
+        """Click inline button of the latest bot message which has it (the message may be overridden, e.g. with
+        a voted poll)"""
+        found, callback_data = self.chat.find_button(prefix)
+        if found is None:
+            raise JourneyError(f'[{step}] no inline button {prefix}')
+        await self.harness.deliver(step, {'callback_query': {
+            'id': str(self.harness.api.next_message_id()), 'from': self.profile, 'chat_instance': str(self.user_id),
+            'message': message or found, 'data': callback_data}})
+
+    async def answer_poll(self, step: str, prefix: str) -> None:
+        """Vote in the latest quiz poll and click its button"""
+        found, _ = self.chat.find_button(prefix)
+        if found is None or 'poll' not in found:
+            raise JourneyError(f'[{step}] no poll with button {prefix}')
+        voted = dict(found, poll=dict(found['poll'], total_voter_count=1))
+        selected = random.randrange(len(voted['poll']['options']))
+        voted['poll']['options'] = [dict(option, voter_count=int(index == selected))
+                                    for index, option in enumerate(voted['poll']['options'])]
+        await self.click(step, prefix, voted)
+
+
+async def user_journey(user: FakeUser, words: int, pages: int, quiz: bool, think: float) -> None:
+    """Start, open a dictionary, paginate, add words, search the added word and pass a quiz"""
+
+    async def pause():
+        if think:
+            await asyncio.sleep(random.uniform(.5, 1.5) * think)
+
+    await user.send('start', '/start')
+    await pause()
+    await user.press('open_dictionary', 0)
+    await pause()
+    await user.click('select_dictionary', 'dictionary_')
+    for _ in range(pages):
+        await pause()
+        await user.click('next_page', 'next_dictionary')
+    searched_word = f'word{user.user_id}_0'
+    for _ in range(words):
+        searched_word = ''.join(random.choices(string.ascii_lowercase, k=8))
+        await pause()
+        await user.press('add_word', 0)
+        await pause()
+        await user.send('add_word_string', searched_word)
+        await pause()
+        await user.send('add_word_translation', searched_word[::-1])
+        await pause()
+        await user.press('add_word_confirm', 0)
+    await pause()
+    await user.press('find_word', 3)
+    await pause()
+    await user.send('find_word_query', searched_word)
+    if not quiz:
+        return
+    await pause()
+    await user.press('quiz', 4)
+    await pause()
+    await user.click('quiz_start', 'quiz_start')
+    while user.chat.find_button('quiz_next')[0] is not None:
+        await pause()
+        await user.answer_poll('quiz_answer', 'quiz_next')
+    await pause()
+    await user.answer_poll('quiz_answer', 'quiz_finish')
+
+
+class LoadHarness:
+    """Real VocabularyBot and dispatcher talking to FakeBotAPI, fed with user journeys in polling or webhook
+    mode. Latency is measured from the update delivery to the end of its processing by the dispatcher"""
+
+    UPDATE_TIMEOUT = 30  # Seconds
+
+    def __init__(self, path_to_db: str, path_to_fsm_db: str, mode: str = 'polling', governed: bool = False,
+                 webhook_port: int = 8091, strict_api: bool = True):
+        self.path_to_db = path_to_db
+        self.path_to_fsm_db = path_to_fsm_db
+        self.mode = mode
+        self.governed = governed
+        self.webhook_port = webhook_port
+        self.api = FakeBotAPI(strict_api)
+        self.completion = UpdateCompletion()
+        self.latencies = {}  # step -> [seconds]
+        self.bot = self.dp = self.storage = self.vocabulary_bot = self.webhook = None
+        self._serving = self._session = None
+        self._update_id = 0
+
+    async def start(self) -> None:
+        await self.api.start()
+        server = TelegramAPIServer.from_base(self.api.url)
+        self.bot = GovernedBot(TOKEN, server=server) if self.governed else Bot(TOKEN, server=server)
+        self.storage = SQLiteStorage(self.path_to_fsm_db)
+        self.dp = ChatOrderedDispatcher(self.bot, storage=self.storage)
+        path_to_db, config.PATH_TO_DB = config.PATH_TO_DB, self.path_to_db  # The bot opens database from config
+        try:
+            self.vocabulary_bot = VocabularyBot(self.bot, self.dp, False)
+        finally:
+            config.PATH_TO_DB = path_to_db
+        self.dp.middleware.setup(self.completion)
+        await self.vocabulary_bot.init_commands()
+        if self.mode == 'webhook':
+            self.webhook = WebhookServer(self.dp, secret_token=WEBHOOK_SECRET)
+            self._serving = asyncio.ensure_future(self.webhook.run('127.0.0.1', self.webhook_port))
+            self._session = ClientSession()
+            await asyncio.sleep(.1)
+        else:
+            self._serving = asyncio.ensure_future(self.dp.start_polling())
+        self.api.reset_calls()
+
+    async def stop(self) -> None:
+        if self.mode == 'webhook':
+            self.webhook.stop()
+            await self._session.close()
+            await self._serving
+        else:
+            self.dp.stop_polling()
+            self.api.release_polling()
+            await self.dp.wait_closed()
+        self.dp.stop_workers()
+        await self.vocabulary_bot.shutdown()
+        await self.storage.close()
+        await self.storage.wait_closed()
+        await self.bot.session.close()
+        await self.api.stop()
+
+    async def deliver(self, step: str, update: dict) -> None:
+        """Deliver update to the bot and wait until it is processed"""
+        self._update_id += 1
+        update['update_id'] = self._update_id
+        processed = self.completion.expect(self._update_id)
+        start = time.perf_counter()
+        if self.mode == 'webhook':
+            async with self._session.post(f'http://127.0.0.1:{self.webhook_port}{self.webhook.path}', json=update,
+                                          headers={SECRET_TOKEN_HEADER: WEBHOOK_SECRET}) as response:
+                if response.status != 200:
+                    raise JourneyError(f'[{step}] webhook responded with {response.status}')
+        else:
+            self.api.push_update(update)
+        try:
+            await asyncio.wait_for(processed, self.UPDATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise JourneyError(f'[{step}] update was not processed in {self.UPDATE_TIMEOUT}s')
+        self.latencies.setdefault(step, []).append(time.perf_counter() - start)
+
+    async def run(self, users: list, words: int = 2, pages: int = 2, quiz: bool = True, think: float = 1.,
+                  ramp: float = 0.) -> dict:
+        """Run journeys of given users concurrently, starting them evenly during ramp seconds"""
+        failed = []
+
+        async def run_journey(index: int, user_id: int):
+            await asyncio.sleep(ramp * index / len(users))
+            try:
+                await user_journey(FakeUser(self, user_id), words, pages, quiz, think)
+            except JourneyError as error:
+                failed.append(str(error))
+
+        start = time.perf_counter()
+        await asyncio.gather(*[run_journey(index, user_id) for index, user_id in enumerate(users)])
+        elapsed = time.perf_counter() - start
+        if failed:
+            logging.getLogger(type(self).__name__).warning(f'{len(failed)} journeys failed, e.g. {failed[0]}')
+        return {'journeys': len(users), 'failed_journeys': len(failed), **self.report(elapsed)}
+
+    def report(self, elapsed: float) -> dict:
+        """Updates throughput, latency and Bot API calls of delivered updates"""
+        latencies = sorted(latency for step_latencies in self.latencies.values() for latency in step_latencies)
+        updates = len(latencies)
+        api_calls = sum(calls for method, calls in self.api.calls.items() if method not in STARTUP_METHODS)
+        return {
+            'mode': self.mode,
+            'updates': updates,
+            'elapsed': round(elapsed, 3),
+            'updates_per_sec': round(updates / elapsed, 1),
+            **self._percentiles(latencies),
+            'api_calls_per_update': round(api_calls / updates, 2) if updates else 0.,
+            'api_calls': {method: calls for method, calls in sorted(self.api.calls.items())
+                          if method not in STARTUP_METHODS},
+            'steps': {step: {'updates': len(step_latencies), **self._percentiles(sorted(step_latencies))}
+                      for step, step_latencies in self.latencies.items()}
+        }
+
+    @staticmethod
+    def _percentiles(latencies: list) -> dict:
+        if not latencies:
+            return {'latency_p50_ms': 0., 'latency_p99_ms': 0.}
+        return {
+            'latency_p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+            'latency_p99_ms': round(latencies[int(len(latencies) * .99)] * 1000, 2)
+        }
+
+
+async def run_load(mode: str = 'polling', users: int = 50, words: int = 2, pages: int = 2, quiz: bool = True,
+                   think: float = 1., ramp: float = 0., governed: bool = False, webhook_port: int = 8091,
+                   seed: int = 0) -> dict:
+    """Build a synthetic database (30 words per user, enough for quizzes) in a temporary directory and run one
+    journey per user against the bot"""
+    random.seed(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        path_to_db = os.path.join(directory, 'load.db')
+        build_synthetic_db(path_to_db, users, 30, [('en', 'ru')], events=0, seed=seed)
+        harness = LoadHarness(path_to_db, os.path.join(directory, 'load_fsm.db'), mode, governed, webhook_port)
+        await harness.start()
+        try:
+            return await harness.run(list(range(1, users + 1)), words, pages, quiz, think, ramp)
+        finally:
+            await harness.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end load test of the bot with a fake Telegram Bot API')
+    parser.add_argument('--mode', choices=('polling', 'webhook', 'both'), default='both')
+    parser.add_argument('--users', type=int, default=50, help='Concurrent user journeys')
+    parser.add_argument('--words', type=int, default=2, help='Words added per journey')
+    parser.add_argument('--pages', type=int, default=2, help='Dictionary pages turned per journey')
+    parser.add_argument('--no-quiz', action='store_true', help='Skip quiz in journeys')
+    parser.add_argument('--think', type=float, default=1., help='Mean user think time between actions (seconds)')
+    parser.add_argument('--ramp', type=float, default=5., help='Seconds to start all journeys')
+    parser.add_argument('--governed', action='store_true', help='Send requests through the rate governor')
+    parser.add_argument('--webhook-port', type=int, default=8091)
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    for load_mode in (('polling', 'webhook') if arguments.mode == 'both' else (arguments.mode,)):
+        print(json.dumps(asyncio.run(run_load(load_mode, arguments.users, arguments.words, arguments.pages,
+                                              not arguments.no_quiz, arguments.think, arguments.ramp,
+                                              arguments.governed, arguments.webhook_port)), indent=2))
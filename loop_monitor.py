@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+# ===== Local imports =====
+
+import metrics
+
+LOOP_LAG_SECONDS = metrics.REGISTRY.histogram('bot_event_loop_lag_seconds',
+                                              'Delay of event loop wake ups (time the loop was busy or blocked)')
+LOOP_BLOCKS = metrics.REGISTRY.counter('bot_event_loop_blocks_total', 'Event loop blocks longer than threshold',
+                                       ('handler',))
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+STACK_LIMIT = 20  # Innermost frames in the block log
+
+
+class LoopMonitor:
+    """Event loop lag monitor. A task sleeps for interval and records how late it wakes up, a watchdog thread
+    checks the task heartbeats and, when the loop doesn't respond for threshold, logs the stack of the loop
+    thread: the blocking call and the handler it was made from. Idle cost is one wake up per interval in the
+    loop and one per half threshold in the watchdog"""
+
+    INTERVAL = .5  # Seconds
+    THRESHOLD = .25  # Seconds
+
+    def __init__(self, interval: float = INTERVAL, threshold: float = THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.blocks = 0
+        self._heartbeat = None
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Start monitoring the running loop (called from the loop thread)"""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._measure())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+        if self._thread is not None:
+            self._thread.join()
+
+    async def _measure(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._heartbeat = time.monotonic()
+            LOOP_LAG_SECONDS.observe(max(0., self._heartbeat - start - self.interval))
+
+    def _watch(self) -> None:
+        reported = None  # Heartbeat of the reported block, every block is logged once
+        while not self._stopped.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                reported = heartbeat
+                self._report(blocked, frame)
+
+    def _report(self, blocked: float, frame) -> None:
+        handler = self.get_handler(frame)
+        stack = traceback.extract_stack(frame)
+        # The innermost frame of the bot code, deeper ones are usually libraries (sqlite3, requests, socket)
+        location = next((entry for entry in reversed(stack) if entry.filename.startswith(BOT_DIR)
+                         and 'site-packages' not in entry.filename), stack[-1])
+        self.blocks += 1
+        LOOP_BLOCKS.inc(handler)
+        logging.getLogger(type(self).__name__).warning(
+            f'Event loop blocked for {blocked * 1000:.0f}ms+ in [{handler}] at '
+            f'{os.path.relpath(location.filename, BOT_DIR)}:{location.lineno} {location.name}()\n'
+            + ''.join(traceback.format_list(stack[-STACK_LIMIT:])).rstrip())
+
+    @staticmethod
+    def get_handler(frame) -> str:
+        """Name of the handler running in the frame stack (the innermost metrics.timed_handler call)"""
+        while frame is not None:
+            if frame.f_code is metrics.timed_handler.__code__:
+                return frame.f_locals.get('handler_name', 'unknown')
+            frame = frame.f_back
+        return 'unknown'
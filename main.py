@@ -6,39 +6,67 @@ import asyncio
 import logging
 import sys
 
-# ===== External libs imports =====
-
-from aiogram import Bot, Dispatcher
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-
 # ===== Local imports =====
 
 import config
+from fsm_storage import SQLiteStorage
+from governor import GovernedBot
+from loop_monitor import LoopMonitor
+from metrics import MetricsServer
+from ordered_dispatcher import ChatOrderedDispatcher
+from recovery import BacklogCatchUp, TrackedPolling
 from vocabulary_bot import VocabularyBot
+from webhook import WebhookServer
 
 
-async def main(dev_mode: bool):
+async def main(dev_mode: bool, webhook_mode: bool):
     """Application entry point"""
-    # TODO: Change to webhooks in production
 
     # ===== Basic initializations =====
 
     logging.basicConfig(level=logging.INFO)
     if dev_mode:
-        bot = Bot(token=config.TOKEN_DEV)
+        bot = GovernedBot(token=config.TOKEN_DEV)
         logging.getLogger(__name__).info('Running in development mode')
     else:
-        bot = Bot(token=config.TOKEN)
-    storage = MemoryStorage()  # TODO: Change MemoryStorage to Redis
-    dp = Dispatcher(bot, storage=storage)
+        bot = GovernedBot(token=config.TOKEN)
+    storage = SQLiteStorage(config.PATH_TO_FSM_DB.replace('.db', '_dev.db') if dev_mode else config.PATH_TO_FSM_DB,
+                            ttl=config.FSM_STATES_TTL)
+    dp = ChatOrderedDispatcher(bot, storage=storage)
     vocabulary_bot = VocabularyBot(bot, dp, dev_mode)
 
     await vocabulary_bot.init_commands()
-    await dp.skip_updates()
-    await dp.start_polling()
+    scheduler = asyncio.create_task(vocabulary_bot.run_scheduler())
+    metrics_server = MetricsServer()
+    if config.METRICS_PORT:
+        await metrics_server.start(config.METRICS_HOST, config.METRICS_PORT)
+    loop_monitor = LoopMonitor(config.LOOP_MONITOR_INTERVAL, config.LOOP_BLOCK_THRESHOLD)
+    if config.LOOP_BLOCK_THRESHOLD:
+        loop_monitor.start()
+    await vocabulary_bot.admin.resume_mailings()
+    if webhook_mode:
+        server = WebhookServer(dp, config.WEBHOOK_PATH, config.WEBHOOK_SECRET, config.WEBHOOK_MAX_IN_FLIGHT)
+        # Pending updates are delivered again after restart, already processed ones are dropped by the window
+        if vocabulary_bot.updates.last_update_id is not None:
+            server.window.reset(vocabulary_bot.updates.last_update_id)
+        if config.WEBHOOK_HOST:
+            await server.set_webhook(config.WEBHOOK_HOST)
+        await server.run(config.WEBAPP_HOST, config.WEBAPP_PORT)
+    else:
+        await bot.delete_webhook()
+        await BacklogCatchUp(dp, vocabulary_bot.updates).run()
+        # Not dp.start_polling(): it confirms received updates with the next request before they are processed
+        await TrackedPolling(dp, vocabulary_bot.updates).run()
+    scheduler.cancel()
+    loop_monitor.stop()
+    await metrics_server.stop()
+    dp.stop_workers()
     await vocabulary_bot.shutdown()
+    await storage.close()
+    await storage.wait_closed()
 
 
 if __name__ == '__main__':
     is_dev_mode = 'dev' in sys.argv
-    asyncio.run(main(is_dev_mode))
+    is_webhook_mode = 'webhook' in sys.argv
+    asyncio.run(main(is_dev_mode, is_webhook_mode))
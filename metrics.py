@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import bisect
+import contextvars
+import logging
+import time
+
+# ===== External libs imports =====
+
+from aiohttp import web
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)  # Seconds
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}  # label values -> value
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self.values.items():
+            yield self.name, self.labels, label_values, value
+
+
+class Histogram:
+    """Histogram with fixed buckets. Observation is a binary search and a few additions, so it stays cheap
+    enough for every update"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # label values -> [bucket counts..., count above the last bucket, sum]
+
+    def observe(self, value: float, *label_values) -> None:
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for label_values, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                yield self.name + '_bucket', self.labels + ('le',), label_values + (str(bound),), cumulative
+            yield self.name + '_count', self.labels, label_values, cumulative
+            yield self.name + '_sum', self.labels, label_values, series[-1]
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = {}
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """Metrics in Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, label_values, value in metric.samples():
+                if labels:
+                    label_pairs = ','.join(f'{label}="{self._escape(str(label_value))}"'
+                                           for label, label_value in zip(labels, label_values))
+                    lines.append(f'{name}{{{label_pairs}}} {value}')
+                else:
+                    lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = MetricsRegistry()
+HANDLER_SECONDS = REGISTRY.histogram('bot_handler_seconds', 'Handler execution time', ('handler',))
+HANDLER_DB_SECONDS = REGISTRY.histogram('bot_handler_db_seconds', 'Database time per handler call', ('handler',))
+HANDLER_HTTP_SECONDS = REGISTRY.histogram('bot_handler_http_seconds', 'Outbound HTTP time per handler call',
+                                          ('handler',))
+HANDLER_API_SECONDS = REGISTRY.histogram('bot_handler_api_seconds', 'Bot API calls time per handler call',
+                                         ('handler',))
+HANDLER_ERRORS = REGISTRY.counter('bot_handler_errors_total', 'Handler calls failed with exception', ('handler',))
+DB_QUERIES = REGISTRY.counter('bot_db_queries_total', 'Executed SQL queries')
+DB_SECONDS = REGISTRY.counter('bot_db_seconds_total', 'Time spent executing SQL queries')
+HTTP_SECONDS = REGISTRY.histogram('bot_http_seconds', 'Outbound HTTP requests time', ('provider',))
+API_SECONDS = REGISTRY.histogram('bot_api_seconds', 'Bot API requests time', ('method',))
+
+# Times spent by the running handler: {'db': seconds, 'http': seconds, 'api': seconds}
+_handler_times = contextvars.ContextVar('handler_times', default=None)
+
+
+def add_time(kind: str, seconds: float) -> None:
+    """Attribute time to the handler running in the current context (if any)"""
+    times = _handler_times.get()
+    if times is not None:
+        times[kind] += seconds
+
+
+async def timed_handler(handler_name: str, coroutine):
+    """Await handler coroutine recording its latency and the DB, HTTP and Bot API time spent inside"""
+    times = {'db': 0., 'http': 0., 'api': 0.}
+    token = _handler_times.set(times)
+    start = time.perf_counter()
+    try:
+        return await coroutine
+    except Exception:
+        HANDLER_ERRORS.inc(handler_name)
+        raise
+    finally:
+        HANDLER_SECONDS.observe(time.perf_counter() - start, handler_name)
+        HANDLER_DB_SECONDS.observe(times['db'], handler_name)
+        HANDLER_HTTP_SECONDS.observe(times['http'], handler_name)
+        HANDLER_API_SECONDS.observe(times['api'], handler_name)
+        _handler_times.reset(token)
+
+
+class MetricsServer:
+    """Local HTTP server exposing metrics on /metrics for Prometheus scraping"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self.registry = registry
+        self.runner = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def start(self, host: str, port: int) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logging.getLogger(type(self).__name__).info(f'Metrics are served on http://{host}:{port}/metrics')
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
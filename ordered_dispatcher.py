@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+from collections import deque
+import logging
+import time
+import typing
+
+# ===== External libs imports =====
+
+from aiogram import Bot, Dispatcher, types
+
+
+class ChatOrderedDispatcher(Dispatcher):
+    """Dispatcher which processes updates of one chat strictly in order and updates of different chats in parallel.
+    Updates are put to per-chat queues served by a bounded pool of workers. A worker takes one update of a chat at
+    a time, so a slow handler holds only one worker. Chats are grouped to shards by ID for queue lag stats"""
+
+    WORKERS = 32
+    SHARDS = 16
+
+    def __init__(self, bot: Bot, *args, workers: int = WORKERS, shards: int = SHARDS, **kwargs):
+        super().__init__(bot, *args, **kwargs)
+        self.workers_count = workers
+        self.shards = shards
+        self._chats = {}  # chat_id -> deque of (update, future, enqueue time)
+        self._ready = None  # Queue of chats having pending updates and not being processed
+        self._workers = []
+        self.tracker = None  # Optional UpdateTracker (recovery.py), updates waiting in queues are not processed yet
+        # Stats per shard: processed updates, total and max wait in queue
+        self.processed = [0 for _ in range(shards)]
+        self.wait_total = [0. for _ in range(shards)]
+        self.wait_max = [0. for _ in range(shards)]
+
+    @staticmethod
+    def get_chat_id(update: types.Update):
+        message = update.message or update.edited_message or update.channel_post or update.edited_channel_post
+        if message is not None:
+            return message.chat.id
+        for event in (update.callback_query, update.inline_query, update.chosen_inline_result,
+                      update.shipping_query, update.pre_checkout_query, update.poll_answer):
+            if event is not None:
+                return event.user.id if isinstance(event, types.PollAnswer) else event.from_user.id
+        return None
+
+    def get_shard(self, chat_id) -> int:
+        return chat_id % self.shards if isinstance(chat_id, int) else 0
+
+    async def process_updates(self, updates, fast: typing.Optional[bool] = True):
+        """Put updates to chat queues and wait until they are processed. Returns handlers results in updates order"""
+        if self._ready is None:
+            self._start_workers()
+        if self.tracker is not None:
+            # Tracked before queueing, so the saved last processed update doesn't pass queued updates
+            self.tracker.track(update.update_id for update in updates)
+        loop = asyncio.get_running_loop()
+        futures = []
+        for update in updates:
+            chat_id = self.get_chat_id(update)
+            if chat_id is None:
+                chat_id = ('update', update.update_id)  # Not related to a chat, nothing to keep in order
+            future = loop.create_future()
+            futures.append(future)
+            chat_queue = self._chats.get(chat_id)
+            if chat_queue is None:
+                chat_queue = self._chats[chat_id] = deque()
+                self._ready.put_nowait(chat_id)
+            chat_queue.append((update, future, time.monotonic()))
+        return await asyncio.gather(*futures)
+
+    def _start_workers(self) -> None:
+        self._ready = asyncio.Queue()
+        self._workers = [asyncio.ensure_future(self._worker()) for _ in range(self.workers_count)]
+
+    async def _worker(self) -> None:
+        Dispatcher.set_current(self)
+        Bot.set_current(self.bot)
+        while True:
+            chat_id = await self._ready.get()
+            chat_queue = self._chats[chat_id]
+            update, future, enqueued = chat_queue[0]
+            shard = self.get_shard(chat_id)
+            wait = time.monotonic() - enqueued
+            self.wait_total[shard] += wait
+            self.wait_max[shard] = max(self.wait_max[shard], wait)
+            try:
+                # Every update runs in its own copy of the worker context: aiogram caches per update values in
+                # context variables (e.g. user state in StateFilter), they must not leak to the next update
+                result = await asyncio.ensure_future(self.updates_handler.notify(update))
+            except Exception:
+                logging.getLogger(type(self).__name__).exception(f'Update [{update.update_id}] processing failed')
+                result = []
+                if self.tracker is not None:  # Post process middlewares are not called on errors
+                    self.tracker.done(update.update_id)
+            self.processed[shard] += 1
+            if not future.done():
+                future.set_result(result)
+            chat_queue.popleft()
+            # The chat goes to the end of the ready queue, so busy chats don't delay others
+            if chat_queue:
+                self._ready.put_nowait(chat_id)
+            else:
+                del self._chats[chat_id]
+
+    def stop_workers(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        self._ready = None
+
+    def queue_stats(self) -> list:
+        """Stats per shard: chats with pending updates, queued updates, current lag (oldest pending update age),
+        processed updates, average and max wait in queue"""
+        now = time.monotonic()
+        chats = [0 for _ in range(self.shards)]
+        queued = [0 for _ in range(self.shards)]
+        lag = [0. for _ in range(self.shards)]
+        for chat_id, chat_queue in self._chats.items():
+            shard = self.get_shard(chat_id)
+            chats[shard] += 1
+            queued[shard] += len(chat_queue)
+            lag[shard] = max(lag[shard], now - chat_queue[0][2])
+        return [{
+            'shard': shard,
+            'chats': chats[shard],
+            'queued': queued[shard],
+            'lag': lag[shard],
+            'processed': self.processed[shard],
+            'wait_avg': self.wait_total[shard] / self.processed[shard] if self.processed[shard] else 0.,
+            'wait_max': self.wait_max[shard]
+        } for shard in range(self.shards)]
@@ -6,6 +6,9 @@ from abc import abstractmethod
 
 
 class Paginator:
+    # Data depends only on the user dictionary, so a cached session is valid until the dictionary version changes.
+    # Other paginators (rating, admin pages) show data of other users and are built on every request
+    cached = False
 
     def __init__(self):
         ...
@@ -65,3 +68,15 @@ class Paginator:
     @abstractmethod
     def get_state_data(self):
         pass
+
+    @abstractmethod
+    def restore_state(self, current_page):
+        """Move cached paginator to the position saved in user state"""
+        pass
+
+    @staticmethod
+    def session_params(current_page) -> tuple:
+        """Parameters which define paginator data (not position), used as a part of session cache key"""
+        if isinstance(current_page, dict):
+            return current_page.get('from_lang'), current_page.get('to_lang')
+        return ()
@@ -4,3 +4,9 @@ from .dictionary import DictionaryPaginator
 from .rating import RatingPaginator
 from .users import UsersPaginator
 from .statistics import StatisticsPaginator
+from .cache import PaginatorSessionCache
+
+# Paginators registry by action name used in pagination callbacks data
+PAGINATORS = {paginator.action: paginator for paginator in (AchievementsPaginator, AnalyticsPaginator,
+                                                            DictionaryPaginator, RatingPaginator, UsersPaginator,
+                                                            StatisticsPaginator)}
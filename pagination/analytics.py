@@ -63,3 +63,6 @@ class AnalyticsPaginator(Paginator):
 
     def get_reply_markup(self) -> types.InlineKeyboardMarkup:
         return self.markup.get_pagination_markup(action=self.action)
+
+    def restore_state(self, current_page: int):
+        self.current_page = current_page
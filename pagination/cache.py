@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+from collections import OrderedDict
+import time
+
+# ===== Local imports =====
+
+from db_manager import DbManager
+from lang_manager import LangManager
+from markups_manager import MarkupManager
+from .Paginator import Paginator
+
+
+class PaginatorSessionCache:
+    """Live paginators of recent users, so pagination clicks don't query and split the same data again.
+    Sessions are keyed by (user_id, action, params), evicted by TTL and LRU and rebuilt after dictionary changes.
+    Only paginators of the user dictionary data are cached"""
+
+    SIZE = 1000
+    TTL = 10 * 60  # Seconds since the last use
+
+    def __init__(self, paginators: dict, lang_manager: LangManager, db_manager: DbManager,
+                 markup_manager: MarkupManager, size: int = SIZE, ttl: int = TTL):
+        self.paginators = paginators
+        self.lang = lang_manager
+        self.db = db_manager
+        self.markup = markup_manager
+        self.size = size
+        self.ttl = ttl
+        self.sessions = OrderedDict()  # key -> [paginator, dictionary version, last use time]
+
+    def get(self, action: str, user_id: int, current_page) -> Paginator:
+        """Get paginator moved to current_page position from user state"""
+        paginator_class = self.paginators[action]
+        if not paginator_class.cached:
+            return paginator_class(self.lang, self.db, self.markup, user_id, current_page=current_page)
+        key = (user_id, action, paginator_class.session_params(current_page))
+        version = self.db.get_user_dict_version(user_id)
+        now = time.monotonic()
+        session = self.sessions.get(key)
+        if session is not None and session[1] == version and now - session[2] < self.ttl:
+            session[2] = now
+            self.sessions.move_to_end(key)
+            session[0].restore_state(current_page)
+            return session[0]
+        paginator = paginator_class(self.lang, self.db, self.markup, user_id, current_page=current_page)
+        self.sessions[key] = [paginator, version, now]
+        self.sessions.move_to_end(key)
+        self._evict(now)
+        return paginator
+
+    def _evict(self, now: float) -> None:
+        while len(self.sessions) > self.size:
+            self.sessions.popitem(last=False)
+        # Sessions are ordered by last use, so expired ones are at the beginning
+        while self.sessions and now - next(iter(self.sessions.values()))[2] >= self.ttl:
+            self.sessions.popitem(last=False)
@@ -15,6 +15,7 @@ from .Paginator import Paginator
 class DictionaryPaginator(Paginator):
 
     action = 'dictionary'
+    cached = True
 
     def __init__(self, lang_manager: LangManager, db_manager: DbManager, markup_manager: MarkupManager, user_id: int,
                  current_page: dict = None):
@@ -83,3 +84,7 @@ class DictionaryPaginator(Paginator):
             'to_lang': self.to_lang
         }
         return self.current_state
+
+    def restore_state(self, current_page: dict):
+        self.current_state = current_page
+        self.current_page = current_page['current_page']
@@ -14,6 +14,7 @@ from .Paginator import Paginator
 
 class StatisticsPaginator(Paginator):
     action = 'statistics'
+    cached = True
     parse_mode = 'Markdown'
 
     def __init__(self, lang_manager: LangManager, db_manager: DbManager, markup_manager: MarkupManager, user_id: int,
@@ -136,6 +137,16 @@ class StatisticsPaginator(Paginator):
         }
         return self.current_state
 
+    def restore_state(self, current_page: dict):
+        if self.data is not None:
+            self.current_state = current_page
+            self.current_year_index = self.current_state['current_year_index']
+            self.current_month_index = self.current_state['current_month_index']
+            self.current_month_page = self.current_state['current_month_page']
+            self.current_total_page = self.current_state['current_total_page']
+            self.current_year = self.__parse_year()
+            self.current_month = self.__parse_month()
+
     def __parse_year(self):
         return tuple(tuple(self.data['years'].items()))[self.current_year_index][0]
 
@@ -62,3 +62,6 @@ class UsersPaginator(Paginator):
 
     def get_reply_markup(self) -> types.InlineKeyboardMarkup:
         return self.markup.get_pagination_markup(action=self.action)
+
+    def restore_state(self, current_page: int):
+        self.current_page = current_page
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+from datetime import date
+import functools
+import logging
+
+# ===== External libs imports =====
+
+import requests
+
+# ===== Local imports =====
+
+import translation
+
+
+class QuoteOfTheDay:
+    """Quote of the day cache. Quote and its translations are prefetched by scheduler and served from memory"""
+
+    SOURCE_LANG = 'en'
+    GOOGLE_LANG_CODES = {'ua': 'uk'}  # Interface lang codes which differ from Google Translate ones
+    REQUEST_TIMEOUT = 10
+
+    def __init__(self, quote_api_endpoint: str, lang_codes: list):
+        self.quote_api_endpoint = quote_api_endpoint
+        self.lang_codes = lang_codes
+        self.quote_date = None
+        self.author = None
+        self.quotes = {}  # Quote text by interface lang code
+
+    def is_actual(self) -> bool:
+        return self.quote_date == date.today()
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Fetch today's quote and translate it for every interface language.
+        On upstream errors the last good quote is kept. Returns True if actual quote is available"""
+        if self.is_actual() and not force:
+            return True
+        try:
+            response = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(requests.get, self.quote_api_endpoint, verify=False,
+                                        timeout=self.REQUEST_TIMEOUT))
+            if response.status_code != 200:
+                raise requests.RequestException(f'status code {response.status_code}')
+            quote = response.json()['quote']
+            body, author = quote['body'], quote['author']
+        except (requests.RequestException, ValueError, KeyError, TypeError) as error:
+            logging.getLogger(type(self).__name__).error(f'Quote of the day fetching error ({error})')
+            return False
+        quotes = {self.SOURCE_LANG: body}
+        for lang_code in self.lang_codes:
+            if lang_code == self.SOURCE_LANG:
+                continue
+            try:
+                quotes[lang_code] = await asyncio.get_running_loop().run_in_executor(
+                    None, translation.google_translate, body, self.SOURCE_LANG,
+                    self.GOOGLE_LANG_CODES.get(lang_code, lang_code))
+            except (requests.RequestException, ValueError, LookupError) as error:
+                logging.getLogger(type(self).__name__).error(f'Quote of the day translation error [{lang_code}] '
+                                                             f'({error})')
+        self.quotes = quotes
+        self.author = author
+        self.quote_date = date.today()
+        logging.getLogger(type(self).__name__).info(f'Quote of the day updated [{len(self.quotes)} languages]')
+        return True
+
+    def get(self, lang_code: str):
+        """Returns (quote, translation, author) from cache or None if no quote has been fetched yet.
+        Translation is None for the source language or if it isn't available"""
+        if self.SOURCE_LANG not in self.quotes:
+            return None
+        quote = self.quotes[self.SOURCE_LANG]
+        quote_translation = self.quotes.get(lang_code) if lang_code != self.SOURCE_LANG else None
+        return quote, quote_translation or None, self.author
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Asyncio token bucket. Tokens are refilled continuously with [rate] per second up to [capacity]"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.
+        self._lock = None  # Created on first acquire, buckets used only with try_acquire don't need it
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds left until one token is available"""
+        now = time.monotonic()
+        if self.paused_until > now:
+            return self.paused_until - now
+        self._refill(now)
+        return 0. if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def try_acquire(self) -> bool:
+        if self.delay() > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self) -> float:
+        """Wait for token in FIFO order. Returns waiting time in seconds"""
+        start = time.monotonic()
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep(self.delay())
+        return time.monotonic() - start
+
+    def pause(self, seconds: float) -> None:
+        """Stop issuing tokens for given time (e.g. after Telegram RetryAfter error)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+
+    def is_idle(self) -> bool:
+        """Bucket is full and not paused, so it can be dropped and recreated later without changing behaviour"""
+        now = time.monotonic()
+        return self.paused_until <= now and self.tokens + (now - self.updated) * self.rate >= self.capacity
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import logging
+import time
+
+# ===== External libs imports =====
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+# ===== Local imports =====
+
+from db_manager import DbManager
+from rate_limit import TokenBucket
+from webhook import UpdateWindow
+
+
+class UpdateTracker(BaseMiddleware):
+    """Tracks the last processed update ID: the biggest update_id such that every received update up to it
+    has been processed. The value is persisted at most once per SAVE_INTERVAL and on shutdown. Update far below it
+    means Telegram started IDs again at random (after a week without updates), the value follows it down"""
+
+    STATE_KEY = 'last_update_id'
+    SAVE_INTERVAL = 1  # Seconds
+    RESTART_GAP = UpdateWindow.SIZE
+
+    def __init__(self, db_manager: DbManager):
+        self.db = db_manager
+        saved = self.db.get_bot_state(self.STATE_KEY)
+        self.last_update_id = int(saved) if saved is not None else None
+        self._saved_update_id = self.last_update_id
+        self._in_flight = set()
+        self._max_done = self.last_update_id
+        self._last_save = 0.
+        super(UpdateTracker, self).__init__()
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        self.track([update.update_id])
+
+    async def on_post_process_update(self, update: types.Update, result, data: dict):
+        self.done(update.update_id)
+
+    def track(self, update_ids) -> None:
+        """Mark updates as received before they are processed (e.g. whole batch processed not in order)"""
+        for update_id in update_ids:
+            if self._max_done is not None and update_id < self._max_done - self.RESTART_GAP:
+                self._max_done = self.last_update_id = update_id - 1
+                self._in_flight = {in_flight for in_flight in self._in_flight if in_flight < update_id}
+            self._in_flight.add(update_id)
+
+    def done(self, update_id: int) -> None:
+        """Mark update as processed (or intentionally skipped)"""
+        self._in_flight.discard(update_id)
+        self._max_done = update_id if self._max_done is None else max(self._max_done, update_id)
+        watermark = self._max_done
+        if self._in_flight:
+            watermark = min(watermark, min(self._in_flight) - 1)
+        if self.last_update_id is None or watermark > self.last_update_id:
+            self.last_update_id = watermark
+            if time.monotonic() - self._last_save >= self.SAVE_INTERVAL:
+                self.save()
+
+    def save(self) -> None:
+        if self.last_update_id is not None and self.last_update_id != self._saved_update_id:
+            self.db.set_bot_state(self.STATE_KEY, self.last_update_id)
+            self._saved_update_id = self.last_update_id
+            self._last_save = time.monotonic()
+
+
+class BacklogCatchUp:
+    """Drains updates received while the bot was down, starting right after the last processed update.
+    Chats are processed in parallel (updates of one chat in order), stale repeated button presses are skipped
+    and updates are processed with limited rate, so replies to a big backlog don't hit flood limits"""
+
+    BATCH_SIZE = 100
+    CONCURRENCY = 32  # Chats processed at once
+    RATE_LIMIT = 20  # Updates per second, most updates produce one reply
+
+    def __init__(self, dispatcher: Dispatcher, tracker: UpdateTracker, concurrency: int = CONCURRENCY,
+                 rate_limit: float = RATE_LIMIT):
+        self.dp = dispatcher
+        self.tracker = tracker
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate_limit, capacity=rate_limit)
+        self.stats = {'processed': 0, 'skipped': 0, 'errors': 0}
+
+    async def run(self) -> dict:
+        """Process backlog until there are no pending updates. Returns counters"""
+        Dispatcher.set_current(self.dp)
+        Bot.set_current(self.dp.bot)
+        start = time.monotonic()
+        offset = self.tracker.last_update_id + 1 if self.tracker.last_update_id is not None else None
+        while True:
+            # Requesting with offset confirms all previous updates, so they are confirmed only after processing
+            updates = await self.dp.bot.get_updates(offset=offset, limit=self.BATCH_SIZE, timeout=0)
+            if not updates:
+                break
+            offset = updates[-1].update_id + 1
+            await self.process(updates)
+        self.tracker.save()
+        logging.getLogger(type(self).__name__).info(
+            f'Backlog processed in {round(time.monotonic() - start, 2)}s {self.stats}')
+        return self.stats
+
+    async def process(self, updates: list) -> None:
+        self.tracker.track(update.update_id for update in updates)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process_chat(chat_updates: list):
+            async with semaphore:
+                for update in chat_updates:
+                    await self.bucket.acquire()
+                    try:
+                        # Same way as polling, so update middlewares (and tracker) are triggered
+                        await self.dp.updates_handler.notify(update)
+                        self.stats['processed'] += 1
+                    except Exception:
+                        self.stats['errors'] += 1
+                        logging.getLogger(type(self).__name__).exception(f'Update [{update.update_id}] failed')
+                    finally:
+                        self.tracker.done(update.update_id)
+
+        await asyncio.gather(*[process_chat(chat_updates) for chat_updates in self.group_by_chat(updates)])
+
+    def group_by_chat(self, updates: list) -> list:
+        """Split updates by chat keeping the order. Button press is dropped if the same button of the same message
+        is pressed again later in the backlog"""
+        chats = {}
+        for update in updates:
+            chats.setdefault(self.get_chat_id(update), []).append(update)
+        result = []
+        for chat_updates in chats.values():
+            pressed = set()
+            kept = []
+            for update in reversed(chat_updates):
+                query = update.callback_query
+                if query is not None and query.message is not None:
+                    button = (query.message.message_id, query.data)
+                    if button in pressed:
+                        self.stats['skipped'] += 1
+                        self.tracker.done(update.update_id)
+                        continue
+                    pressed.add(button)
+                kept.append(update)
+            result.append(kept[::-1])
+        return result
+
+    @staticmethod
+    def get_chat_id(update: types.Update):
+        message = update.message or update.edited_message or update.channel_post or update.edited_channel_post
+        if message is not None:
+            return message.chat.id
+        if update.callback_query is not None:
+            return update.callback_query.from_user.id
+        return update.update_id  # Other updates are independent
+
+
+class TrackedPolling:
+    """Long polling which confirms to Telegram only processed updates: getUpdates offset follows the tracker
+    watermark, not the last received update, so updates queued or being processed when the bot crashed are delivered
+    again. Updates still in flight come again with every poll, the window drops them"""
+
+    POLL_TIMEOUT = 20
+    BATCH_SIZE = 100
+    ERROR_SLEEP = 5
+    WAIT_INTERVAL = .5  # Seconds to wait for processing when a poll brought only updates in flight
+
+    def __init__(self, dispatcher: Dispatcher, tracker: UpdateTracker, timeout: int = POLL_TIMEOUT):
+        self.dp = dispatcher
+        self.tracker = tracker
+        self.timeout = timeout
+        self.window = UpdateWindow()
+        if tracker.last_update_id is not None:
+            self.window.reset(tracker.last_update_id)
+        self._tasks = set()
+        self._stopped = False
+
+    async def run(self) -> None:
+        """Poll and process updates until stop(), then wait for updates in flight"""
+        logger = logging.getLogger(type(self).__name__)
+        Dispatcher.set_current(self.dp)
+        Bot.set_current(self.dp.bot)
+        try:
+            while not self._stopped:
+                offset = self.tracker.last_update_id + 1 if self.tracker.last_update_id is not None else None
+                try:
+                    updates = await self.dp.bot.get_updates(offset=offset, limit=self.BATCH_SIZE,
+                                                            timeout=self.timeout)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception('Getting updates failed')
+                    await asyncio.sleep(self.ERROR_SLEEP)
+                    continue
+                updates = [update for update in updates if not self.window.seen(update.update_id)]
+                if updates:
+                    self.tracker.track(update.update_id for update in updates)
+                    task = asyncio.ensure_future(self.process(updates))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                elif self._tasks:
+                    # Watermark is held by updates in flight, Telegram returns them at once without waiting
+                    await asyncio.wait(self._tasks, timeout=self.WAIT_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if self._tasks:
+                await asyncio.wait(self._tasks)
+            self.tracker.save()
+
+    async def process(self, updates: list) -> None:
+        try:
+            await self.dp.process_updates(updates)
+        except Exception:
+            logging.getLogger(type(self).__name__).exception('Updates processing failed')
+        finally:
+            for update in updates:  # Processed or failed, failing updates are not polled again and again
+                self.tracker.done(update.update_id)
+
+    def stop(self) -> None:
+        self._stopped = True
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'replay.db')  # Replay works with a copy of the database given in arguments
+
+import config
+from load_harness import JourneyError, LoadHarness
+from traffic_capture import Anonymizer, read_capture
+
+
+def update_step(update: dict) -> str:
+    """Latency group of an update: command, plain message or callback query by its data prefix"""
+    message = update.get('message') or update.get('edited_message')
+    if message is not None:
+        text = message.get('text') or ''
+        return text.split(' ')[0].split('_')[0] if text.startswith('/') else 'message'
+    return 'callback:' + (update['callback_query'].get('data') or '').split('_')[0]
+
+
+async def replay(records: list, path_to_db: str, speed: float = 1., mode: str = 'polling', salt: str = None,
+                 governed: bool = False, webhook_port: int = 8091) -> dict:
+    """Feed captured updates to the bot working with an anonymized copy of the database (a backup made when the
+    capture started, so added words are new again) and a fake Bot API.
+    Updates keep their capture intervals divided by speed (0 sends all of them at once)"""
+    if salt is None:
+        logging.getLogger('Replay').warning('Capture salt is not set, captured users are unknown to the database copy')
+    with tempfile.TemporaryDirectory() as directory:
+        path_to_copy = os.path.join(directory, 'replay.db')
+        source, copy = sqlite3.connect(path_to_db), sqlite3.connect(path_to_copy)
+        source.backup(copy)
+        source.close()
+        copy.close()
+        Anonymizer(salt).anonymize_database(path_to_copy)
+
+        harness = LoadHarness(path_to_copy, os.path.join(directory, 'replay_fsm.db'), mode, governed, webhook_port,
+                              strict_api=False)
+        await harness.start()
+        failed = []
+        lag = []
+
+        async def deliver(record: dict):
+            try:
+                await harness.deliver(update_step(record['update']), dict(record['update']))
+            except JourneyError as error:
+                failed.append(str(error))
+
+        try:
+            tasks = []
+            start = time.perf_counter()
+            first = records[0]['t'] if records else 0
+            for record in records:
+                delay = (record['t'] - first) / speed - (time.perf_counter() - start) if speed else 0
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    lag.append(-delay)
+                tasks.append(asyncio.ensure_future(deliver(record)))
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+        finally:
+            await harness.stop()
+    if failed:
+        logging.getLogger('Replay').warning(f'{len(failed)} updates failed, e.g. {failed[0]}')
+    return {
+        'speed': speed,
+        'captured_seconds': round(records[-1]['t'] - records[0]['t'], 3) if records else 0,
+        'failed_updates': len(failed),
+        'max_schedule_lag_ms': round(max(lag) * 1000, 2) if lag and speed else 0.,
+        **harness.report(elapsed)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay captured updates against a copy of the bot database')
+    parser.add_argument('capture', help='Capture file or directory with capture files')
+    parser.add_argument('--db', default=config.PATH_TO_DB,
+                        help='Bot database backup made at the capture start (not sharded)')
+    parser.add_argument('--speed', type=float, default=1., help='Replay speed, e.g. 10 for 10x, 0 for no delays')
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='polling')
+    parser.add_argument('--salt', default=config.TRAFFIC_CAPTURE_SALT, help='Capture anonymization key')
+    parser.add_argument('--limit', type=int, help='Replay only the first updates')
+    parser.add_argument('--governed', action='store_true', help='Send requests through the rate governor')
+    parser.add_argument('--webhook-port', type=int, default=8091)
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    captured = read_capture(arguments.capture)[:arguments.limit]
+    print(json.dumps(asyncio.run(replay(captured, arguments.db, arguments.speed, arguments.mode, arguments.salt,
+                                        arguments.governed, arguments.webhook_port)), indent=2))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+# ===== Local imports =====
+
+from loop_monitor import BOT_DIR, LoopMonitor
+
+IDLE = 'idle'  # Samples of the loop waiting for events
+TRUNCATED = '[truncated]'
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+class SamplingProfiler:
+    """Statistical profiler of the event loop thread. A helper thread takes the loop thread stack every interval
+    and counts collapsed stacks (root first, frames separated with ';') with the running handler as the root
+    frame, the format of flamegraph.pl and speedscope. One session at a time, memory is bounded by the number of
+    distinct stacks and the stack depth"""
+
+    INTERVAL = .01  # Seconds between samples
+    MAX_SECONDS = 120
+    MAX_STACKS = 5000  # Distinct stacks, further new stacks are counted as truncated ones of their handler
+    MAX_DEPTH = 64  # Innermost frames of a stack
+
+    def __init__(self, interval: float = INTERVAL, max_stacks: int = MAX_STACKS, max_depth: int = MAX_DEPTH):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, seconds: float) -> dict:
+        """Sample the running loop for seconds. Returns {stack: samples}, raises ProfilerBusyError if another
+        session is running"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError('Profiling is already running')
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        thread_id = threading.get_ident()
+
+        def sample() -> None:
+            try:
+                stacks = self._sample(thread_id, min(seconds, self.MAX_SECONDS))
+                loop.call_soon_threadsafe(done.set_result, stacks)
+            except Exception as error:
+                loop.call_soon_threadsafe(done.set_exception, error)
+            finally:
+                self._lock.release()
+
+        threading.Thread(target=sample, name='sampling-profiler', daemon=True).start()
+        return await done
+
+    def _sample(self, thread_id: int, seconds: float) -> dict:
+        stacks = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                break
+            stack = self.collapse(frame)
+            if stack not in stacks and len(stacks) >= self.max_stacks:
+                stack = stack.split(';', 1)[0] + ';' + TRUNCATED
+            stacks[stack] = stacks.get(stack, 0) + 1
+            del frame
+            time.sleep(self.interval)
+        return stacks
+
+    def collapse(self, frame) -> str:
+        """Stack of a frame as 'handler;file:function;...;file:function'"""
+        handler = LoopMonitor.get_handler(frame)
+        if frame.f_code.co_name == 'select' and frame.f_code.co_filename.endswith('selectors.py'):
+            handler = IDLE
+        frames = []
+        while frame is not None and len(frames) < self.max_depth:
+            filename = frame.f_code.co_filename
+            if filename.startswith(BOT_DIR) and 'site-packages' not in filename:
+                filename = os.path.relpath(filename, BOT_DIR)
+            else:
+                filename = os.path.basename(filename)
+            frames.append(f'{filename}:{frame.f_code.co_name}')
+            frame = frame.f_back
+        return ';'.join([handler] + frames[::-1])
+
+    @staticmethod
+    def render(stacks: dict) -> str:
+        """Collapsed stacks text: 'stack samples' per line, the most sampled first"""
+        return ''.join(f'{stack} {samples}\n'
+                       for stack, samples in sorted(stacks.items(), key=lambda item: item[1], reverse=True))
+
+    @staticmethod
+    def handlers_summary(stacks: dict) -> list:
+        """Samples by handler (the root frame) as (handler, samples) by samples desc"""
+        handlers = {}
+        for stack, samples in stacks.items():
+            handler = stack.split(';', 1)[0]
+            handlers[handler] = handlers.get(handler, 0) + samples
+        return sorted(handlers.items(), key=lambda item: item[1], reverse=True)
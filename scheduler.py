@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+from datetime import datetime, timedelta
+import logging
+import random
+import time
+
+
+class CronExpression:
+    """Five fields cron expression (minute hour day month weekday).
+    Supports '*', '*/n', 'a', 'a-b', 'a-b/n' and comma separated lists. Weekday 0 (or 7) is Sunday"""
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression must have 5 fields: {expression!r}')
+        self.minutes, self.hours, self.days, self.months, weekdays = \
+            [self._parse_field(field, low, high) for field, (low, high) in zip(fields, self.FIELDS)]
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> set:
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = map(int, part.split('-'))
+            else:
+                start = end = int(part)
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f'Cron field {field!r} is out of range [{low}-{high}]')
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt: datetime) -> bool:
+        day_matches = dt.day in self.days
+        weekday_matches = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_matches and weekday_matches
+        return day_matches or weekday_matches  # Standard cron: restricted day and weekday are combined with OR
+
+    def next_after(self, dt: datetime) -> datetime:
+        """Returns the nearest matching time strictly after dt"""
+        result = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = result + timedelta(days=366 * 4)
+        while result < limit:
+            if result.month not in self.months:
+                result = (result.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(result):
+                result = result.replace(hour=0, minute=0) + timedelta(days=1)
+            elif result.hour not in self.hours:
+                result = result.replace(minute=0) + timedelta(hours=1)
+            elif result.minute not in self.minutes:
+                result += timedelta(minutes=1)
+            else:
+                return result
+        raise ValueError(f'Cron expression {self.expression!r} never matches')
+
+
+class ScheduledJob:
+    """Scheduler job with interval or cron trigger and its runtime state"""
+
+    def __init__(self, name: str, func, interval: float = None, cron: str = None, jitter: float = 0,
+                 timeout: float = None, run_on_start: bool = False):
+        if (interval is None) == (cron is None):
+            raise ValueError(f'Job {name} must have either interval or cron trigger')
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronExpression(cron) if cron is not None else None
+        self.jitter = jitter
+        self.timeout = timeout
+        self.run_on_start = run_on_start
+        self.next_run = None
+        self.last_run = None
+        self.last_duration = None
+        self.last_status = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+
+    def schedule_next(self, now: float) -> None:
+        """Calculate next run timestamp. Overdue jobs are spread over the jitter window instead of firing at once"""
+        if self.cron is not None:
+            base = datetime.fromtimestamp(self.last_run if self.last_run is not None else now)
+            next_run = self.cron.next_after(base).timestamp()
+            if next_run < now:
+                next_run = self.cron.next_after(datetime.fromtimestamp(now)).timestamp()
+        else:
+            next_run = self.last_run + self.interval if self.last_run is not None else now + self.interval
+        self.next_run = max(next_run, now) + random.uniform(0, self.jitter)
+
+
+class Scheduler:
+    """In-process asyncio jobs scheduler with interval and cron jobs, jitter, overlap protection and per-job
+    timeouts. Last runs are persisted in database (if provided), so jobs keep their schedule after restart"""
+
+    MAX_SLEEP = 60
+
+    def __init__(self, db_manager=None):
+        self.db = db_manager
+        self.jobs = {}
+        self._wakeup = asyncio.Event()
+        self._tasks = set()
+        self._running = False
+
+    def add_interval_job(self, name: str, func, seconds: float, jitter: float = 0, timeout: float = None,
+                         run_on_start: bool = False) -> ScheduledJob:
+        return self._add_job(ScheduledJob(name, func, interval=seconds, jitter=jitter, timeout=timeout,
+                                          run_on_start=run_on_start))
+
+    def add_cron_job(self, name: str, func, expression: str, jitter: float = 0,
+                     timeout: float = None) -> ScheduledJob:
+        return self._add_job(ScheduledJob(name, func, cron=expression, jitter=jitter, timeout=timeout))
+
+    def _add_job(self, job: ScheduledJob) -> ScheduledJob:
+        if job.name in self.jobs:
+            raise ValueError(f'Job {job.name} already exists')
+        self.jobs[job.name] = job
+        if self._running:
+            self._init_job(job, time.time())
+            self._wakeup.set()
+        return job
+
+    def _init_job(self, job: ScheduledJob, now: float) -> None:
+        if self.db is not None:
+            job_state = self.db.get_scheduler_job(job.name)
+            if job_state is not None:
+                job.last_run, job.last_duration, job.last_status = job_state
+        if job.run_on_start:
+            job.next_run = now + random.uniform(0, job.jitter)
+        else:
+            job.schedule_next(now)
+
+    async def run(self) -> None:
+        """Scheduler main loop"""
+        self._running = True
+        now = time.time()
+        for job in self.jobs.values():
+            self._init_job(job, now)
+        logging.getLogger(type(self).__name__).info(f'Scheduler started [{len(self.jobs)} jobs]')
+        try:
+            while self._running:
+                now = time.time()
+                for job in self.jobs.values():
+                    if job.next_run <= now:
+                        self._start_job(job, now)
+                next_run = min((job.next_run for job in self.jobs.values()), default=now + self.MAX_SLEEP)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(max(next_run - now, 0), self.MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._running = False
+            for task in list(self._tasks):
+                task.cancel()
+
+    def _start_job(self, job: ScheduledJob, now: float) -> None:
+        if job.running:
+            job.skipped += 1
+            logging.getLogger(type(self).__name__).warning(f'Job [{job.name}] is still running, run skipped')
+            job.schedule_next(now)
+            return
+        job.running = True
+        job.next_run = float('inf')
+        task = asyncio.ensure_future(self._execute(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, job: ScheduledJob) -> None:
+        start_time = time.time()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(job.func(), timeout=job.timeout)
+            job.last_status = 'ok'
+        except asyncio.TimeoutError:
+            job.last_status = 'timeout'
+            job.failures += 1
+            logging.getLogger(type(self).__name__).error(f'Job [{job.name}] timed out after {job.timeout}s')
+        except asyncio.CancelledError:
+            job.last_status = 'cancelled'
+            raise
+        except Exception as error:
+            job.last_status = 'error'
+            job.failures += 1
+            logging.getLogger(type(self).__name__).exception(f'Job [{job.name}] failed ({error})')
+        finally:
+            job.running = False
+            job.runs += 1
+            job.last_run = start_time
+            job.last_duration = time.perf_counter() - start
+            if self.db is not None:
+                self.db.save_scheduler_job(job.name, job.last_run, job.last_duration, job.last_status)
+            job.schedule_next(time.time())
+            self._wakeup.set()
+
+    def stop(self) -> None:
+        self._running = False
+        self._wakeup.set()
+
+    def get_jobs_info(self) -> list:
+        """Returns jobs runtime info: (name, last run, last duration, last status, next run, runs, failures)"""
+        return [(job.name, job.last_run, job.last_duration, job.last_status, job.next_run, job.runs, job.failures)
+                for job in self.jobs.values()]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import functools
+import logging
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls into one in-flight execution shared by every caller"""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func, *args):
+        """Run func(*args) once per key at a time. Sync functions are executed in the default executor,
+        all concurrent callers with the same key get the same result (or the same exception)"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run(func, *args))
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._forget, key))
+        else:
+            logging.getLogger(type(self).__name__).debug(f'Joined in-flight call {key}')
+        # Shield the shared task, so a cancelled caller doesn't cancel it for the rest of the waiters
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    @staticmethod
+    async def _run(func, *args):
+        if asyncio.iscoroutinefunction(func):
+            return await func(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+
+    def _forget(self, key, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Mark exception as retrieved even if every waiter was cancelled
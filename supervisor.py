@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+
+# ===== External libs imports =====
+
+from aiogram import Bot, types
+
+# ===== Local imports =====
+
+import config
+from db_manager import DbManager
+from fsm_storage import SQLiteStorage
+from governor import GovernedBot, RateGovernor
+from loop_monitor import LoopMonitor
+from metrics import MetricsServer
+from ordered_dispatcher import ChatOrderedDispatcher
+from recovery import UpdateTracker
+from vocabulary_bot import VocabularyBot
+from webhook import UpdateWindow
+
+QUEUE_POLL_INTERVAL = 1  # Seconds, so processes notice shutdown while waiting for a queue
+
+
+def get_token(dev_mode: bool) -> str:
+    return config.TOKEN_DEV if dev_mode else config.TOKEN
+
+
+def get_fsm_db_path(dev_mode: bool) -> str:
+    return config.PATH_TO_FSM_DB.replace('.db', '_dev.db') if dev_mode else config.PATH_TO_FSM_DB
+
+
+async def run_worker(worker_id: int, workers: int, dev_mode: bool, inbox, outbox) -> None:
+    """Worker process: full bot processing updates of its chats partition received from supervisor"""
+    logging.basicConfig(level=logging.INFO, format=f'[worker {worker_id}] %(levelname)s:%(name)s:%(message)s')
+    # Telegram global limit is shared by all workers, per-chat limits belong to the worker owning the chat
+    bot = GovernedBot(token=get_token(dev_mode), governor=RateGovernor(RateGovernor.GLOBAL_RATE / workers))
+    storage = SQLiteStorage(get_fsm_db_path(dev_mode), ttl=config.FSM_STATES_TTL)
+    dp = ChatOrderedDispatcher(bot, storage=storage)
+    vocabulary_bot = VocabularyBot(bot, dp, dev_mode, worker_id)
+    scheduler = asyncio.create_task(vocabulary_bot.run_scheduler())
+    metrics_server = MetricsServer()
+    if config.METRICS_PORT:  # Every worker serves its own metrics on METRICS_PORT + worker ID
+        await metrics_server.start(config.METRICS_HOST, config.METRICS_PORT + worker_id)
+    loop_monitor = LoopMonitor(config.LOOP_MONITOR_INTERVAL, config.LOOP_BLOCK_THRESHOLD)
+    if config.LOOP_BLOCK_THRESHOLD:
+        loop_monitor.start()
+    if vocabulary_bot.is_main_worker:
+        await vocabulary_bot.admin.resume_mailings()
+
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def process(batch: list):
+        try:
+            await dp.process_updates([types.Update(**update) for update in batch])
+        finally:
+            outbox.put([update['update_id'] for update in batch])
+
+    while True:
+        try:
+            batch = await loop.run_in_executor(None, inbox.get, True, QUEUE_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        if batch is None:
+            break
+        task = asyncio.ensure_future(process(batch))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+    scheduler.cancel()
+    loop_monitor.stop()
+    await metrics_server.stop()
+    dp.stop_workers()
+    await vocabulary_bot.shutdown()
+    await storage.close()
+    await storage.wait_closed()
+    await bot.session.close()
+
+
+def worker_main(worker_id: int, workers: int, dev_mode: bool, inbox, outbox) -> None:
+    asyncio.run(run_worker(worker_id, workers, dev_mode, inbox, outbox))
+
+
+class Supervisor:
+    """Multi-process mode. Supervisor receives updates with long polling and passes them to worker processes,
+    each owning a partition of chats by chat ID, so updates of one chat are always processed by one worker in order.
+    Workers share one SQLite database in WAL mode (writers wait for each other with busy timeout), supervisor
+    is the only writer of the last processed update ID. Polling offset follows it, so Telegram forgets only processed
+    updates. Workers which died are restarted and get their unfinished updates again"""
+
+    POLL_TIMEOUT = 20
+    BATCH_SIZE = 100
+    ERROR_SLEEP = 5
+    WAIT_INTERVAL = .5  # Seconds to wait for workers when a poll brought only updates in flight
+
+    def __init__(self, workers: int, dev_mode: bool):
+        self.workers = workers
+        self.dev_mode = dev_mode
+        self.context = multiprocessing.get_context('spawn')
+        self.inboxes = [self.context.Queue() for _ in range(workers)]
+        self.outbox = self.context.Queue()
+        self.processes = [None for _ in range(workers)]
+        self.pending = [{} for _ in range(workers)]  # Update ID -> update sent to the worker and not finished yet
+        # Database is created (and copied in development mode) once here, before workers open it
+        self.db = DbManager(config.PATH_TO_DB, dev_mode, shards=config.DB_SHARDS)
+        self.db.create_connection()
+        self.tracker = UpdateTracker(self.db)
+        self.window = UpdateWindow()
+        if self.tracker.last_update_id is not None:
+            self.window.reset(self.tracker.last_update_id)
+        self._stopped = False
+
+    def get_worker(self, update: types.Update) -> int:
+        chat_id = ChatOrderedDispatcher.get_chat_id(update)
+        return (chat_id if isinstance(chat_id, int) else update.update_id) % self.workers
+
+    def start_worker(self, worker_id: int) -> None:
+        process = self.context.Process(target=worker_main, name=f'worker-{worker_id}', daemon=True,
+                                       args=(worker_id, self.workers, self.dev_mode, self.inboxes[worker_id],
+                                             self.outbox))
+        process.start()
+        self.processes[worker_id] = process
+
+    def check_workers(self) -> None:
+        for worker_id, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logging.getLogger(type(self).__name__).error(
+                    f'Worker {worker_id} died [exit code {process.exitcode}], restarting')
+                # Batches left in the old inbox are sent again with the updates the dead worker was processing
+                self.inboxes[worker_id] = self.context.Queue()
+                self.start_worker(worker_id)
+                pending = self.pending[worker_id]
+                if pending:
+                    self.inboxes[worker_id].put([pending[update_id] for update_id in sorted(pending)])
+
+    async def collect_done(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._stopped or any(self.pending):
+            try:
+                update_ids = await loop.run_in_executor(None, self.outbox.get, True, QUEUE_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            for update_id in update_ids:
+                for pending in self.pending:
+                    pending.pop(update_id, None)
+                self.tracker.done(update_id)
+
+    async def run(self) -> None:
+        logger = logging.getLogger(type(self).__name__)
+        bot = Bot(token=get_token(self.dev_mode))
+        await bot.set_my_commands(VocabularyBot.commands)
+        await bot.delete_webhook()
+        for worker_id in range(self.workers):
+            self.start_worker(worker_id)
+        collector = asyncio.ensure_future(self.collect_done())
+        logger.info(f'Started {self.workers} workers, polling from update {self.tracker.last_update_id}')
+        try:
+            while True:
+                self.check_workers()
+                # Requesting with offset confirms all previous updates, so offset doesn't pass updates in flight
+                offset = self.tracker.last_update_id + 1 if self.tracker.last_update_id is not None else None
+                try:
+                    updates = await bot.get_updates(offset=offset, limit=self.BATCH_SIZE, timeout=self.POLL_TIMEOUT)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception('Getting updates failed')
+                    await asyncio.sleep(self.ERROR_SLEEP)
+                    continue
+                updates = [update for update in updates if not self.window.seen(update.update_id)]
+                if not updates:
+                    if any(self.pending):  # Telegram returns updates in flight at once, without long polling
+                        await asyncio.sleep(self.WAIT_INTERVAL)
+                    continue
+                self.tracker.track(update.update_id for update in updates)
+                batches = {}
+                for update in updates:
+                    batches.setdefault(self.get_worker(update), []).append(update.to_python())
+                for worker_id, batch in batches.items():
+                    self.pending[worker_id].update((update['update_id'], update) for update in batch)
+                    self.inboxes[worker_id].put(batch)
+        finally:
+            # Workers finish updates they have received before exit
+            self._stopped = True
+            for inbox in self.inboxes:
+                inbox.put(None)
+            loop = asyncio.get_running_loop()
+            for process in self.processes:
+                await loop.run_in_executor(None, process.join)
+            await collector
+            self.tracker.save()
+            self.db.close_connection()
+            await bot.session.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    is_dev_mode = 'dev' in sys.argv
+    workers_count = next((int(arg) for arg in sys.argv[1:] if arg.isdigit()), os.cpu_count() or 1)
+    try:
+        asyncio.run(Supervisor(workers_count, is_dev_mode).run())
+    except KeyboardInterrupt:
+        pass
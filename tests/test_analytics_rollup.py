@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'test.db')  # Required by config when there is no .env file
+
+from analytics import BotAnalytics
+from db_manager import DbManager
+from tests.test_db_sharding import SCHEMA
+
+DAY = 1609459200  # 2021-01-01 00:00 UTC
+
+
+class AnalyticsRollupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'bot.db')
+        conn = sqlite3.connect(self.path)
+        conn.executescript(SCHEMA)
+        conn.executemany('INSERT INTO metrics VALUES (?, ?)', [(1, 'start'), (2, 'dictionary')])
+        conn.executemany('INSERT INTO analytics_log (metric, user_id, count) VALUES (?, ?, ?)',
+                         [(1, 10, 5), (2, 10, 3)])  # Counted before the events log
+        conn.commit()
+        conn.close()
+        self.db = DbManager(self.path, False)
+        self.db.create_connection()
+
+    def tearDown(self):
+        self.db.close_connection()
+        self.directory.cleanup()
+
+    def test_rollup_and_retention(self):
+        analytics = BotAnalytics(self.db)
+        analytics._log_event('dictionary', 10)
+        analytics._log_event('quiz', 11)  # New metric is created
+        analytics.flush()
+        self.db.add_analytics_events([(1, 10, DAY + 10), (1, 11, DAY + 3700), (1, 10, DAY + 86400)])
+        self.assertEqual(self.db.rollup_analytics_events(), 5)
+        self.assertEqual(self.db.rollup_analytics_events(), 0)  # Events are folded once
+
+        quiz = self.db.get_metric_id('quiz')
+        self.assertEqual(self.db.get_admin_statistics(), [(1, 8, 'start'), (2, 4, 'dictionary'), (quiz, 1, 'quiz')])
+        self.assertEqual(self.db.get_daily_traffic('2021-01-01')[:2], [('2021-01-01', 2), ('2021-01-02', 1)])
+        self.assertEqual(self.db.get_hourly_traffic(DAY)[:2], [(DAY, 1), (DAY + 3600, 1)])
+        self.assertEqual(self.db.conn.execute('SELECT count FROM analytics_log WHERE user_id=10 AND metric=1')
+                         .fetchall(), [(7,)])
+
+        self.assertEqual(self.db.purge_analytics_events(DAY + 86400, DAY + 3600), (2, 1))
+        self.assertEqual(self.db.get_admin_statistics()[0], (1, 8, 'start'))  # Daily counts are kept
+
+    def test_unique_users(self):
+        analytics = BotAnalytics(self.db)
+        for user_id in range(200):
+            analytics._log_event('start' if user_id % 2 else 'dictionary', user_id)
+        analytics.save_sketches()
+        analytics._log_event('dictionary', 1000)  # Not saved yet
+        self.assertAlmostEqual(analytics.get_unique_users(1), 201, delta=4)
+        self.assertAlmostEqual(dict(analytics.get_feature_unique_users(7))['dictionary'], 101, delta=3)
+        self.assertTrue(analytics.dirty_sketches)  # Read paths don't open write transactions
+        self.db.add_user(1, 'user', 'User', '')
+        self.assertEqual(self.db.get_users_count(), 1)
+        self.db.add_user(2, 'user', 'User', '')
+        self.assertEqual(self.db.get_users_count(), 2)
+
+    def test_sketches_are_merged_inside_open_transaction(self):
+        analytics = BotAnalytics(self.db)
+        analytics._log_event('dictionary', 10)
+        self.db.conn.execute('INSERT INTO metrics VALUES (3, ?)', ('quiz',))  # Implicitly opens a transaction
+        analytics.save_sketches()
+        self.assertFalse(self.db.conn.in_transaction)
+        self.assertEqual(len(self.db.get_hll_sketches('2000-01-01')), 2)
+        self.assertEqual(self.db.get_metric_id('quiz'), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import os
+import unittest
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'test.db')  # Required by config when there is no .env file
+
+from antiflood import TimerWheel, VocabularyBotAntifloodMiddleware
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def test_callbacks_fire_in_order_with_single_task(self):
+        fired = []
+
+        async def callback(name):
+            fired.append(name)
+
+        async def run():
+            wheel = TimerWheel(tick=.01, slots=4)
+            wheel.schedule(.05, callback, 'late')  # Longer than one wheel round
+            wheel.schedule(.01, callback, 'early')
+            task = wheel._task
+            await asyncio.sleep(.15)
+            self.assertIs(wheel._task, task)
+            self.assertEqual(wheel.size, 0)
+
+        asyncio.run(run())
+        self.assertEqual(fired, ['early', 'late'])
+
+
+class AntifloodBucketTest(unittest.TestCase):
+
+    def test_bucket_limits_and_eviction(self):
+        middleware = VocabularyBotAntifloodMiddleware(lang_manager=None)
+        self.assertIsNone(middleware._hit(1, 'key', 10, 2))
+        self.assertIsNone(middleware._hit(1, 'key', 10, 2))
+        bucket = middleware._hit(1, 'key', 10, 2)
+        self.assertEqual(bucket[2], 1)
+        self.assertIsNone(middleware._hit(2, 'key', 10, 1))
+        bucket[0], bucket[1] = 2, 0  # Refilled long ago
+        middleware._evict(100)
+        self.assertEqual(list(middleware.buckets), [(2, 'key')])
+
+
+if __name__ == '__main__':
+    unittest.main()
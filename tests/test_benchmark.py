@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import unittest
+
+# ===== Local imports =====
+
+from benchmark import compare, run_benchmarks
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_suite_runs_on_small_database(self):
+        results = run_benchmarks(users=20, words_per_user=12, lang_pairs=[('en', 'ru'), ('ru', 'en')], events=500,
+                                 repeat=5)
+        self.assertEqual(set(results['results']), {
+            'get_user_dict', 'get_user_dictionary_stats', 'get_user_quiz_data', 'get_rating_list',
+            'analytics_flush', 'analytics_log_event', 'get_user_profile_page', 'dictionary_pagination'})
+        self.assertEqual(results['results']['get_user_dict']['queries_per_call'], 1)
+
+        baseline = {'results': {name: dict(case, mean_us=case['mean_us'] / 2)
+                                for name, case in results['results'].items()}}
+        comparison = compare(results, baseline)
+        self.assertEqual(len(comparison), 8)
+        self.assertTrue(all(row[3] > 90 and row[4] for row in comparison))  # Twice slower than the baseline
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import time
+import unittest
+
+# ===== External libs imports =====
+
+from aiogram.utils import exceptions
+
+# ===== Local imports =====
+
+from broadcast import BroadcastEngine, MailingLedger
+
+
+class FakeBot:
+
+    def __init__(self, blocked: set = frozenset(), retry_chats: set = frozenset()):
+        self.blocked = blocked
+        self.retry_chats = set(retry_chats)
+        self.sent = []
+
+    async def send_message(self, chat_id: int, text: str, disable_notification: bool = False):
+        if chat_id in self.blocked:
+            raise exceptions.BotBlocked('Forbidden: bot was blocked by the user')
+        if chat_id in self.retry_chats:
+            self.retry_chats.discard(chat_id)
+            raise exceptions.RetryAfter(1)
+        self.sent.append((chat_id, text, time.monotonic()))
+
+
+class BroadcastEngineTest(unittest.TestCase):
+
+    def test_statuses_and_rendered_texts(self):
+        bot = FakeBot(blocked={3})
+        engine = BroadcastEngine(bot, rate_limit=1000)
+        delivered = []
+        result = asyncio.run(engine.broadcast([(1, 'en'), (2, 'ru'), (3, 'en'), (4, 'en')],
+                                              lambda lang_code: f'Hello [{lang_code}]',
+                                              on_delivered=lambda user_id, status: delivered.append(user_id)))
+        self.assertEqual(result, {BroadcastEngine.SENT: 3, BroadcastEngine.BLOCKED: 1})
+        self.assertEqual(sorted(delivered), [1, 2, 3, 4])
+        self.assertIn((2, 'Hello [ru]'), [(chat_id, text) for chat_id, text, _ in bot.sent])
+
+    def test_rate_has_no_initial_burst(self):
+        bot = FakeBot()
+        engine = BroadcastEngine(bot, rate_limit=20)
+        asyncio.run(engine.broadcast([(user_id, 'en') for user_id in range(11)], lambda lang_code: 'Hello'))
+        # The first message goes at once, the next ten at the rate: no full second of tokens up front
+        self.assertGreaterEqual(bot.sent[-1][2] - bot.sent[0][2], 10 / 20 - .05)
+
+    def test_retry_after_pauses_all_workers(self):
+        bot = FakeBot(retry_chats={1})
+        engine = BroadcastEngine(bot, rate_limit=1000, concurrency=4)
+        start = time.monotonic()
+        result = asyncio.run(engine.broadcast([(user_id, 'en') for user_id in range(1, 5)], lambda lang_code: 'Hi'))
+        self.assertEqual(result, {BroadcastEngine.SENT: 4})
+        # Flood limit is global for the bot, other workers must not keep sending
+        self.assertGreaterEqual(min(sent for _, _, sent in bot.sent) - start, 1 - .05)
+
+
+class FakeDbManager:
+
+    def __init__(self):
+        self.checkpoints = []
+
+    def save_mailing_checkpoint(self, job_id, last_user_id, deliveries, unreachable):
+        self.checkpoints.append((job_id, last_user_id, list(deliveries), list(unreachable)))
+
+
+class MailingLedgerTest(unittest.TestCase):
+
+    def test_watermark_and_unreachable_users(self):
+        db = FakeDbManager()
+        ledger = MailingLedger(db, 7, last_user_id=10)
+        recipients = list(ledger.track([(11, 'en'), (12, 'en'), (13, 'en')]))
+        self.assertEqual(len(recipients), 3)
+        ledger.delivered(13, BroadcastEngine.SENT)
+        ledger.delivered(11, BroadcastEngine.BLOCKED)
+        self.assertEqual(ledger.last_user_id, 11)  # 12 is still being sent, restart must resend it
+        ledger.flush()
+        ledger.delivered(12, BroadcastEngine.SENT)
+        ledger.flush()
+        ledger.flush()  # Nothing new, no checkpoint
+        self.assertEqual(db.checkpoints, [
+            (7, 11, [(7, 13, 'sent'), (7, 11, 'blocked')], [(11, 'blocked')]),
+            (7, 13, [(7, 12, 'sent')], [])
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+# ===== External libs imports =====
+
+from aiogram import Bot, Dispatcher, types
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'test.db')  # Required by config when there is no .env file
+
+from db_manager import DbManager
+from db_profiler import FILTERS, QueryProfiler
+from tests.test_db_sharding import SCHEMA
+from tests.test_ordered_dispatcher import message_update
+
+
+class QueryProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'bot.db')
+        conn = sqlite3.connect(path)
+        conn.executescript(SCHEMA)
+        conn.executemany('INSERT INTO users (user_id, user_firstname) VALUES (?, ?)',
+                         [(user_id, f'User {user_id}') for user_id in range(1, 11)])
+        conn.commit()
+        conn.close()
+        self.db = DbManager(path, False)
+        self.db.create_connection()
+        self.profiler = self.db.profiler = QueryProfiler(slow_query=10, query_budget=3)
+
+    def tearDown(self):
+        self.db.close_connection()
+        self.directory.cleanup()
+
+    def test_statement_stats_and_slow_query_plan(self):
+        self.assertEqual(len(self.db.get_users_list()), 10)
+        for user_id in range(1, 4):
+            self.db.get_user_lang(user_id)
+        stats = dict(self.profiler.top())
+        self.assertEqual(stats['SELECT user_id FROM users'].rows, 10)
+        self.assertEqual(stats['SELECT lang FROM users WHERE user_id=?'].count, 3)
+        self.profiler.slow_query = 0
+        with self.assertLogs('QueryProfiler', 'WARNING') as logs:
+            self.db.get_user_lang(1)
+        self.assertIn('SEARCH users USING INTEGER PRIMARY KEY', logs.output[0])
+
+    def test_queries_budget_per_update(self):
+        async def run():
+            bot = Bot(token='123456:test')
+            dp = Dispatcher(bot)
+            dp.middleware.setup(self.profiler)
+
+            @dp.message_handler(lambda message: self.db.is_user_exists(message.chat.id))
+            async def handler(message: types.Message):
+                for user_id, in self.db.get_users_list():  # N+1 queries
+                    self.db.get_user_lang(user_id)
+
+            try:
+                with self.profiler.expect_max_queries(5):
+                    await dp.process_updates([message_update(1, 1)])
+            finally:
+                await bot.session.close()
+
+        with self.assertLogs('QueryProfiler', 'WARNING'):
+            with self.assertRaises(AssertionError):
+                asyncio.run(run())
+        profile = self.profiler.over_budget[0]
+        self.assertEqual(profile.queries, 12)
+        self.assertEqual(profile.handlers, {FILTERS: 1, 'handler': 11})
+
+
+if __name__ == '__main__':
+    unittest.main()
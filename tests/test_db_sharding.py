@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'test.db')  # Required by config when there is no .env file
+
+import metrics
+from db_manager import DbManager
+from db_profiler import QueryProfiler
+
+SCHEMA = '''
+CREATE TABLE users (user_id INTEGER PRIMARY KEY, user_nickname TEXT, user_firstname TEXT, user_lastname TEXT,
+                    lang TEXT DEFAULT 'en', date_added TIMESTAMP, referrals INTEGER DEFAULT 0, referrer INTEGER,
+                    mailings INTEGER DEFAULT 2);
+CREATE TABLE words (word_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, word_string TEXT,
+                    word_translation TEXT, date_added TIMESTAMP, from_lang TEXT, to_lang TEXT);
+CREATE INDEX words_user_id ON words (user_id);
+CREATE TABLE metrics (metric_id INTEGER PRIMARY KEY, metric_name TEXT);
+CREATE TABLE analytics_log (metric INTEGER, user_id INTEGER, count INTEGER DEFAULT 1);
+CREATE TABLE permissions (permission_level INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE admins (user_id INTEGER PRIMARY KEY, permission_level INTEGER);
+CREATE TABLE achievements (user_id INTEGER, name TEXT, date_added TIMESTAMP);
+CREATE TABLE achievements_log (user_id INTEGER, achievement TEXT, date_added TIMESTAMP);
+'''
+
+
+class DbShardingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'bot.db')
+        conn = sqlite3.connect(self.path)
+        conn.executescript(SCHEMA)
+        conn.executemany('INSERT INTO users (user_id, user_firstname) VALUES (?, ?)',
+                         [(user_id, f'User {user_id}') for user_id in range(1, 7)])
+        conn.executemany('INSERT INTO metrics VALUES (?, ?)', [(1, 'start'), (2, 'dictionary')])
+        # Words of an existing single-file database are moved to shards on the first start
+        conn.executemany('INSERT INTO words (user_id, word_string, word_translation, date_added, from_lang, to_lang) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         [(user_id, f'word{i}', f'translation{i}', '2021-01-01', 'en', 'ru')
+                          for user_id in range(1, 7) for i in range(user_id)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_user_data_is_routed_to_shards(self):
+        db = DbManager(self.path, False, shards=3)
+        db.create_connection()
+        events = [(1, user_id, 1609459200) for user_id in range(1, 7)] + [(2, 4, 1609459200), (2, 4, 1609459201)]
+        db.add_analytics_events(events)
+        self.assertEqual(db.rollup_analytics_events(), 8)
+        db.add_user_word('new', 'новое', 6, 'en', 'ru')
+
+        self.assertEqual(len(db.get_user_dict(6, 'en', 'ru')), 7)
+        self.assertEqual(db.get_user_total_dict_capacity(2), 2)
+        for shard, conn in enumerate(db.shard_conns):
+            user_ids = {row[0] for row in conn.execute('SELECT user_id FROM words')}
+            self.assertEqual(user_ids, {user_id for user_id in range(1, 7) if user_id % 3 == shard})
+            self.assertEqual(conn.execute("SELECT name FROM sqlite_master WHERE type='index'").fetchall(),
+                             [('words_user_id',)])
+
+        self.assertEqual(db.get_admin_statistics(), [(1, 6, 'start'), (2, 2, 'dictionary')])
+        self.assertEqual(db.shard_conns[1].execute('SELECT metric, user_id, count FROM analytics_log ORDER BY metric, '
+                                                   'user_id').fetchall(), [(1, 1, 1), (1, 4, 1), (2, 4, 2)])
+        self.assertEqual(db.get_rating_list(3, 0), [(6, 'User 6', 7), (5, 'User 5', 5), (4, 'User 4', 4)])
+        self.assertEqual(db.get_rating_list(2, 3), [(3, 'User 3', 3), (2, 'User 2', 2)])
+        db.close_connection()
+
+
+    def test_scatter_queries_are_accounted(self):
+        db = DbManager(self.path, False, shards=3)
+        db.create_connection()
+        db.profiler = QueryProfiler(slow_query=10)
+        queries = metrics.DB_QUERIES.values.get((), 0)
+        self.assertEqual(len(db.get_rating_list(10, 0)), 6)
+        # Shard queries are accounted in the calling thread, not in executor threads
+        stats = [stats for statement, stats in db.profiler.top() if statement.endswith('LIMIT ?')]
+        self.assertEqual((stats[0].count, stats[0].rows), (3, 6))
+        self.assertGreaterEqual(metrics.DB_QUERIES.values[()] - queries, 3)
+        db.close_connection()
+
+
+if __name__ == '__main__':
+    unittest.main()
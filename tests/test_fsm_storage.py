@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+# ===== Local imports =====
+
+from fsm_storage import SQLiteStorage
+
+
+class SQLiteStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'fsm.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_states_survive_restart(self):
+        quiz_data = [{'word': f'word{i}', 'options': [f'option{j}' for j in range(4)]} for i in range(10)]
+
+        async def write():
+            storage = SQLiteStorage(self.path, flush_interval=60)
+            await storage.set_state(chat=1, user=1, state='DictionaryQuizState:user_answers')
+            await storage.set_data(chat=1, user=1, data={'quiz_data': quiz_data, 'index': 1})
+            for index in range(2, 5):  # Hot key changes are buffered until flush
+                await storage.update_data(chat=1, user=1, index=index)
+            await storage.set_state(chat=2, user=2, state='DictionaryState:dictionary')
+            await storage.reset_state(chat=2, user=2)
+            await storage.close()
+            await storage.wait_closed()
+
+        async def read():
+            storage = SQLiteStorage(self.path)
+            self.assertEqual(await storage.get_state(chat=1, user=1), 'DictionaryQuizState:user_answers')
+            self.assertEqual(await storage.get_data(chat=1, user=1), {'quiz_data': quiz_data, 'index': 4})
+            self.assertIsNone(await storage.get_state(chat=2, user=2))
+            self.assertEqual(storage.conn.execute('SELECT COUNT(*) FROM fsm_states').fetchone()[0], 1)
+            await storage.close()
+            await storage.wait_closed()
+
+        asyncio.run(write())
+        asyncio.run(read())
+
+    def test_cache_is_bounded_and_expired_states_purged(self):
+        async def run():
+            storage = SQLiteStorage(self.path, ttl=60, cache_size=10)
+            for user in range(50):
+                await storage.set_state(chat=user, user=user, state='state')
+            storage.flush()
+            self.assertEqual(len(storage._cache), 10)
+            storage.conn.execute('UPDATE fsm_states SET date_updated=0 WHERE user < 20')
+            self.assertEqual(storage.purge_expired(), 20)
+            self.assertIsNone(await storage.get_state(chat=5, user=5))
+            await storage.close()
+            await storage.wait_closed()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import time
+import unittest
+
+# ===== External libs imports =====
+
+from aiogram.utils import exceptions
+
+# ===== Local imports =====
+
+from broadcast import BroadcastEngine
+from governor import PRIORITY_BULK, PRIORITY_INTERACTIVE, GovernedBot, RateGovernor
+
+
+class RetryingBot(GovernedBot):
+    """Governed bot answering the first request to every chat in retry_chats with RetryAfter"""
+
+    def __init__(self, retry_chats: set, retry_after: int = 1):
+        super().__init__('123456:test', governor=RateGovernor(global_rate=1000))
+        self.retry_chats = set(retry_chats)
+        self.retry_after = retry_after
+        self.sent = []
+
+    async def _timed_request(self, method: str, data=None, files=None, **kwargs):
+        if data['chat_id'] in self.retry_chats:
+            self.retry_chats.discard(data['chat_id'])
+            raise exceptions.RetryAfter(self.retry_after)
+        self.sent.append((data['chat_id'], time.monotonic()))
+        return {'message_id': 1, 'date': 0, 'chat': {'id': data['chat_id'], 'type': 'private'}}
+
+
+class RateGovernorTest(unittest.TestCase):
+
+    def test_interactive_lane_goes_first(self):
+        async def run() -> list:
+            governor = RateGovernor(global_rate=20)
+            governor.global_bucket.tokens = 0
+            granted = []
+
+            async def request(name: str, chat_id: int, priority: int):
+                await governor.acquire(chat_id, priority)
+                granted.append(name)
+
+            requests = [asyncio.ensure_future(request(f'bulk{chat_id}', chat_id, PRIORITY_BULK))
+                        for chat_id in range(3)]
+            await asyncio.sleep(0)
+            requests.append(asyncio.ensure_future(request('interactive', 10, PRIORITY_INTERACTIVE)))
+            await asyncio.gather(*requests)
+            self.assertEqual(governor.stats()['lanes']['bulk']['granted'], 3)
+            return granted
+
+        self.assertEqual(asyncio.run(run()), ['interactive', 'bulk0', 'bulk1', 'bulk2'])
+
+    def test_rate_has_no_initial_burst(self):
+        async def run() -> float:
+            governor = RateGovernor(global_rate=20)
+            start = time.monotonic()
+            await asyncio.gather(*[governor.acquire(chat_id, PRIORITY_BULK) for chat_id in range(11)])
+            return time.monotonic() - start
+
+        # The first request goes at once, the next ten at the rate: no full second of tokens up front
+        self.assertGreaterEqual(asyncio.run(run()), 10 / 20 - .05)
+
+    def test_limited_chat_does_not_block_others(self):
+        async def run() -> list:
+            governor = RateGovernor(global_rate=1000)
+            governor.CHAT_RATE, governor.CHAT_BURST = 10, 1
+            granted = []
+
+            async def request(chat_id: int):
+                await governor.acquire(chat_id, PRIORITY_BULK)
+                granted.append(chat_id)
+
+            await asyncio.gather(*[request(chat_id) for chat_id in (1, 1, 1, 2)])
+            return granted
+
+        # The second request to chat 1 waits for its bucket, the request to chat 2 is granted meanwhile
+        self.assertEqual(asyncio.run(run()), [1, 2, 1, 1])
+
+    def test_retry_after_pauses_only_the_chat(self):
+        bot = RetryingBot(retry_chats={1})
+        engine = BroadcastEngine(bot)
+        self.assertIsNone(engine.bucket)  # Governed mailings are not limited twice
+
+        async def run() -> dict:
+            try:
+                return await engine.broadcast([(1, 'en'), (2, 'en'), (3, 'en')], lambda lang_code: 'Hello')
+            finally:
+                await bot.session.close()
+
+        start = time.monotonic()
+        result = asyncio.run(run())
+        self.assertEqual(result, {BroadcastEngine.SENT: 3})
+        sent = dict(bot.sent)
+        self.assertLess(sent[2] - start, .5)
+        self.assertLess(sent[3] - start, .5)
+        self.assertGreaterEqual(sent[1] - start, bot.retry_after - .05)
+
+
+if __name__ == '__main__':
+    unittest.main()
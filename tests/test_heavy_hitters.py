@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import os
+import random
+import unittest
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'test.db')  # Required by config when there is no .env file
+
+from heavy_hitters import SpaceSaving, WordTrends
+
+
+class FakeDbManager:
+
+    def __init__(self):
+        self.state = {}
+
+    def get_bot_state(self, key):
+        return self.state.get(key)
+
+    def get_bot_states(self, prefix):
+        return [(key, value) for key, value in self.state.items() if key.startswith(prefix)]
+
+    def set_bot_state(self, key, value):
+        self.state[key] = str(value)
+
+
+class SpaceSavingTest(unittest.TestCase):
+
+    def test_finds_heavy_hitters_in_skewed_stream(self):
+        rand = random.Random(1)
+        summary = SpaceSaving(capacity=100)
+        words = [f'word{rank}' for rank in range(1, 5001)]
+        weights = [1 / rank for rank in range(1, 5001)]  # Zipf-like distribution of words
+        for word in rand.choices(words, weights, k=50000):
+            summary.add(word)
+        self.assertEqual(len(summary.counters), 100)
+        self.assertEqual([item for item, count, error in summary.top(5)], words[:5])
+        summary.decay(.5)
+        restored = SpaceSaving.from_json(summary.to_json())
+        self.assertEqual(restored.top(3), summary.top(3))
+
+
+class WordTrendsTest(unittest.TestCase):
+
+    def test_top_merges_worker_snapshots(self):
+        db = FakeDbManager()
+        first, second = WordTrends(db, 0), WordTrends(db, 1)
+        for _ in range(3):
+            first.add('added', 'Apple', 'en', 'ru')
+        for _ in range(2):
+            second.add('added', ' apple ', 'en', 'ru')
+            second.add('added', 'pear', 'en', 'ru')
+        second.snapshot()
+        self.assertEqual(first.top('added', 2), [('apple', 'en', 'ru', 5), ('pear', 'en', 'ru', 2)])
+        self.assertEqual(WordTrends(db, 1).top('added', 1), [('apple', 'en', 'ru', 2)])  # First isn't saved yet
+
+
+if __name__ == '__main__':
+    unittest.main()
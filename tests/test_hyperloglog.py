@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import unittest
+
+# ===== Local imports =====
+
+from hyperloglog import HyperLogLog
+
+
+class HyperLogLogTest(unittest.TestCase):
+
+    def test_count_and_merge(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for user_id in range(60000):
+            first.add(user_id)
+        for user_id in range(40000, 100000):
+            second.add(user_id)
+        self.assertFalse(first.add(1))  # Repeated value doesn't change the sketch
+        self.assertAlmostEqual(first.count(), 60000, delta=60000 * .05)
+        merged = HyperLogLog.merged([first.to_bytes(), second.to_bytes()])
+        self.assertAlmostEqual(merged.count(), 100000, delta=100000 * .05)
+        self.assertEqual(first.registers, HyperLogLog.from_bytes(first.to_bytes()).registers)
+
+    def test_small_counts_are_exact_enough(self):
+        sketch = HyperLogLog()
+        self.assertEqual(sketch.count(), 0)
+        for user_id in range(100):
+            sketch.add(user_id)
+        self.assertAlmostEqual(sketch.count(), 100, delta=2)
+        self.assertLess(len(sketch.to_bytes()), 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import os
+import tempfile
+import unittest
+
+# ===== Local imports =====
+
+from lexicon import OfflineLexicon, build_lexicon, read_word_list
+
+
+class LexiconTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path_to_lexicon = os.path.join(self.tmp_dir.name, 'lexicon.bin')
+        entries = [
+            ('en', 'ru', 'cat', 'kæt', ['кот', 'кошка']),
+            ('en', 'ua', 'cat', 'kæt', ['кіт']),
+            ('en', 'ru', 'Dog', 'dɒɡ', ['собака']),
+            ('en', 'ru', 'cat', '', ['котик']),
+            ('en', 'ru', 'look  after', '', ['заботиться']),
+        ]
+        self.written = build_lexicon(entries, self.path_to_lexicon)
+        self.lexicon = OfflineLexicon(self.path_to_lexicon)
+
+    def tearDown(self):
+        self.lexicon.close()
+        self.tmp_dir.cleanup()
+
+    def test_lookup(self):
+        self.assertEqual(self.written, 4)
+        self.assertEqual(len(self.lexicon), 4)
+        self.assertEqual(self.lexicon.lookup('cat', 'en', 'ru'),
+                         {'word': 'cat', 'transcription': 'kæt', 'translations': ['кот', 'кошка', 'котик']})
+        self.assertEqual(self.lexicon.lookup('Cat', 'en', 'ua')['translations'], ['кіт'])
+        self.assertEqual(self.lexicon.lookup('dog', 'EN', 'ru')['transcription'], 'dɒɡ')
+        self.assertEqual(self.lexicon.lookup('look after', 'en', 'ru')['translations'], ['заботиться'])
+
+    def test_missing(self):
+        self.assertIsNone(self.lexicon.lookup('cow', 'en', 'ru'))
+        self.assertIsNone(self.lexicon.lookup('dog', 'en', 'ua'))
+        self.assertIsNone(self.lexicon.lookup('zzz', 'zz', 'zz'))
+
+    def test_read_word_list(self):
+        path_to_word_list = os.path.join(self.tmp_dir.name, 'words.tsv')
+        with open(path_to_word_list, 'w', encoding='utf-8') as file:
+            file.write('# comment\nen\tru\tbird\tbɜːd\tптица; птичка\nbroken line\n')
+        self.assertEqual(list(read_word_list(path_to_word_list)),
+                         [('en', 'ru', 'bird', 'bɜːd', ['птица', 'птичка'])])
+
+    def test_not_lexicon_file(self):
+        path_to_file = os.path.join(self.tmp_dir.name, 'broken.bin')
+        with open(path_to_file, 'wb') as file:
+            file.write(b'\0' * 32)
+        with self.assertRaises(ValueError):
+            OfflineLexicon(path_to_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
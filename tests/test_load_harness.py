@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import socket
+import unittest
+
+# ===== Local imports =====
+
+from load_harness import run_load
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LoadHarnessTest(unittest.TestCase):
+
+    def test_journeys_in_polling_and_webhook_modes(self):
+        for mode in ('polling', 'webhook'):
+            with self.subTest(mode=mode):
+                result = asyncio.run(run_load(mode, users=3, words=1, pages=1, quiz=False, think=0,
+                                              webhook_port=free_port()))
+                self.assertEqual(result['failed_journeys'], 0)
+                # start, dictionary, pair, page, 4 updates to add a word, 2 updates to find it
+                self.assertEqual(result['updates'], 3 * 10)
+                self.assertEqual(result['steps']['find_word_query']['updates'], 3)
+                self.assertGreater(result['api_calls_per_update'], 1)
+                self.assertGreater(result['api_calls']['sendMessage'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
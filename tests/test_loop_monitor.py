@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import time
+import unittest
+
+# ===== Local imports =====
+
+from loop_monitor import LOOP_LAG_SECONDS, LoopMonitor
+import metrics
+
+
+def blocking_call():
+    time.sleep(.4)
+
+
+class LoopMonitorTest(unittest.TestCase):
+
+    def test_blocking_handler_is_reported(self):
+        async def slow_handler():
+            blocking_call()
+
+        async def run() -> LoopMonitor:
+            monitor = LoopMonitor(interval=.05, threshold=.1)
+            monitor.start()
+            try:
+                await asyncio.sleep(.2)
+                self.assertEqual(monitor.blocks, 0)
+                await metrics.timed_handler('slow_handler', slow_handler())
+                await asyncio.sleep(.1)
+            finally:
+                monitor.stop()
+            return monitor
+
+        lag_count = sum(LOOP_LAG_SECONDS.values.get((), [0, 0])[:-1])
+        with self.assertLogs('LoopMonitor', 'WARNING') as logs:
+            monitor = asyncio.run(run())
+        self.assertEqual(monitor.blocks, 1)
+        self.assertIn('in [slow_handler] at tests/test_loop_monitor.py', logs.output[0])
+        self.assertIn('blocking_call()', logs.output[0])
+        lag_series = LOOP_LAG_SECONDS.values[()]
+        self.assertGreater(sum(lag_series[:-1]), lag_count)
+        self.assertGreaterEqual(lag_series[-1], .3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import unittest
+
+# ===== Local imports =====
+
+import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_histogram_render(self):
+        registry = metrics.MetricsRegistry()
+        histogram = registry.histogram('test_seconds', 'Test', ('handler',), buckets=(.1, 1))
+        for value in (.05, .1, .5, 3):
+            histogram.observe(value, 'start')
+        registry.counter('test_total', 'Test counter').inc(amount=2)
+        lines = registry.render().splitlines()
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{handler="start",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{handler="start",le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{handler="start",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{handler="start"} 4', lines)
+        self.assertIn('test_total 2', lines)
+
+    def test_handler_times_are_attributed(self):
+        async def handler():
+            metrics.add_time('db', .02)
+            metrics.add_time('api', .3)
+            await asyncio.sleep(0)
+
+        asyncio.run(metrics.timed_handler('test_handler', handler()))
+        metrics.add_time('db', 1)  # Out of handler, not attributed
+        db_series = metrics.HANDLER_DB_SECONDS.values[('test_handler',)]
+        self.assertEqual(sum(db_series[:-1]), 1)
+        self.assertAlmostEqual(db_series[-1], .02)
+        self.assertAlmostEqual(metrics.HANDLER_API_SECONDS.values[('test_handler',)][-1], .3)
+        self.assertEqual(sum(metrics.HANDLER_SECONDS.values[('test_handler',)][:-1]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
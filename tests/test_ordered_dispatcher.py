@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import os
+import time
+import unittest
+
+# ===== External libs imports =====
+
+from aiogram import Bot, types
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher import FSMContext
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'test.db')  # Required by config when there is no .env file
+
+from ordered_dispatcher import ChatOrderedDispatcher
+from recovery import UpdateTracker
+from tests.test_recovery import FakeDbManager
+
+
+def message_update(update_id: int, chat_id: int) -> types.Update:
+    return types.Update(**{'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': str(update_id),
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'}}})
+
+
+class ChatOrderedDispatcherTest(unittest.TestCase):
+
+    def test_order_per_chat_and_parallel_chats(self):
+        handled = {}
+
+        async def run():
+            bot = Bot(token='123456:test')
+            dp = ChatOrderedDispatcher(bot, workers=4, shards=2)
+
+            @dp.message_handler()
+            async def handler(message: types.Message):
+                # Slow chat must not delay other chats, later updates of a chat must wait for earlier ones
+                await asyncio.sleep(.05 if message.chat.id == 1 else .001 * (10 - message.message_id % 10))
+                handled.setdefault(message.chat.id, []).append(message.message_id)
+
+            start = time.monotonic()
+            updates = [message_update(update_id, update_id % 3 + 1) for update_id in range(1, 31)]
+            await dp.process_updates(updates)
+            elapsed = time.monotonic() - start
+            stats = dp.queue_stats()
+            dp.stop_workers()
+            await bot.session.close()
+            return elapsed, stats
+
+        elapsed, stats = asyncio.run(run())
+        for chat_id in range(1, 4):
+            self.assertEqual(handled[chat_id], list(range(chat_id - 1 or 3, 31, 3)))
+        self.assertLess(elapsed, .9)  # Slow chat (10 updates by 50ms) runs in parallel with others
+        self.assertEqual(sum(shard['processed'] for shard in stats), 30)
+        self.assertEqual(sum(shard['queued'] for shard in stats), 0)
+
+    def test_state_is_not_cached_between_updates(self):
+        answers = []
+
+        async def run():
+            bot = Bot(token='123456:test')
+            dp = ChatOrderedDispatcher(bot, storage=MemoryStorage(), workers=1)
+
+            @dp.message_handler(state='waiting')
+            async def waiting_handler(message: types.Message, state: FSMContext):
+                answers.append('waiting')
+                await state.finish()
+
+            @dp.message_handler()
+            async def default_handler(message: types.Message, state: FSMContext):
+                answers.append('default')
+                await state.set_state('waiting')
+
+            # One worker processes all updates, the state set by an update must be seen by the next one
+            for update_id in range(1, 5):
+                await dp.process_updates([message_update(update_id, 1)])
+            dp.stop_workers()
+            await bot.session.close()
+
+        asyncio.run(run())
+        self.assertEqual(answers, ['default', 'waiting', 'default', 'waiting'])
+
+    def test_queued_updates_hold_tracker_watermark(self):
+        watermarks = {}
+
+        async def run():
+            bot = Bot(token='123456:test')
+            dp = ChatOrderedDispatcher(bot, workers=1)
+            tracker = UpdateTracker(FakeDbManager())
+            dp.middleware.setup(tracker)
+            dp.tracker = tracker
+
+            @dp.message_handler()
+            async def handler(message: types.Message):
+                watermarks[message.message_id] = tracker.last_update_id
+
+            # Update 2 waits in chat 1 queue while update 3 of chat 2 is processed
+            await dp.process_updates([message_update(1, 1), message_update(2, 1), message_update(3, 2)])
+            dp.stop_workers()
+            await bot.session.close()
+            return tracker.last_update_id
+
+        self.assertEqual(asyncio.run(run()), 3)
+        self.assertEqual(watermarks[2], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import os
+import unittest
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'test.db')  # Required by config when there is no .env file
+
+from db_manager import DbManager
+from pagination import PAGINATORS, DictionaryPaginator, PaginatorSessionCache, RatingPaginator
+
+
+class FakeDbManager:
+
+    def __init__(self):
+        self.queries = 0
+        self.dict_versions = {}
+
+    def get_user_dict(self, user_id, from_lang, to_lang):
+        self.queries += 1
+        return [(f'word{i}', f'translation{i}') for i in range(25)]
+
+    def get_user_achievements(self, user_id):
+        self.queries += 1
+        return []
+
+    def get_user_dict_version(self, user_id):
+        return self.dict_versions.get(user_id, 0)
+
+
+class FakeLangManager:
+    PAGINATION_PAGE_SIZE = 10
+
+
+class PaginatorSessionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = FakeDbManager()
+        self.cache = PaginatorSessionCache(PAGINATORS, FakeLangManager(), self.db, None, size=2)
+
+    @staticmethod
+    def state(page: int, from_lang: str = 'en') -> dict:
+        return {'current_page': page, 'from_lang': from_lang, 'to_lang': 'ru'}
+
+    def test_registry(self):
+        self.assertIs(PAGINATORS['dictionary'], DictionaryPaginator)
+
+    def test_session_reused_and_invalidated(self):
+        paginator = self.cache.get('dictionary', 1, self.state(0))
+        paginator.next()
+        self.assertIs(self.cache.get('dictionary', 1, self.state(2)), paginator)
+        self.assertEqual(paginator.current_page, 2)  # Position always comes from user state
+        self.assertEqual(self.db.queries, 1)
+        self.db.dict_versions[1] = 1
+        self.assertIsNot(self.cache.get('dictionary', 1, self.state(0)), paginator)
+        self.assertEqual(self.db.queries, 2)
+
+    def test_lru_eviction(self):
+        self.cache.get('dictionary', 1, self.state(0))
+        self.cache.get('dictionary', 1, self.state(0, 'ua'))
+        self.cache.get('dictionary', 2, self.state(0))
+        self.assertEqual(list(self.cache.sessions), [(1, 'dictionary', ('ua', 'ru')), (2, 'dictionary', ('en', 'ru'))])
+
+    def test_other_users_data_not_cached(self):
+        paginator = self.cache.get(RatingPaginator.action, 1, 0)
+        self.assertIsNot(self.cache.get(RatingPaginator.action, 1, 0), paginator)
+        self.assertEqual(self.db.queries, 2)
+        self.assertEqual(len(self.cache.sessions), 0)
+
+    def test_dict_versions_of_idle_users_evicted(self):
+        db = DbManager('versions.db', False)
+        db.DICT_VERSIONS_SIZE = 2
+        version = db.get_user_dict_version(1)
+        db._bump_user_dict_version(1)
+        db._bump_user_dict_version(2)
+        db._bump_user_dict_version(3)
+        self.assertEqual(list(db.dict_versions), [2, 3])
+        # Evicted user gets a version newer than any of their old ones, so their sessions are rebuilt
+        self.assertNotEqual(db.get_user_dict_version(1), version)
+        self.assertGreater(db.get_user_dict_version(1), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import os
+import unittest
+
+# ===== External libs imports =====
+
+from aiogram import Bot, types
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'test.db')  # Required by config when there is no .env file
+
+from ordered_dispatcher import ChatOrderedDispatcher
+from recovery import BacklogCatchUp, TrackedPolling, UpdateTracker
+
+
+class FakeDbManager:
+
+    def __init__(self):
+        self.state = {}
+
+    def get_bot_state(self, key):
+        return self.state.get(key)
+
+    def set_bot_state(self, key, value):
+        self.state[key] = str(value)
+
+
+def message_update(update_id: int, chat_id: int) -> types.Update:
+    return types.Update(**{'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': 'text',
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'}}})
+
+
+def callback_update(update_id: int, user_id: int, message_id: int, data: str) -> types.Update:
+    return types.Update(**{'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'}, 'data': data,
+        'chat_instance': '1', 'message': {'message_id': message_id, 'date': 0,
+                                          'chat': {'id': user_id, 'type': 'private'}}}})
+
+
+class UpdateTrackerTest(unittest.TestCase):
+
+    def test_watermark_waits_for_earlier_updates(self):
+        db = FakeDbManager()
+        tracker = UpdateTracker(db)
+        tracker.track([10, 11, 12])
+        tracker.done(12)
+        tracker.done(11)
+        self.assertEqual(tracker.last_update_id, 9)
+        tracker.done(10)
+        self.assertEqual(tracker.last_update_id, 12)
+        tracker.save()
+        self.assertEqual(UpdateTracker(db).last_update_id, 12)
+
+    def test_watermark_follows_restarted_update_ids(self):
+        db = FakeDbManager()
+        db.set_bot_state(UpdateTracker.STATE_KEY, 900000)
+        tracker = UpdateTracker(db)
+        tracker.track([5000])
+        tracker.done(5000)
+        tracker.save()
+        self.assertEqual(UpdateTracker(db).last_update_id, 5000)
+
+
+class PollingBot(Bot):
+    """Bot getting updates from a list the way Telegram does: updates before offset are confirmed and forgotten"""
+
+    def __init__(self, updates: list):
+        super().__init__('123456:test')
+        self.updates = updates
+        self.offsets = []
+
+    async def get_updates(self, offset=None, limit=None, timeout=None, *args, **kwargs):
+        self.offsets.append(offset)
+        if offset is not None:
+            self.updates = [update for update in self.updates if update.update_id >= offset]
+        await asyncio.sleep(.01)
+        return self.updates[:limit]
+
+
+class TrackedPollingTest(unittest.TestCase):
+
+    def test_only_processed_updates_are_confirmed(self):
+        handled = []
+
+        async def run(tracker: UpdateTracker) -> PollingBot:
+            bot = PollingBot([message_update(update_id, update_id) for update_id in range(11, 16)])
+            dp = ChatOrderedDispatcher(bot, workers=4)
+            dp.middleware.setup(tracker)
+            dp.tracker = tracker
+            polling = TrackedPolling(dp, tracker)
+
+            @dp.message_handler()
+            async def handler(message: types.Message):
+                await asyncio.sleep(.2 if message.message_id == 12 else 0)
+                # Telegram must not forget the update before it is processed
+                if message.message_id in [update.update_id for update in bot.updates]:
+                    handled.append(message.message_id)
+
+            polling_task = asyncio.ensure_future(polling.run())
+            while not bot.offsets or bot.offsets[-1] != 16:
+                await asyncio.sleep(.01)
+            polling.stop()
+            await polling_task
+            dp.stop_workers()
+            await bot.session.close()
+            return bot
+
+        db = FakeDbManager()
+        db.set_bot_state(UpdateTracker.STATE_KEY, 10)
+        bot = asyncio.run(run(UpdateTracker(db)))
+        self.assertEqual(sorted(handled), [11, 12, 13, 14, 15])  # Updates polled again while in flight are dropped
+        # Offset doesn't pass the slow update 12 while it is processed
+        self.assertEqual(bot.offsets, [11] * (len(bot.offsets) - 1) + [16])
+        self.assertGreater(len(bot.offsets), 2)
+        self.assertEqual(db.state[UpdateTracker.STATE_KEY], '15')
+
+
+class BacklogCatchUpTest(unittest.TestCase):
+
+    def test_group_by_chat_skips_repeated_presses(self):
+        catch_up = BacklogCatchUp(None, UpdateTracker(FakeDbManager()))
+        updates = [message_update(1, 100), callback_update(2, 200, 5, 'next_dictionary'), message_update(3, 200),
+                   callback_update(4, 200, 5, 'next_dictionary'), callback_update(5, 200, 5, 'prev_dictionary'),
+                   message_update(6, 100)]
+        groups = catch_up.group_by_chat(updates)
+        self.assertEqual([[update.update_id for update in group] for group in groups], [[1, 6], [3, 4, 5]])
+        self.assertEqual(catch_up.stats['skipped'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
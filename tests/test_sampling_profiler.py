@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import sys
+import time
+import unittest
+
+# ===== Local imports =====
+
+import metrics
+from sampling_profiler import IDLE, TRUNCATED, ProfilerBusyError, SamplingProfiler
+
+
+def busy_loop(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+class SamplingProfilerTest(unittest.TestCase):
+
+    def test_stacks_are_grouped_by_handler(self):
+        async def busy_handler():
+            busy_loop(.15)
+
+        async def run(profiler: SamplingProfiler) -> dict:
+            session = asyncio.ensure_future(profiler.profile(.4))
+            await asyncio.sleep(.05)
+            with self.assertRaises(ProfilerBusyError):
+                await profiler.profile(1)
+            await metrics.timed_handler('busy_handler', busy_handler())
+            return await session
+
+        profiler = SamplingProfiler(interval=.005)
+        stacks = asyncio.run(run(profiler))
+        self.assertFalse(profiler.running)
+        handlers = dict(SamplingProfiler.handlers_summary(stacks))
+        self.assertGreater(handlers['busy_handler'], 5)
+        self.assertGreater(handlers[IDLE], 5)
+        busy_stack = max((stack for stack in stacks if stack.startswith('busy_handler;')), key=stacks.get)
+        self.assertTrue(busy_stack.endswith('tests/test_sampling_profiler.py:busy_handler;'
+                                            'tests/test_sampling_profiler.py:busy_loop'))
+        self.assertIn(f'{busy_stack} {stacks[busy_stack]}\n', SamplingProfiler.render(stacks))
+
+    def test_memory_is_bounded(self):
+        async def run(profiler: SamplingProfiler) -> dict:
+            session = asyncio.ensure_future(profiler.profile(.6))
+            for depth in range(20):
+                await asyncio.sleep(.001)
+                await metrics.timed_handler('deep_handler', recurse(depth))
+            return await session
+
+        async def recurse(depth: int):
+            if depth:
+                return await recurse(depth - 1)
+            busy_loop(.02)
+
+        stacks = asyncio.run(run(SamplingProfiler(interval=.001, max_stacks=3)))
+        self.assertLessEqual(len(stacks), 3 + 2)  # Truncated stacks of the handler and idle
+        self.assertTrue(any(stack.endswith(TRUNCATED) for stack in stacks))
+        stack = SamplingProfiler(max_depth=2).collapse(sys._getframe())
+        self.assertEqual(len(stack.split(';')), 1 + 2)
+        self.assertTrue(stack.endswith(';tests/test_sampling_profiler.py:test_memory_is_bounded'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+from datetime import datetime
+import time
+import unittest
+
+# ===== Local imports =====
+
+from scheduler import CronExpression, Scheduler
+
+
+class CronExpressionTest(unittest.TestCase):
+
+    def test_next_after(self):
+        cron = CronExpression('30 4 * * *')
+        self.assertEqual(cron.next_after(datetime(2021, 3, 1, 3, 0)), datetime(2021, 3, 1, 4, 30))
+        self.assertEqual(cron.next_after(datetime(2021, 3, 1, 4, 30)), datetime(2021, 3, 2, 4, 30))
+        self.assertEqual(cron.next_after(datetime(2021, 12, 31, 23, 59)), datetime(2022, 1, 1, 4, 30))
+
+    def test_steps_lists_and_ranges(self):
+        cron = CronExpression('*/15 9-10 * * *')
+        self.assertEqual(cron.next_after(datetime(2021, 3, 1, 9, 50)), datetime(2021, 3, 1, 10, 0))
+        self.assertEqual(cron.next_after(datetime(2021, 3, 1, 10, 45)), datetime(2021, 3, 2, 9, 0))
+        self.assertEqual(CronExpression('0 0 1,15 * *').next_after(datetime(2021, 2, 2)), datetime(2021, 2, 15))
+
+    def test_weekdays(self):
+        # 2021-03-01 is Monday, Sunday is 0 or 7
+        self.assertEqual(CronExpression('0 12 * * 0').next_after(datetime(2021, 3, 1)), datetime(2021, 3, 7, 12))
+        self.assertEqual(CronExpression('0 12 * * 7').next_after(datetime(2021, 3, 1)), datetime(2021, 3, 7, 12))
+        # Restricted day and weekday are combined with OR
+        self.assertEqual(CronExpression('0 0 13 * 5').next_after(datetime(2021, 3, 1)), datetime(2021, 3, 5))
+
+    def test_invalid(self):
+        for expression in ('* * * *', '60 * * * *', '* 5-2 * * *', '*/0 * * * *'):
+            with self.assertRaises(ValueError):
+                CronExpression(expression)
+        with self.assertRaises(ValueError):
+            CronExpression('0 0 31 2 *').next_after(datetime(2021, 1, 1))
+
+
+class SchedulerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_interval_job_overlap_and_timeout(self):
+        scheduler = Scheduler()
+        calls = {'fast': 0, 'slow': 0}
+
+        async def fast_job():
+            calls['fast'] += 1
+
+        async def slow_job():
+            calls['slow'] += 1
+            await asyncio.sleep(10)
+
+        scheduler.add_interval_job('fast', fast_job, .05, run_on_start=True)
+        scheduler.add_interval_job('slow', slow_job, .01, timeout=.1, run_on_start=True)
+        runner = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(.35)
+        scheduler.stop()
+        await runner
+
+        self.assertGreaterEqual(calls['fast'], 4)
+        slow = scheduler.jobs['slow']
+        self.assertEqual(slow.last_status, 'timeout')
+        self.assertGreaterEqual(slow.failures, 2)
+        self.assertLessEqual(calls['slow'], 4)  # Never more than one run at a time, each run lasts 0.1s
+        self.assertEqual(scheduler.jobs['fast'].last_status, 'ok')
+
+    async def test_failed_job_keeps_schedule(self):
+        scheduler = Scheduler()
+
+        async def failing_job():
+            raise RuntimeError('failed')
+
+        job = scheduler.add_interval_job('failing', failing_job, 60, run_on_start=True)
+        runner = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(.05)
+        scheduler.stop()
+        await runner
+        self.assertEqual(job.last_status, 'error')
+        self.assertEqual(job.runs, 1)
+        self.assertGreater(job.next_run, time.time() + 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import threading
+import time
+import unittest
+
+# ===== Local imports =====
+
+from single_flight import SingleFlight
+import translation
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_concurrent_calls_coalesced(self):
+        flight = SingleFlight()
+        calls = []
+
+        def lookup(word):
+            calls.append(word)
+            time.sleep(.05)
+            return word.upper()
+
+        results = await asyncio.gather(*[flight.do(('google', 'cat'), lookup, 'cat') for _ in range(20)])
+        self.assertEqual(results, ['CAT'] * 20)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.in_flight(), 0)
+
+    async def test_error_shared_between_waiters(self):
+        flight = SingleFlight()
+        counter = {'calls': 0}
+        lock = threading.Lock()
+
+        def failing():
+            with lock:
+                counter['calls'] += 1
+            time.sleep(.05)
+            raise ValueError('upstream is down')
+
+        results = await asyncio.gather(*[flight.do('key', failing) for _ in range(5)], return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        self.assertEqual(counter['calls'], 1)
+
+    async def test_new_call_after_completion(self):
+        flight = SingleFlight()
+
+        async def lookup(word):
+            return word
+
+        self.assertEqual(await flight.do('a', lookup, 'first'), 'first')
+        self.assertEqual(await flight.do('a', lookup, 'second'), 'second')
+
+    async def test_cancelled_waiter_does_not_cancel_others(self):
+        flight = SingleFlight()
+
+        async def slow():
+            await asyncio.sleep(.05)
+            return 42
+
+        first = asyncio.ensure_future(flight.do('slow', slow))
+        second = asyncio.ensure_future(flight.do('slow', slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual(await second, 42)
+
+    async def test_provider_gets_original_text(self):
+        calls = []
+
+        def provider(text, from_lang, to_lang):
+            calls.append(text)
+            time.sleep(.05)
+            return text
+
+        results = await asyncio.gather(*[translation._coalesced('test', provider, text, 'en', 'RU', 'en', 'ru')
+                                          for text in ('New  York', 'new york')])
+        self.assertEqual(calls, ['New  York'])  # Coalesced by normalized text, sent as the user typed it
+        self.assertEqual(results, ['New  York', 'New  York'])
+
+
+if __name__ == '__main__':
+    unittest.main()
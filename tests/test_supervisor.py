@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import multiprocessing
+import os
+import unittest
+
+# ===== Local imports =====
+
+os.environ.setdefault('DB_NAME', 'test.db')  # Required by config when there is no .env file
+
+from recovery import UpdateTracker
+from supervisor import Supervisor
+from tests.test_recovery import FakeDbManager
+
+
+class DeadProcess:
+    exitcode = 1
+
+    @staticmethod
+    def is_alive() -> bool:
+        return False
+
+
+class SupervisorTest(unittest.TestCase):
+
+    def test_dead_worker_updates_are_sent_again(self):
+        supervisor = Supervisor.__new__(Supervisor)  # Without database and worker processes
+        supervisor.workers = 2
+        supervisor.context = multiprocessing.get_context('spawn')
+        supervisor.inboxes = [supervisor.context.Queue() for _ in range(2)]
+        supervisor.tracker = UpdateTracker(FakeDbManager())
+        started = []
+        supervisor.start_worker = lambda worker_id: started.append(worker_id)
+        supervisor.processes = [None, DeadProcess()]
+        supervisor.pending = [{}, {12: {'update_id': 12}, 11: {'update_id': 11}}]
+        supervisor.tracker.track([11, 12])
+        old_inbox = supervisor.inboxes[1]
+        old_inbox.put([{'update_id': 11}])  # Not taken by the worker before it died
+
+        supervisor.check_workers()
+        self.assertEqual(started, [1])
+        self.assertIsNot(supervisor.inboxes[1], old_inbox)
+        self.assertEqual(supervisor.inboxes[1].get(timeout=1), [{'update_id': 11}, {'update_id': 12}])
+        self.assertIsNone(supervisor.tracker.last_update_id)  # Not processed, must not be confirmed
+        self.assertEqual(len(supervisor.pending[1]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+# ===== Local imports =====
+
+from benchmark import build_synthetic_db
+from load_harness import FakeUser, LoadHarness, user_journey
+from replay import replay
+from traffic_capture import Anonymizer, CaptureWriter, UpdateCapture, keyboard_texts, read_capture
+
+
+class AnonymizerTest(unittest.TestCase):
+
+    def test_stable_hashing_keeps_structure(self):
+        anonymizer = Anonymizer('secret', {'📃 Dictionary'})
+        self.assertEqual(anonymizer.user_id(42), Anonymizer('secret').user_id(42))
+        self.assertNotEqual(anonymizer.user_id(42), Anonymizer('other').user_id(42))
+        self.assertLess(anonymizer.user_id(-42), 0)
+        self.assertEqual(anonymizer.message_text('📃 Dictionary'), '📃 Dictionary')
+        self.assertEqual(anonymizer.message_text('/word_12'), '/word_12')
+        self.assertEqual(anonymizer.message_text('/start referral_42'), f'/start referral_{anonymizer.user_id(42)}')
+        text = anonymizer.message_text('Apple pie, 2021')
+        self.assertRegex(text, r'^[a-z]{5} [a-z]{3}, [0-9]{4}$')
+        self.assertNotIn('pie', text)
+        self.assertEqual(text.split(' ')[0], anonymizer.text('apple'))
+
+
+class CaptureReplayTest(unittest.TestCase):
+
+    def test_captured_journeys_are_replayed(self):
+        async def capture(path_to_db: str, directory: str) -> int:
+            harness = LoadHarness(path_to_db, os.path.join(directory, 'fsm.db'))
+            await harness.start()
+            anonymizer = Anonymizer('secret', keyboard_texts(harness.vocabulary_bot.lang.localizations))
+            capture_middleware = UpdateCapture(CaptureWriter(os.path.join(directory, 'capture'), max_bytes=4096),
+                                               anonymizer)
+            harness.dp.middleware.setup(capture_middleware)
+            try:
+                await asyncio.gather(*[user_journey(FakeUser(harness, user_id), 1, 1, False, 0)
+                                       for user_id in (1, 2)])
+            finally:
+                await harness.stop()
+                capture_middleware.close()
+            return harness.report(1)['updates']
+
+        with tempfile.TemporaryDirectory() as directory:
+            path_to_db = os.path.join(directory, 'bot.db')
+            build_synthetic_db(path_to_db, 2, 30, [('en', 'ru')], events=0)
+            path_to_backup = os.path.join(directory, 'backup.db')
+            shutil.copyfile(path_to_db, path_to_backup)  # Database state at the capture start
+            captured_updates = asyncio.run(capture(path_to_db, directory))
+            self.assertGreater(len(os.listdir(os.path.join(directory, 'capture'))), 1)  # Files were rotated
+            records = read_capture(os.path.join(directory, 'capture'))
+            self.assertEqual(len(records), captured_updates)
+            self.assertNotIn({'id': 1, 'type': 'private'}, [record['update'].get('message', {}).get('chat')
+                                                             for record in records])
+            result = asyncio.run(replay(records, path_to_backup, speed=0, salt='secret'))
+        self.assertEqual(result['failed_updates'], 0)
+        self.assertEqual(result['updates'], captured_updates)
+        # Anonymized users exist in the anonymized database copy: the searched words are found
+        self.assertGreater(result['api_calls']['sendMessage'], captured_updates)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import asyncio
+import time
+import unittest
+
+# ===== External libs imports =====
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import ClientSession
+
+# ===== Local imports =====
+
+from ordered_dispatcher import ChatOrderedDispatcher
+from webhook import UpdateWindow, WebhookServer
+
+
+def message_update(update_id: int, chat_id: int) -> dict:
+    return {'update_id': update_id, 'message': {'message_id': update_id, 'date': 0, 'text': 'text',
+                                                'chat': {'id': chat_id, 'type': 'private'},
+                                                'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'}}}
+
+
+class UpdateWindowTest(unittest.TestCase):
+
+    def test_duplicates_in_window(self):
+        window = UpdateWindow(size=8)
+        self.assertFalse(window.seen(100))
+        self.assertFalse(window.seen(103))
+        self.assertFalse(window.seen(101))  # Late, but not received yet
+        self.assertTrue(window.seen(100))
+        self.assertTrue(window.seen(103))
+        self.assertFalse(window.seen(102))
+        self.assertFalse(window.seen(120))
+        with self.assertLogs('UpdateWindow', 'WARNING'):
+            self.assertFalse(window.seen(103))  # Far below the window: Telegram started IDs again
+        self.assertTrue(window.seen(103))
+        self.assertFalse(window.seen(104))
+
+
+class WebhookServerTest(unittest.TestCase):
+
+    def test_update_confirmed_after_processing(self):
+        events = []
+
+        async def run():
+            bot = Bot(token='123456:test')
+            dp = Dispatcher(bot)
+
+            @dp.message_handler()
+            async def slow_handler(message: types.Message):
+                await asyncio.sleep(.1)
+                events.append('processed')
+
+            server = WebhookServer(dp)
+            serving = asyncio.ensure_future(server.run('127.0.0.1', 8093))
+            await asyncio.sleep(.1)
+            async with ClientSession() as session:
+                async with session.post('http://127.0.0.1:8093' + server.path, json=message_update(1, 1)) as response:
+                    events.append(response.status)
+            server.stop()
+            await serving
+            await bot.session.close()
+
+        asyncio.run(run())
+        # Telegram delivers again updates which were not confirmed, e.g. when the bot crashed while processing
+        self.assertEqual(events, ['processed', 200])
+
+    def test_flooding_chat_does_not_block_others(self):
+        latencies = {}
+
+        async def run():
+            bot = Bot(token='123456:test')
+            dp = ChatOrderedDispatcher(bot)
+
+            @dp.message_handler()
+            async def handler(message: types.Message):
+                await asyncio.sleep(.2 if message.chat.id == 1 else 0)
+
+            server = WebhookServer(dp, max_in_flight=2, max_per_chat=1)
+            serving = asyncio.ensure_future(server.run('127.0.0.1', 8093))
+            await asyncio.sleep(.1)
+
+            async def post(session: ClientSession, update_id: int, chat_id: int):
+                start = time.monotonic()
+                async with session.post('http://127.0.0.1:8093' + server.path,
+                                        json=message_update(update_id, chat_id)) as response:
+                    self.assertEqual(response.status, 200)
+                latencies[update_id] = time.monotonic() - start
+
+            async with ClientSession() as session:
+                flood = [asyncio.ensure_future(post(session, update_id, 1)) for update_id in range(1, 4)]
+                await asyncio.sleep(.05)
+                await post(session, 4, 2)
+                await asyncio.gather(*flood)
+            server.stop()
+            await serving
+            dp.stop_workers()
+            await bot.session.close()
+
+        asyncio.run(run())
+        self.assertLess(latencies[4], .15)
+        self.assertGreaterEqual(latencies[3], .55)  # Updates of the flooding chat still go one by one
+
+
+if __name__ == '__main__':
+    unittest.main()
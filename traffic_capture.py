@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import glob
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import string
+import time
+
+# ===== External libs imports =====
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+ID_SPACE = 2 ** 31 - 1
+REFERRAL_ARGS_REGEX = re.compile(r'^referral_([0-9]+)$')
+TOKEN_REGEX = re.compile(r'[^\W\d_]+|\d+')
+USER_ID_COLUMNS = ('user_id', 'referrer')
+
+
+def keyboard_texts(localizations: dict) -> set:
+    """Texts of all buttons in localizations (values under *BUTTON* keys). Users send them as they are,
+    so they are kept in captures for handlers to match"""
+    texts = set()
+
+    def walk(value, is_button: bool):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(item, is_button or 'BUTTON' in key)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item, is_button)
+        elif is_button and isinstance(value, str):
+            texts.add(value)
+
+    walk(localizations, False)
+    return texts
+
+
+class Anonymizer:
+    """Keyed hashing of user data: IDs are mapped to other IDs, every word and number of a text is replaced by
+    a pseudo word (number) of the same length. The mapping is stable for the same key, so sessions, added and
+    then searched words still match, and a database copy anonymized with the same key fits the capture"""
+
+    def __init__(self, key: str = None, preserved_texts: set = frozenset()):
+        # Without a key IDs are stable only while the process runs
+        self.key = key.encode() if key else secrets.token_bytes(32)
+        self.preserved_texts = preserved_texts
+
+    def _digest(self, value: str) -> bytes:
+        return hmac.new(self.key, value.encode('utf-8'), hashlib.sha512).digest()
+
+    def user_id(self, user_id: int) -> int:
+        """Positive IDs (users) stay positive, negative ones (groups) stay negative"""
+        anonymized = int.from_bytes(self._digest(str(abs(user_id)))[:8], 'big') % ID_SPACE + 1
+        return anonymized if user_id >= 0 else -anonymized
+
+    def _token(self, match) -> str:
+        token = match.group()
+        digest = self._digest(token.lower())
+        alphabet = string.digits if token.isdigit() else string.ascii_lowercase
+        return ''.join(alphabet[digest[index % len(digest)] % len(alphabet)] for index in range(len(token)))
+
+    def text(self, text: str) -> str:
+        if text is None or text in self.preserved_texts:
+            return text
+        return TOKEN_REGEX.sub(self._token, text)
+
+    def message_text(self, text: str) -> str:
+        """Commands are kept, their arguments are anonymized (referral links keep pointing to the same user)"""
+        if text is None or not text.startswith('/'):
+            return self.text(text)
+        command, _, args = text.partition(' ')
+        referral = REFERRAL_ARGS_REGEX.match(args)
+        if referral is not None:
+            return f'{command} referral_{self.user_id(int(referral.group(1)))}'
+        return command + (' ' + self.text(args) if args else '')
+
+    def _user(self, user: dict) -> dict:
+        user_id = self.user_id(user['id'])
+        return {'id': user_id, 'is_bot': user.get('is_bot', False), 'first_name': f'User{user_id}',
+                'username': f'user{user_id}', 'language_code': user.get('language_code')}
+
+    def _chat(self, chat: dict) -> dict:
+        return {'id': self.user_id(chat['id']), 'type': chat.get('type', 'private')}
+
+    def _message(self, message: dict) -> dict:
+        """Only fields used by handlers: texts, poll options and names are anonymized, everything else is dropped"""
+        anonymized = {'message_id': message['message_id'], 'date': message['date'],
+                      'chat': self._chat(message['chat'])}
+        if 'from' in message:
+            anonymized['from'] = self._user(message['from'])
+        if 'text' in message:
+            anonymized['text'] = self.message_text(message['text'])
+        if 'poll' in message:
+            poll = message['poll']
+            anonymized['poll'] = dict(poll, question=self.text(poll['question']), options=[
+                dict(option, text=self.text(option['text'])) for option in poll['options']])
+        return anonymized
+
+    def update(self, update: dict):
+        """Anonymized update or None for updates of other types than messages and callback queries"""
+        for kind in ('message', 'edited_message'):
+            if kind in update:
+                return {'update_id': update['update_id'], kind: self._message(update[kind])}
+        if 'callback_query' in update:
+            query = update['callback_query']
+            anonymized = {'id': query['id'], 'from': self._user(query['from']),
+                          'chat_instance': query.get('chat_instance', ''), 'data': query.get('data')}
+            if 'message' in query:
+                anonymized['message'] = self._message(query['message'])
+            return {'update_id': update['update_id'], 'callback_query': anonymized}
+        return None
+
+    def anonymize_database(self, path_to_db: str) -> None:
+        """Anonymize a copy of the bot database the same way: user IDs in every table, users names and
+        dictionary words"""
+        conn = sqlite3.connect(path_to_db)
+        conn.create_function('anonymize_id', 1, lambda value: self.user_id(value) if value is not None else None)
+        conn.create_function('anonymize_text', 1, self.text)
+        with conn:
+            tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+            for table in tables:
+                columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+                for column in USER_ID_COLUMNS:
+                    if column in columns:
+                        conn.execute(f'UPDATE "{table}" SET "{column}"=anonymize_id("{column}")')
+            if 'users' in tables:
+                conn.execute("UPDATE users SET user_nickname='user' || user_id, user_firstname='User' || user_id, "
+                             "user_lastname=NULL")
+            if 'words' in tables:
+                conn.execute('UPDATE words SET word_string=anonymize_text(word_string), '
+                             'word_translation=anonymize_text(word_translation)')
+        conn.close()
+
+
+class CaptureWriter:
+    """Appends JSON lines to capture files in a directory. A new file is started when the current one exceeds
+    max_bytes, the oldest files are deleted to keep at most max_files. File names have start time and process
+    ID, so workers of a multi-process bot write their own files"""
+
+    MAX_BYTES = 64 * 1024 * 1024
+    MAX_FILES = 10
+    PREFIX = 'capture-'
+
+    def __init__(self, directory: str, max_bytes: int = MAX_BYTES, max_files: int = MAX_FILES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.file = None
+        self.size = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, record: dict) -> None:
+        if self.file is None or self.size >= self.max_bytes:
+            self._rotate()
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        self.file.write(line)
+        self.size += len(line.encode('utf-8'))
+
+    def _rotate(self) -> None:
+        self.close()
+        path = os.path.join(self.directory, f'{self.PREFIX}{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.jsonl')
+        self.file = open(path, 'a', encoding='utf-8')
+        self.size = self.file.tell()
+        files = sorted(glob.glob(os.path.join(self.directory, self.PREFIX + '*.jsonl')), key=os.path.getmtime)
+        for old_path in files[:max(0, len(files) - self.max_files)]:
+            if old_path != path:
+                os.remove(old_path)
+        logging.getLogger(type(self).__name__).info(f'Capturing updates to {path}')
+
+    def flush(self) -> None:
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class UpdateCapture(BaseMiddleware):
+    """Records incoming updates (anonymized) with their arrival time for replay: {"t": unix time, "update": {}}"""
+
+    def __init__(self, writer: CaptureWriter, anonymizer: Anonymizer):
+        self.writer = writer
+        self.anonymizer = anonymizer
+        super(UpdateCapture, self).__init__()
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        try:
+            anonymized = self.anonymizer.update(update.to_python())
+            if anonymized is not None:
+                self.writer.write({'t': round(time.time(), 3), 'update': anonymized})
+        except (OSError, KeyError, TypeError) as error:
+            logging.getLogger(type(self).__name__).error(f'Update [{update.update_id}] capture error ({error})')
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def read_capture(path: str) -> list:
+    """Records of a capture file or of all capture files in a directory, ordered by arrival time"""
+    paths = sorted(glob.glob(os.path.join(path, CaptureWriter.PREFIX + '*.jsonl'))) if os.path.isdir(path) \
+        else [path]
+    records = []
+    for capture_path in paths:
+        with open(capture_path, 'r', encoding='utf-8') as file:
+            records.extend(json.loads(line) for line in file if line.strip())
+    return sorted(records, key=lambda record: record['t'])
@@ -2,12 +2,21 @@
 
 # ===== Default imports =====
 
+import logging
+import os
+import time
 from urllib.parse import quote
 
 # ===== External libs imports =====
 
 import requests
 
+# ===== Local imports =====
+
+from lexicon import OfflineLexicon
+import metrics
+from single_flight import SingleFlight
+
 DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) ' \
                      'Chrome/89.0.4389.82 Safari/537.36 Edg/89.0.774.50'
 
@@ -16,18 +25,23 @@ headers = {
     'From': 'https://google.com/'
 }
 
+REQUEST_TIMEOUT = 10  # Seconds, a hung provider must not hold an executor thread
+
 LEO_CONFIG = {
     'api': 'https://api.lingualeo.com',
     'get_translations': '/gettranslates',
     'translate': '/translate.php'
 }
 
+_single_flight = SingleFlight()
+_lexicon = None
+
 
 def google_translate(source_text: str, from_lang: str, to_lang: str) -> str:
     """Translate word or short phrase from one lang to another via Google Translate API"""
     url = "https://translate.googleapis.com/translate_a/single?client=gtx&sl=" \
           f"{from_lang}&tl={to_lang}&dt=t&q={quote(source_text)}"
-    response = requests.get(url, headers=headers)
+    response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
     if response.status_code == 200:
         data = response.json()
         result = ''
@@ -47,7 +61,7 @@ def google_translate_extended(query: str, from_lang: str, to_lang: str) -> dict:
         'dj': '1',
         'q': query
     }
-    response = requests.get(request_url, headers=headers, params=params)
+    response = requests.get(request_url, headers=headers, params=params, timeout=REQUEST_TIMEOUT)
     if response.status_code == 200:
         result = response.json()
     else:
@@ -58,7 +72,7 @@ def google_translate_extended(query: str, from_lang: str, to_lang: str) -> dict:
 def leo_translate(source_text: str):
     """Get a few word translations in English"""
     url = LEO_CONFIG['api'] + LEO_CONFIG['get_translations'] + f'?word={quote(source_text)}'
-    response = requests.get(url, headers=headers)
+    response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
     if response.status_code == 200:
         data = response.json()
         result = {
@@ -70,6 +84,66 @@ def leo_translate(source_text: str):
     return None
 
 
+def load_lexicon(path_to_lexicon: str) -> None:
+    """Enable offline lexicon provider if lexicon file exists"""
+    global _lexicon
+    if not os.path.isfile(path_to_lexicon):
+        logging.getLogger('OfflineLexicon').info('Lexicon file not found, offline lookups disabled')
+        return
+    try:
+        _lexicon = OfflineLexicon(path_to_lexicon)
+        logging.getLogger('OfflineLexicon').info(f'Lexicon successfully loaded [entries: {len(_lexicon)}]')
+    except (OSError, ValueError) as error:
+        logging.getLogger('OfflineLexicon').error(f'Lexicon loading error ({error})')
+
+
+def lexicon_translate(source_text: str, from_lang: str, to_lang: str):
+    """Get word translations and transcription from offline lexicon (same format as leo_translate)"""
+    return _lexicon.lookup(source_text, from_lang, to_lang) if _lexicon is not None else None
+
+
 def linguee_translate(text: str):
     from deep_translator import LingueeTranslator
     return LingueeTranslator(source='english', target='russian').translate(text)
+
+
+def _normalize_text(source_text: str) -> str:
+    return ' '.join(source_text.split()).lower()
+
+
+async def _coalesced(provider: str, func, source_text: str, from_lang: str, to_lang: str, *args):
+    """Run blocking translation provider off the event loop, sharing one upstream request between all concurrent
+    callers asking for the same normalized (text, from_lang, to_lang). Providers get the text as the user sent it"""
+    key = (provider, _normalize_text(source_text), from_lang.lower(), to_lang.lower())
+    start = time.perf_counter()
+    try:
+        return await _single_flight.do(key, func, source_text, *args)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.HTTP_SECONDS.observe(elapsed, provider)
+        metrics.add_time('http', elapsed)
+
+
+async def google_translate_async(source_text: str, from_lang: str, to_lang: str) -> str:
+    return await _coalesced('google', google_translate, source_text, from_lang, to_lang, from_lang, to_lang)
+
+
+async def google_translate_extended_async(query: str, from_lang: str, to_lang: str) -> dict:
+    return await _coalesced('google_extended', google_translate_extended, query, from_lang, to_lang,
+                            from_lang, to_lang)
+
+
+async def leo_translate_async(source_text: str):
+    return await _coalesced('leo', leo_translate, source_text, 'en', 'ru')
+
+
+async def linguee_translate_async(text: str):
+    return await _coalesced('linguee', linguee_translate, text, 'en', 'ru')
+
+
+async def translate_word(source_text: str, from_lang: str, to_lang: str) -> str:
+    """Translation providers chain: offline lexicon first, remote API only on lexicon miss"""
+    entry = lexicon_translate(source_text, from_lang, to_lang)
+    if entry is not None and len(entry['translations']) > 0:
+        return ', '.join(entry['translations'])
+    return await linguee_translate_async(source_text)
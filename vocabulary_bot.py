@@ -4,7 +4,9 @@
 
 import asyncio
 import logging
+import os
 import re
+import time
 
 # ===== External libs imports =====
 
@@ -21,9 +23,16 @@ import config
 from admin_manager import AdminManager
 from analytics import BotAnalytics
 from db_manager import DbManager
+from db_profiler import QueryProfiler
+from fsm_storage import SQLiteStorage
 from callback_handlers import VocabularyBotCallbackHandler
 from lang_manager import LangManager
 from markups_manager import MarkupManager
+from ordered_dispatcher import ChatOrderedDispatcher
+from quotes import QuoteOfTheDay
+from recovery import UpdateTracker
+from scheduler import Scheduler
+from traffic_capture import Anonymizer, CaptureWriter, UpdateCapture, keyboard_texts
 from antiflood import VocabularyBotAntifloodMiddleware
 from states.Dictionary import DictionaryState, DictionaryAddNewWordState, DictionaryDeleteWordState, \
     DictionarySearchWordState, DictionaryEditWordState
@@ -37,6 +46,7 @@ class VocabularyBot:
     REFERRAL_REGEX = "^referral_[0-9]*$"
     EN_PHRASE_REGEX = "^([A-Z]?[a-z]*'?[a-z]*)(,?( |-)?,?([A-z]|[a-z]?([a-z]*)'?[a-z]*))*$"
     USERS_FOR_RATING_LIMIT = 10
+    SKETCHES_RETENTION = 62 * 24 * 60 * 60  # Unique users sketches are kept for two months (enough for MAU)
     commands = [
         BotCommand(command='/start', description='Start the bot'),
         BotCommand(command='/help', description='How to user'),
@@ -45,24 +55,47 @@ class VocabularyBot:
         BotCommand(command='/quote', description='Quote of the day')
     ]
 
-    def __init__(self, bot: Bot, dispatcher: Dispatcher, dev_mode: bool):
+    def __init__(self, bot: Bot, dispatcher: Dispatcher, dev_mode: bool, worker_id: int = None):
         self.bot = bot
         self.dp = dispatcher
         self.dev_mode = dev_mode
+        self.worker_id = worker_id  # Worker process number in multi-process mode (see supervisor.py)
 
-        self.db = DbManager(config.PATH_TO_DB, self.dev_mode)
+        self.db = DbManager(config.PATH_TO_DB, self.dev_mode, copy_dev_db=self.worker_id is None,
+                           shards=config.DB_SHARDS)
         self.db.create_connection()
+        if config.DB_PROFILE:
+            self.db.profiler = QueryProfiler(config.DB_SLOW_QUERY_MS / 1000, config.DB_QUERY_BUDGET)
+            self.dp.middleware.setup(self.db.profiler)
         self.lang = LangManager(config.PATH_TO_TRANSLATIONS, self.db)
         self.markup = MarkupManager(self.lang)
-        self.analytics = BotAnalytics(self.db)
-        self.admin = AdminManager(self.bot, self.db, self.lang, self.markup, self.dp, self.analytics)
-
+        self.quote = QuoteOfTheDay(config.QUOTE_API_ENDPOINT, list(self.lang.localizations.keys()))
+        self.analytics = BotAnalytics(self.db, self.worker_id)
+        translation.load_lexicon(config.PATH_TO_LEXICON)
+        self.scheduler = Scheduler(self.db)
+        self.admin = AdminManager(self.bot, self.db, self.lang, self.markup, self.dp, self.analytics, self.scheduler)
+
+        self.capture = None
+        if config.TRAFFIC_CAPTURE_DIR:
+            self.capture = UpdateCapture(
+                CaptureWriter(os.path.join(config.ROOT_DIR, config.TRAFFIC_CAPTURE_DIR),
+                              config.TRAFFIC_CAPTURE_MAX_MB * 1024 * 1024, config.TRAFFIC_CAPTURE_FILES),
+                Anonymizer(config.TRAFFIC_CAPTURE_SALT, keyboard_texts(self.lang.localizations)))
+            self.dp.middleware.setup(self.capture)
         self.dp.middleware.setup(VocabularyBotAntifloodMiddleware(self.lang))
-
+        # In multi-process mode updates are tracked by supervisor
+        self.updates = UpdateTracker(self.db) if self.worker_id is None else None
+        if self.updates is not None:
+            self.dp.middleware.setup(self.updates)
+            if isinstance(self.dp, ChatOrderedDispatcher):
+                self.dp.tracker = self.updates
+
+        self.paginators = pagination.PaginatorSessionCache(pagination.PAGINATORS, self.lang, self.db, self.markup)
         self.callbacks = VocabularyBotCallbackHandler(self.db, self.lang, self.markup, self.analytics, self.dp,
-                                                      self.bot)
+                                                      self.bot, self.paginators)
 
         self.__init_handlers()
+        self.__init_jobs()
 
     def __init_handlers(self):
         """Initializing basic Vocabulary Bot message handlers"""
@@ -75,6 +108,7 @@ class VocabularyBot:
         async def welcome_message_handler(message: types.Message):
             if self.db.is_user_exists(message['from']['id']):
                 user_lang = self.lang.parse_user_lang(message['from']['id'])
+                self.db.set_user_reachable(message['from']['id'])
             else:
                 self.db.add_user(message['from']['id'], message['from']['username'], message['from']['first_name'],
                                  message['from']['last_name'])
@@ -112,14 +146,14 @@ class VocabularyBot:
         @self.analytics.default_metric
         async def quote_command_handler(message: types.Message):
             user_lang = self.lang.parse_user_lang(message['from']['id'])
-            msg_header = f'*{self.lang.get_page_text("QUOTE", "TEXT", user_lang)}*\n\n'
-            author = '\n\n© '
-            response = requests.get(config.QUOTE_API_ENDPOINT, verify=False)
-            if response.status_code == 200:
-                quote = response.json()['quote']['body']
-                author += response.json()['quote']['author']
-                await message.answer(text=msg_header + markdown.italic(quote) + markdown.bold(author),
-                                     parse_mode='Markdown')
+            quote_of_the_day = self.quote.get(user_lang)
+            if quote_of_the_day is not None:
+                quote, quote_translation, author = quote_of_the_day
+                msg = f'*{self.lang.get_page_text("QUOTE", "TEXT", user_lang)}*\n\n' + markdown.italic(quote)
+                if quote_translation is not None:
+                    msg += '\n\n' + markdown.italic(quote_translation)
+                msg += markdown.bold('\n\n© ' + author)
+                await message.answer(text=msg, parse_mode='Markdown')
             else:
                 await message.answer(text=self.lang.get_page_text('QUOTE', 'ERROR', user_lang))
 
@@ -142,9 +176,8 @@ class VocabularyBot:
                 'from_lang': from_lang,
                 'to_lang': to_lang
             }
-            paginator = getattr(pagination, 'dictionary'.capitalize() + 'Paginator')(self.lang, self.db, self.markup,
-                                                                                     message['from']['id'],
-                                                                                     current_page=current_state)
+            paginator = self.paginators.get(pagination.DictionaryPaginator.action, message['from']['id'],
+                                            current_state)
             await message.answer(text=self.lang.get_page_text('DICTIONARY', 'TEXT', user_lang),
                                  reply_markup=self.markup.get_dictionary_markup(user_lang))
             await message.answer(text=paginator.first_page(user_lang), reply_markup=paginator.get_reply_markup())
@@ -283,6 +316,7 @@ class VocabularyBot:
                 to_lang = data['curr_pagination_page']['to_lang']
             if data['confirmation']:
                 self.db.add_user_word(data['word'], data['translation'], message['from']['id'], from_lang, to_lang)
+                self.analytics.trends.add('added', data['word'], from_lang, to_lang)
                 msg = self.lang.get_page_text('ADD_WORD', 'SUCCESSFUL_ADDED', user_lang) + ':\n\n'
                 msg += f"{data['word']} - {data['translation']}"
                 await message.answer(msg, reply_markup=self.markup.get_dictionary_markup(user_lang))
@@ -455,6 +489,7 @@ class VocabularyBot:
                 from_lang = data['curr_pagination_page']['from_lang']
                 to_lang = data['curr_pagination_page']['to_lang']
             query_result = self.db.search_user_word(message['from']['id'], data['search_query'])
+            self.analytics.trends.add('searched', data['search_query'], from_lang, to_lang)
             if len(query_result) > 0:
                 found_word_str = f"[{query_result[5]} - {query_result[6]}] " \
                                  f"{query_result[2]} - {query_result[3]} /word_{query_result[0]}"
@@ -465,7 +500,7 @@ class VocabularyBot:
                 await state.finish()
                 await _send_dictionary_page(message, user_lang, from_lang, to_lang, state)
             else:
-                word_translation = translation.linguee_translate(data['search_query'])
+                word_translation = await translation.translate_word(data['search_query'], from_lang, to_lang)
                 async with state.proxy() as data:
                     data['translation'] = word_translation
                 msg = f"{self.lang.get_page_text('FIND_WORD', 'NOT_FOUND', user_lang)}\n"
@@ -510,10 +545,8 @@ class VocabularyBot:
                     'to_lang': data['curr_pagination_page']['to_lang']
                 }
                 data['curr_pagination_page'] = state_data
-                paginator = getattr(pagination, 'statistics'.capitalize() + 'Paginator')(self.lang, self.db,
-                                                                                         self.markup,
-                                                                                         message['from']['id'],
-                                                                                         current_page=state_data)
+                paginator = self.paginators.get(pagination.StatisticsPaginator.action, message['from']['id'],
+                                                state_data)
             if self.db.get_user_dict_capacity(message['from']['id'], state_data['from_lang'],
                                               state_data['to_lang']) > 0:
                 await message.answer(text=paginator.first_page(user_lang),
@@ -555,14 +588,84 @@ class VocabularyBot:
             logging.getLogger(type(self).__name__).info(f'ECHO [{message["from"]["id"]}] {message.text}')
             await message.answer(text=self.lang.get('ECHO_MESSAGE', user_lang))
 
+    @property
+    def is_main_worker(self) -> bool:
+        return self.worker_id is None or self.worker_id == 0
+
     async def init_commands(self):
         """Init commands and their descriptions"""
         await self.bot.set_my_commands(self.commands)
 
+    def __init_jobs(self):
+        """Register Vocabulary Bot regular jobs"""
+        # Jobs run by every worker keep their state (last run, status) under names of their own
+        worker = f'_{self.worker_id}' if self.worker_id is not None else ''
+        # Quote is kept in memory only, so it is fetched on every start and then checked every 10 minutes
+        self.scheduler.add_interval_job(f'quote_of_the_day{worker}', self.quote.refresh, 10 * 60, jitter=30, timeout=60,
+                                        run_on_start=True)
+
+        async def flush_analytics():
+            self.analytics.flush()
+            self.analytics.save_sketches()
+
+        async def snapshot_trends():
+            self.analytics.trends.snapshot()
+
+        async def decay_trends():
+            self.analytics.trends.decay()
+
+        # Analytics events are buffered by every worker, idle buffers are written by this job
+        self.scheduler.add_interval_job(f'analytics_flush{worker}', flush_analytics, 60, jitter=5, timeout=60)
+        self.scheduler.add_interval_job(f'trends_snapshot{worker}', snapshot_trends, 10 * 60, jitter=30, timeout=60)
+        # Halving counts every day makes trending words reflect the last days rather than all time
+        self.scheduler.add_cron_job(f'trends_decay{worker}', decay_trends, '0 0 * * *', timeout=60)
+        if self.capture is not None:
+            async def flush_capture():
+                self.capture.writer.flush()
+
+            self.scheduler.add_interval_job(f'capture_flush{worker}', flush_capture, 10, timeout=60)
+        if not self.is_main_worker:  # Database maintenance is done by one worker
+            return
+
+        async def rollup_analytics():
+            self.analytics.flush()
+            self.db.rollup_analytics_events()
+
+        async def purge_analytics():
+            now = time.time()
+            self.db.purge_analytics_events(now - config.ANALYTICS_EVENTS_RETENTION_DAYS * 24 * 60 * 60,
+                                           now - config.ANALYTICS_HOURLY_RETENTION_DAYS * 24 * 60 * 60)
+            self.db.purge_hll_sketches(time.strftime('%Y-%m-%d', time.gmtime(now - self.SKETCHES_RETENTION)))
+
+        self.scheduler.add_cron_job('analytics_rollup', rollup_analytics, '*/5 * * * *', jitter=30, timeout=5 * 60)
+        self.scheduler.add_cron_job('analytics_purge', purge_analytics, '15 5 * * *', jitter=5 * 60,
+                                    timeout=10 * 60)
+
+        async def optimize_database():
+            self.db.optimize()
+
+        self.scheduler.add_cron_job('database_optimize', optimize_database, '30 4 * * *', jitter=5 * 60,
+                                    timeout=10 * 60)
+
+        if isinstance(self.dp.storage, SQLiteStorage):
+            async def purge_fsm_states():
+                self.dp.storage.purge_expired()
+
+            self.scheduler.add_cron_job('fsm_states_purge', purge_fsm_states, '0 5 * * *', jitter=5 * 60,
+                                        timeout=10 * 60)
+
     async def run_scheduler(self):
         """Run Vocabulary Bot Task Scheduler for regular jobs."""
-        pass
+        await self.scheduler.run()
 
     async def shutdown(self):
         """Operations for safely bot shutdown"""
+        self.scheduler.stop()
+        self.analytics.flush()
+        self.analytics.save_sketches()
+        self.analytics.trends.snapshot()
+        if self.updates is not None:
+            self.updates.save()
+        if self.capture is not None:
+            self.capture.close()
         self.db.close_connection()
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+# ===== Default imports =====
+
+import argparse
+import asyncio
+from contextlib import asynccontextmanager
+import hmac
+import logging
+import random
+import time
+
+# ===== External libs imports =====
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import ClientSession, web
+
+# ===== Local imports =====
+
+from ordered_dispatcher import ChatOrderedDispatcher
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class UpdateWindow:
+    """Sliding window of recently received update IDs stored as one bitmap relative to the biggest seen ID.
+    Telegram retries deliveries which were not confirmed in time, so repeated IDs must be dropped. After a week
+    without updates Telegram picks the next ID at random, so an ID far below the window starts it again"""
+
+    SIZE = 4096
+
+    def __init__(self, size: int = SIZE):
+        self.size = size
+        self.mask = (1 << size) - 1
+        self.top = None
+        self.bits = 0
+
+    def reset(self, update_id: int) -> None:
+        """Treat every update up to given ID as received (e.g. already processed before restart)"""
+        self.top = update_id
+        self.bits = self.mask
+
+    def seen(self, update_id: int) -> bool:
+        """Record update ID. Returns True if it was already received"""
+        if self.top is None or update_id > self.top:
+            shift = update_id - self.top if self.top is not None else self.size
+            self.bits = ((self.bits << shift) | 1) & self.mask if shift < self.size else 1
+            self.top = update_id
+            return False
+        offset = self.top - update_id
+        if offset >= self.size:
+            logging.getLogger(type(self).__name__).warning(
+                f'Update [{update_id}] is far below the last update [{self.top}], update IDs are started again')
+            self.top = update_id
+            self.bits = 1
+            return False
+        bit = 1 << offset
+        if self.bits & bit:
+            return True
+        self.bits |= bit
+        return False
+
+
+class WebhookServer:
+    """aiohttp server receiving Telegram updates. A request is confirmed only after its update is processed, so
+    Telegram delivers again updates which were in flight when the bot crashed. Count of updates in flight is bounded
+    (Telegram max_connections is set to the same value), one chat can hold only a few of the slots while its updates
+    wait for each other in the chat queue, so a flooding chat doesn't block deliveries to other chats"""
+
+    MAX_IN_FLIGHT = 64
+    MAX_PER_CHAT = 4
+
+    def __init__(self, dispatcher: Dispatcher, path: str = '/webhook', secret_token: str = None,
+                 max_in_flight: int = MAX_IN_FLIGHT, max_per_chat: int = MAX_PER_CHAT):
+        self.dp = dispatcher
+        self.path = path
+        self.secret_token = secret_token
+        self.max_in_flight = max_in_flight
+        self.max_per_chat = max_per_chat
+        self.window = UpdateWindow()
+        self.stats = {'received': 0, 'processed': 0, 'duplicates': 0, 'rejected': 0, 'errors': 0}
+        self.started = time.monotonic()
+        self._semaphore = None
+        self.in_flight = 0
+        self._chat_slots = {}  # chat_id -> [semaphore, requests waiting for or holding it]
+        self._stopped = None
+        self.app = web.Application()
+        self.app.router.add_post(self.path, self.handle_update)
+        self.app.router.add_get('/health', self.handle_health)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token is not None and not hmac.compare_digest(
+                request.headers.get(SECRET_TOKEN_HEADER, ''), self.secret_token):
+            self.stats['rejected'] += 1
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+            update_id = data['update_id']
+        except (ValueError, KeyError, TypeError):
+            self.stats['rejected'] += 1
+            return web.Response(status=400)
+        self.stats['received'] += 1
+        if self.window.seen(update_id):
+            self.stats['duplicates'] += 1
+            return web.Response()
+        update = types.Update(**data)
+        # Wait here when too many updates are in flight, so Telegram slows down deliveries. Extra updates of a chat
+        # wait for their chat slot before taking a shared one
+        async with self._chat_slot(ChatOrderedDispatcher.get_chat_id(update)):
+            async with self._semaphore:
+                self.in_flight += 1
+                try:
+                    await self._process(update)
+                finally:
+                    self.in_flight -= 1
+        return web.Response()
+
+    @asynccontextmanager
+    async def _chat_slot(self, chat_id):
+        if chat_id is None:
+            yield
+            return
+        slot = self._chat_slots.get(chat_id)
+        if slot is None:
+            slot = self._chat_slots[chat_id] = [asyncio.Semaphore(self.max_per_chat), 0]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self._chat_slots[chat_id]
+
+    async def _process(self, update: types.Update) -> None:
+        try:
+            await self.dp.process_updates([update])
+            self.stats['processed'] += 1
+        except Exception:
+            # Confirmed anyway: Telegram would deliver the failing update again and again
+            self.stats['errors'] += 1
+            logging.getLogger(type(self).__name__).exception(f'Update [{update.update_id}] processing failed')
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            'status': 'ok',
+            'uptime': round(time.monotonic() - self.started),
+            'in_flight': self.in_flight,
+            **self.stats
+        })
+
+    async def set_webhook(self, url: str, drop_pending_updates: bool = False) -> None:
+        # aiogram 2.11 Bot.set_webhook doesn't support secret_token yet
+        payload = {'url': url + self.path, 'max_connections': min(self.max_in_flight, 100),
+                   'drop_pending_updates': drop_pending_updates}
+        if self.secret_token is not None:
+            payload['secret_token'] = self.secret_token
+        await self.dp.bot.request('setWebhook', payload)
+        logging.getLogger(type(self).__name__).info(f'Webhook is set to {url + self.path}')
+
+    async def run(self, host: str, port: int) -> None:
+        """Serve updates until stop()"""
+        Dispatcher.set_current(self.dp)
+        Bot.set_current(self.dp.bot)
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._stopped = asyncio.Event()
+        self.started = time.monotonic()
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logging.getLogger(type(self).__name__).info(f'Webhook server is listening on {host}:{port}')
+        try:
+            await self._stopped.wait()
+        finally:
+            await runner.cleanup()  # Waits for requests being processed
+
+    def stop(self) -> None:
+        if self._stopped is not None:
+            self._stopped.set()
+
+
+async def post_fake_updates(url: str, count: int, concurrency: int = 32, duplicates: float = 0.,
+                            secret_token: str = None, users: int = 1000) -> dict:
+    """Post synthetic text message updates to webhook (a part of them twice, like Telegram retries)"""
+    headers = {SECRET_TOKEN_HEADER: secret_token} if secret_token else {}
+    queue = asyncio.Queue()
+    for update_id in range(1, count + 1):
+        queue.put_nowait(update_id)
+        if random.random() < duplicates:
+            queue.put_nowait(update_id)
+    latencies = []
+    statuses = {}
+
+    async def poster(session: ClientSession):
+        while not queue.empty():
+            update_id = queue.get_nowait()
+            user_id = random.randint(1, users)
+            update = {
+                'update_id': update_id,
+                'message': {
+                    'message_id': update_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'language_code': 'en'},
+                    'text': random.choice(('/start', '/help', '/quote', 'apple'))
+                }
+            }
+            start = time.perf_counter()
+            async with session.post(url, json=update, headers=headers) as response:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*[poster(session) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'statuses': statuses,
+        'elapsed': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+        'latency_p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'latency_p99_ms': round(latencies[int(len(latencies) * .99)] * 1000, 2)
+    }
+
+
+async def benchmark(count: int, concurrency: int, duplicates: float, work: float, max_in_flight: int) -> None:
+    """Run webhook server with a stub handler (simulating [work] seconds of processing) and post updates to it"""
+    bot = Bot(token='123456:fake_token_for_benchmark')
+    dp = Dispatcher(bot)
+
+    @dp.message_handler()
+    async def stub_handler(message: types.Message):
+        await asyncio.sleep(work)
+
+    server = WebhookServer(dp, secret_token='benchmark', max_in_flight=max_in_flight)
+    serving = asyncio.ensure_future(server.run('127.0.0.1', 8089))
+    await asyncio.sleep(.1)
+    result = await post_fake_updates('http://127.0.0.1:8089' + server.path, count, concurrency, duplicates,
+                                     secret_token='benchmark')
+    server.stop()
+    await serving
+    await bot.session.close()
+    print(result)
+    print(server.stats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Webhook fake update poster and throughput benchmark')
+    parser.add_argument('mode', choices=('bench', 'post'))
+    parser.add_argument('--url', help='Webhook URL for post mode')
+    parser.add_argument('--secret', help='Webhook secret token')
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duplicates', type=float, default=.05, help='Ratio of repeated updates')
+    parser.add_argument('--work', type=float, default=.01, help='Simulated handler time in seconds (bench mode)')
+    parser.add_argument('--in-flight', type=int, default=WebhookServer.MAX_IN_FLIGHT)
+    args = parser.parse_args()
+    if args.mode == 'bench':
+        asyncio.run(benchmark(args.updates, args.concurrency, args.duplicates, args.work, args.in_flight))
+    else:
+        print(asyncio.run(post_fake_updates(args.url, args.updates, args.concurrency, args.duplicates, args.secret)))